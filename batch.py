@@ -0,0 +1,141 @@
+#Batch runner: simulates a corpus of memory images in parallel, one output directory per case
+import os
+import sys
+import glob
+import shlex
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import isl
+
+#Comparison against the expected file
+COMPARE_TRACE = "trace" #results.txt must match byte for byte
+COMPARE_FINAL = "final" #only the last record (final state) must match
+
+PASS, FAIL, NO_GOLDEN, ERROR = "PASS", "FAIL", "NO-GOLDEN", "ERROR"
+
+#.txt files isl.py / disasm.py write (and the reference listing), never images
+NOT_IMAGES = {"results.txt", "decode_dump.txt", "mem_dump.txt", "mnemonic.txt", "summary.txt", "profile.txt",
+              "cache.txt", "pipeline.txt"}
+
+def find_images(inputs):
+    """
+    Memory images named by the inputs: files, directories (*.txt inside) or
+    glob patterns. Directories and patterns skip the simulator's own output
+    files (NOT_IMAGES); files named outright are kept.
+    """
+    images = []
+    for item in inputs:
+        if os.path.isfile(item):
+            images.append(item)
+            continue
+        found = glob.glob(os.path.join(item, "*.txt")) if os.path.isdir(item) else glob.glob(item)
+        images += sorted(p for p in found if os.path.basename(p) not in NOT_IMAGES)
+    #expected files may sit next to the images, don't run those
+    return [p for p in dict.fromkeys(images) if not p.endswith(".expected.txt")]
+
+def case_name(image):
+    return os.path.splitext(os.path.basename(image))[0]
+
+def golden_path(image, golden_dir=None):
+    """<golden_dir or image dir>/<case>.expected.txt"""
+    return os.path.join(golden_dir or os.path.dirname(image), case_name(image) + ".expected.txt")
+
+def final_record(trace_text):
+    """Last record of a results.txt trace (from its last 'EIP: ' line on)."""
+    pos = trace_text.rfind("EIP: ")
+    return trace_text[pos:].strip() if pos != -1 else ""
+
+def compare(results_path, expected_path, mode):
+    if not os.path.exists(expected_path):
+        return NO_GOLDEN, ""
+    if not os.path.exists(results_path):
+        return ERROR, "no results.txt written (text trace disabled?)"
+    with open(results_path) as f:
+        got = f.read()
+    with open(expected_path) as f:
+        expected = f.read()
+    if mode == COMPARE_FINAL:
+        got, expected = final_record(got), final_record(expected)
+    if got == expected:
+        return PASS, ""
+    got_lines, exp_lines = got.splitlines(), expected.splitlines()
+    for n, (g, e) in enumerate(zip(got_lines, exp_lines), 1):
+        if g != e:
+            return FAIL, f"line {n}: got {g.strip()!r}, expected {e.strip()!r}"
+    return FAIL, f"length differs: {len(got_lines)} lines, expected {len(exp_lines)}"
+
+def run_one(image, case_dir, isl_argv, expected, mode):
+    """Worker: runs one image with stdout captured to case_dir/stdout.txt, then compares."""
+    name = os.path.basename(case_dir)
+    os.makedirs(case_dir, exist_ok=True)
+    args = isl.build_parser().parse_args([image] + isl_argv)
+    start = time.perf_counter()
+    try:
+        with open(os.path.join(case_dir, "stdout.txt"), "w") as out, contextlib.redirect_stdout(out):
+            result = isl.run_case(args, case_dir)
+    except Exception as e:
+        return {"case": name, "status": ERROR, "detail": f"{type(e).__name__}: {e}",
+                "retired": None, "reason": "", "seconds": time.perf_counter() - start}
+    status, detail = compare(os.path.join(case_dir, "results.txt"), expected, mode)
+    return {"case": name, "status": status, "detail": detail, "retired": result["retired"],
+            "reason": result["reason"], "seconds": time.perf_counter() - start}
+
+def write_summary(path, results, wall):
+    counts = {s: sum(r["status"] == s for r in results) for s in (PASS, FAIL, NO_GOLDEN, ERROR)}
+    width = max([len(r["case"]) for r in results] + [4])
+    with open(path, "w") as f:
+        f.write(f"{'case':<{width}}  {'status':<9}  {'instrs':>10}  {'seconds':>8}  detail\n")
+        for r in results:
+            retired = "-" if r["retired"] is None else r["retired"]
+            detail = r["detail"] or r["reason"]
+            f.write(f"{r['case']:<{width}}  {r['status']:<9}  {retired:>10}  {r['seconds']:>8.3f}  {detail}\n")
+        f.write("\n" + "  ".join(f"{s}: {n}" for s, n in counts.items()))
+        f.write(f"  cases: {len(results)}  wall: {wall:.2f}s\n")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="run many memory images through isl.py in parallel")
+    parser.add_argument("inputs", nargs="+", help="memory image files, directories or glob patterns")
+    parser.add_argument("-o", "--out-dir", default="batch_out", help="one subdirectory per case is created here")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--golden-dir", default=None,
+                        help="where <case>.expected.txt files are (default: next to each image)")
+    parser.add_argument("--compare", choices=(COMPARE_TRACE, COMPARE_FINAL), default=COMPARE_TRACE,
+                        help="compare the whole trace (default) or the final state only")
+    parser.add_argument("--isl-args", default="", help="extra isl.py options for every case, e.g. \"--max-instrs 1000\"")
+    args = parser.parse_args()
+
+    images = find_images(args.inputs)
+    if not images:
+        print("No memory images found.")
+        return 1
+    isl_argv = shlex.split(args.isl_args)
+    isl.build_parser().parse_args(["image"] + isl_argv) #reject bad options before starting workers
+    os.makedirs(args.out_dir, exist_ok=True)
+    case_dirs, seen = [], {}
+    for image in images: #images from different directories may share a name
+        name = case_name(image)
+        seen[name] = seen.get(name, 0) + 1
+        case_dirs.append(os.path.join(args.out_dir, name if seen[name] == 1 else f"{name}_{seen[name]}"))
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(run_one, image, case_dir, isl_argv, golden_path(image, args.golden_dir), args.compare)
+                   for image, case_dir in zip(images, case_dirs)]
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            print(f"{r['status']:<9} {r['case']} ({r['seconds']:.3f}s)")
+    wall = time.perf_counter() - start
+
+    results.sort(key=lambda r: r["case"])
+    counts = write_summary(os.path.join(args.out_dir, "summary.txt"), results, wall)
+    print("  ".join(f"{s}: {n}" for s, n in counts.items()) + f"  ({wall:.2f}s, summary in {args.out_dir}/summary.txt)")
+    return 1 if counts[FAIL] or counts[ERROR] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
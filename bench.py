@@ -0,0 +1,404 @@
+#Benchmark suite: synthetic workloads, per-phase timings and JSON results for regression tracking
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from registers import Registers, EAX, ECX, EDX, EBX, EBP, ESI, EDI
+from memory import Memory, load_mem_file
+from decoder import DecodeCache, predecode, decode, MAX_INSTR_LEN
+from trace_writer import TraceWriter, MODE_FULL, MODE_DELTA
+from bintrace import BinaryTraceWriter
+from hooks import Hooks, EV_RETIRED
+import isl
+
+RESULTS_VERSION = 1
+
+#Addressing modes of the README's Part A tables
+MODE_REG = "reg"          #mod 11
+MODE_IND = "ind"          #mod 00, [base]
+MODE_DISP8 = "disp8"      #mod 01, [base + disp8]
+MODE_DISP32 = "disp32"    #mod 10, [base + disp32]
+MODE_ABS = "abs"          #mod 00 rm 101, [disp32]
+MODES = (MODE_REG, MODE_IND, MODE_DISP8, MODE_DISP32, MODE_ABS)
+
+#Instruction kinds and their default weights in the mix
+DEFAULT_MIX = {"add": 6, "mov": 4, "movq": 1, "xchg": 1, "cmpxchg": 1}
+
+#Register roles: ECX counts loop iterations, EBX/ESI/EDI point into the data
+#area; generated instructions only ever write the scratch registers
+SCRATCH32 = (EAX, EDX, EBP)
+SCRATCH8 = (0, 2, 4, 6) #AL, DL, AH, DH
+BASES = (EBX, ESI, EDI)
+
+CODE_BASE = 0x0
+DATA_BASE = 0x8000
+DATA_SIZE = 0x1000
+BLOCK_BYTES = 100 #loop body size, keeps the JNE back edge within rel8
+
+class Workload:
+    """A generated program: its image, the static instruction list and the expected dynamic count."""
+    def __init__(self, code, data, instrs, dynamic, config):
+        self.code = code         #bytes at CODE_BASE
+        self.data = data         #bytes at DATA_BASE
+        self.instrs = instrs     #(eip, bytes) of every instruction in the code
+        self.dynamic = dynamic   #instructions retired by a run to HLT
+        self.config = config
+
+    def image_text(self):
+        """The program in the "0xADDR: bytes" format isl.py loads, 16 bytes per line."""
+        lines = []
+        for base, blob in ((CODE_BASE, self.code), (DATA_BASE, self.data)):
+            for off in range(0, len(blob), 16):
+                lines.append(f"0x{base + off:08X}: {blob[off:off + 16].hex(' ')}\n")
+        return "".join(lines)
+
+    def load(self, mem):
+        mem.write_bytes(CODE_BASE, self.code)
+        mem.write_bytes(DATA_BASE, self.data)
+
+
+def _modrm(r, mode, reg, size):
+    """ModRM (with reg field) plus displacement bytes for an operand in the given addressing mode."""
+    if mode == MODE_REG:
+        rm = r.choice(SCRATCH8 if size == 1 else SCRATCH32)
+        return bytes([0xC0 | reg << 3 | rm])
+    if mode == MODE_ABS:
+        return bytes([0x05 | reg << 3]) + (DATA_BASE + r.randrange(DATA_SIZE - 8)).to_bytes(4, "little")
+    base = r.choice(BASES)
+    if mode == MODE_IND:
+        return bytes([base | reg << 3])
+    if mode == MODE_DISP8:
+        return bytes([0x40 | reg << 3 | base, r.randrange(256)])
+    return bytes([0x80 | reg << 3 | base]) + r.randrange(-0x200, 0x200).to_bytes(4, "little", signed=True)
+
+def _imm(r, size):
+    return r.randrange(1 << 8 * size).to_bytes(size, "little")
+
+def _instruction(r, kind, mode):
+    """One instruction of the given kind using the given addressing mode for its r/m operand."""
+    wide = r.random() < 0.25 #operand size prefix
+    prefix = b"\x66" if wide else b""
+    size = 2 if wide else 4
+    dst32 = r.choice(SCRATCH32)
+    if kind == "add":
+        form = r.randrange(6)
+        if form == 0:
+            return bytes([0x00 if mode != MODE_REG else 0x02]) + _modrm(r, mode, r.choice(SCRATCH8), 1)
+        if form == 1:
+            return prefix + b"\x01" + _modrm(r, mode, dst32, size)
+        if form == 2:
+            return prefix + b"\x03" + _modrm(r, mode, dst32, size)
+        if form == 3:
+            return prefix + b"\x83" + _modrm(r, mode, 0, size) + _imm(r, 1)
+        if form == 4:
+            return prefix + b"\x81" + _modrm(r, mode, 0, size) + _imm(r, size)
+        return b"\x80" + _modrm(r, mode, 0, 1) + _imm(r, 1)
+    if kind == "mov":
+        if mode == MODE_REG: #MOV reg, imm (B0+/B8+)
+            if r.random() < 0.3:
+                return bytes([0xB0 + r.choice(SCRATCH8)]) + _imm(r, 1)
+            return prefix + bytes([0xB8 + dst32]) + _imm(r, size)
+        return prefix + b"\xC7" + _modrm(r, mode, 0, size) + _imm(r, size)
+    if kind == "movq":
+        if mode == MODE_REG:
+            return b"\x0F\x6F" + bytes([0xC0 | r.randrange(8) << 3 | r.randrange(8)])
+        return b"\x0F\x6F" + _modrm(r, mode, r.randrange(8), 8)
+    if kind == "xchg":
+        return b"\x86" + _modrm(r, mode, r.choice(SCRATCH8), 1)
+    if kind == "cmpxchg":
+        return prefix + b"\x0F\xB1" + _modrm(r, mode, dst32, size)
+    raise ValueError(f"unknown instruction kind {kind!r}")
+
+def generate(n_instrs=1000, iterations=100, mix=None, modes=MODES, seed=0):
+    """
+    Builds a program with n_instrs generated instructions split into loops of
+    about BLOCK_BYTES each. Every loop runs 'iterations' times (ECX counts up
+    from -iterations, ADD ECX, 1 / JNE back) and ends in a far JMP to the next
+    loop over a few HLT guard bytes; the last loop falls into HLT. Memory
+    operands cycle through 'modes' and all land in the data area.
+    """
+    r = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds, weights = list(mix), list(mix.values())
+    code = bytearray()
+    instrs = []
+    dynamic = 0
+
+    def emit(raw):
+        instrs.append((CODE_BASE + len(code), bytes(raw)))
+        code.extend(raw)
+
+    for base, off in zip(BASES, (0x200, 0x800, 0xE00)): #MOV base, DATA_BASE + off
+        emit(bytes([0xB8 + base]) + (DATA_BASE + off).to_bytes(4, "little"))
+    dynamic += len(BASES)
+    made = 0
+    mode_no = 0
+    while made < n_instrs:
+        emit(b"\xB9" + (-iterations & 0xFFFFFFFF).to_bytes(4, "little")) #MOV ECX, -iterations
+        top = len(code)
+        body = 0
+        while made < n_instrs and len(code) - top < BLOCK_BYTES:
+            emit(_instruction(r, r.choices(kinds, weights)[0], modes[mode_no % len(modes)]))
+            mode_no += 1
+            made += 1
+            body += 1
+        emit(bytes([0x83, 0xC0 | ECX, 0x01]))                     #ADD ECX, 1
+        emit(bytes([0x75, (top - (len(code) + 2)) & 0xFF]))       #JNE top
+        dynamic += 1 + iterations * (body + 2)
+        if made < n_instrs:
+            target = CODE_BASE + len(code) + 7 + 4 #past the 7 byte JMP and the guard
+            emit(b"\xEA" + target.to_bytes(4, "little") + b"\x00\x00") #JMP far 0:target
+            code.extend(b"\xF4" * 4) #guard: a JMP that falls through halts early
+            dynamic += 1
+    emit(b"\xF4")
+    dynamic += 1
+    data = bytes(r.randrange(256) for _ in range(DATA_SIZE))
+    config = {"instrs": n_instrs, "iterations": iterations, "mix": dict(mix), "modes": list(modes), "seed": seed}
+    return Workload(bytes(code), data, instrs, dynamic, config)
+
+#Phases
+def _best(fn, repeat):
+    """Best wall time of 'repeat' calls and the last return value."""
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _rate(seconds, count, unit):
+    return {"seconds": seconds, "count": count, "rate": count / seconds if seconds > 0 else 0.0, "unit": unit}
+
+def _fresh(work):
+    mem = Memory()
+    work.load(mem)
+    return Registers(), mem
+
+def bench_load(work, tmp, repeat):
+    path = os.path.join(tmp, "bench_image.txt")
+    with open(path, "w") as f:
+        f.write(work.image_text())
+    seconds, loaded = _best(lambda: load_mem_file(Memory(), path), repeat)
+    return _rate(seconds, loaded, "bytes/s")
+
+def bench_predecode(work, repeat):
+    windows = [(eip, raw + bytes(MAX_INSTR_LEN - len(raw))) for eip, raw in work.instrs]
+    def go():
+        cnt = [0]
+        for eip, window in windows:
+            predecode(window, eip, cnt, base_addr=eip)
+    seconds, _ = _best(go, repeat)
+    return _rate(seconds, len(windows), "instr/s")
+
+def bench_decode(work, repeat):
+    """decoder.decode(): linear sweep over the code with DecodeCache entries and bound handlers."""
+    def go():
+        mem = Memory()
+        mem.write_bytes(CODE_BASE, work.code) #the sweep would run on into the data
+        return len(decode(mem, CODE_BASE, DecodeCache(mem)))
+    seconds, n = _best(go, repeat)
+    return _rate(seconds, n, "instr/s")
+
+def _execute(work, translate=False, hooks=None, max_instrs=None):
+    state, mem = _fresh(work)
+    cache = DecodeCache(mem, hooks)
+    if hooks is not None:
+        hooks.attach_memory(mem)
+    start = time.perf_counter()
+    if translate:
+        from translate import Translator
+        retired = Translator(cache).run(state, mem, max_instrs)
+    else:
+        retired = isl.run(state, mem, cache, max_instrs, hooks)
+    elapsed = time.perf_counter() - start
+    if max_instrs is None and (not state.halted or retired != work.dynamic):
+        raise RuntimeError(f"workload retired {retired} instructions, expected {work.dynamic} ending in HLT")
+    return elapsed, retired, state, mem
+
+def bench_execute(work, repeat, translate=False):
+    seconds, retired = None, 0
+    for _ in range(repeat):
+        elapsed, retired, _, _ = _execute(work, translate)
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return _rate(seconds, retired, "instr/s")
+
+def bench_trace(work, tmp, repeat, mode, max_instrs):
+    """
+    Run time with a trace sink attached, minus the untraced run time of the
+    same instructions: the writer's own cost per record.
+    """
+    base, _ = _best(lambda: _execute(work, max_instrs=max_instrs)[0], repeat)
+    def go():
+        hooks = Hooks()
+        if mode == "binary":
+            sink = BinaryTraceWriter(os.path.join(tmp, "bench.trace"))
+        else:
+            sink = TraceWriter(os.path.join(tmp, "bench_results.txt"), mode=mode)
+        hooks.subscribe(EV_RETIRED, sink.retire)
+        elapsed, retired, state, mem = _execute(work, hooks=hooks, max_instrs=max_instrs)
+        start = time.perf_counter()
+        sink.final(state, mem)
+        sink.close()
+        return elapsed + time.perf_counter() - start, sink.records
+    seconds, records = None, 0
+    for _ in range(repeat):
+        elapsed, records = go()
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    cost = max(seconds - base, 0.0)
+    out = _rate(cost, records, "records/s")
+    out["us_per_record"] = cost * 1e6 / records if records else 0.0
+    return out
+
+def bench_memory(work):
+    """Peak Python heap (tracemalloc) of loading, decoding and running the workload."""
+    tracemalloc.start()
+    try:
+        _execute(work)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"peak_bytes": peak, "unit": "bytes"}
+
+def run_suite(work, repeat=3, translate=False, trace_modes=(MODE_FULL, MODE_DELTA, "binary"), trace_instrs=1000):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["load"] = bench_load(work, tmp, repeat)
+        results["predecode"] = bench_predecode(work, repeat)
+        results["decode"] = bench_decode(work, repeat)
+        results["execute"] = bench_execute(work, repeat)
+        if translate:
+            results["execute_translate"] = bench_execute(work, repeat, translate=True)
+        for mode in trace_modes:
+            results[f"trace_{mode}"] = bench_trace(work, tmp, repeat, mode, min(trace_instrs, work.dynamic))
+    results["memory"] = bench_memory(work)
+    return results
+
+#Results files
+def _git_commit():
+    head = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".git", "HEAD")
+    try:
+        with open(head) as f:
+            ref = f.read().strip()
+        if ref.startswith("ref: "):
+            with open(os.path.join(os.path.dirname(head), ref[5:])) as f:
+                return f.read().strip()
+        return ref
+    except OSError:
+        return None
+
+def write_results(path, work, results):
+    doc = {
+        "version": RESULTS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "workload": dict(work.config, static=len(work.instrs), dynamic=work.dynamic),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+        f.write("\n")
+    return doc
+
+def compare(baseline, current, threshold):
+    """
+    (phase, old, new, change, regressed) per phase in both result sets.
+    Rates regress when they drop by more than threshold, peak memory when
+    it grows by more than threshold.
+    """
+    rows = []
+    old_results, new_results = baseline["results"], current["results"]
+    for phase, new in new_results.items():
+        old = old_results.get(phase)
+        if old is None:
+            continue
+        key = "peak_bytes" if "peak_bytes" in new else "rate"
+        if not old.get(key):
+            continue
+        change = new[key] / old[key] - 1.0
+        regressed = change > threshold if key == "peak_bytes" else change < -threshold
+        rows.append((phase, old[key], new[key], change, regressed))
+    return rows
+
+def print_results(results):
+    for phase, r in results.items():
+        if "peak_bytes" in r:
+            print(f"{phase:<18} {r['peak_bytes'] / 1024:>14,.0f} KiB peak")
+        else:
+            extra = f"  ({r['us_per_record']:.1f} us/record)" if "us_per_record" in r else ""
+            print(f"{phase:<18} {r['rate']:>14,.0f} {r['unit']:<10} {r['count']:>10} in {r['seconds']:.3f}s{extra}")
+
+def _parse_mix(text):
+    """"add=6,mov=4" -> {"add": 6, "mov": 4}"""
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = float(weight) if weight else 1.0
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown instruction kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+def _parse_modes(text):
+    modes = tuple(m.strip() for m in text.split(","))
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown addressing modes: {', '.join(sorted(unknown))}")
+    return modes
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the simulator on a generated workload")
+    parser.add_argument("--instrs", type=int, default=1000, help="generated instructions (static count)")
+    parser.add_argument("--iterations", type=int, default=100, help="times each loop runs")
+    parser.add_argument("--mix", type=_parse_mix, default=None,
+                        help=f"instruction kind weights, e.g. add=6,mov=4 (kinds: {', '.join(DEFAULT_MIX)})")
+    parser.add_argument("--modes", type=_parse_modes, default=MODES,
+                        help=f"addressing modes to cycle through (default: {','.join(MODES)})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase, the best one counts")
+    parser.add_argument("--translate", action="store_true", help="also time the block translator")
+    parser.add_argument("--trace-instrs", type=int, default=1000,
+                        help="instructions run with each trace writer attached")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="results JSON file")
+    parser.add_argument("--baseline", metavar="FILE", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown (or memory growth) reported as a regression (default 0.10)")
+    parser.add_argument("--emit", metavar="FILE", help="write the generated image for isl.py and exit")
+    args = parser.parse_args()
+
+    work = generate(args.instrs, args.iterations, args.mix, args.modes, args.seed)
+    if args.emit:
+        with open(args.emit, "w") as f:
+            f.write(work.image_text())
+        print(f"{args.emit}: {len(work.instrs)} instructions, {work.dynamic} retired to HLT")
+        return 0
+
+    print(f"Workload: {len(work.instrs)} instructions, {work.dynamic} retired, seed {args.seed}")
+    results = run_suite(work, args.repeat, args.translate, trace_instrs=args.trace_instrs)
+    print_results(results)
+    doc = write_results(args.output, work, results)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("workload") != doc["workload"]:
+            print("Warning: baseline was measured on a different workload")
+        regressions = 0
+        print(f"\nAgainst {args.baseline} (commit {str(baseline.get('commit'))[:10]}):")
+        for phase, old, new, change, regressed in compare(baseline, doc, args.threshold):
+            regressions += regressed
+            print(f"{phase:<18} {old:>14,.0f} -> {new:>14,.0f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
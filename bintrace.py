@@ -0,0 +1,241 @@
+#Binary trace format: compressed blocks of fixed layout register records plus
+#memory deltas, with a sidecar index so any record can be reached with a seek
+import struct
+import zlib
+import argparse
+
+from registers import Registers, FLAG_NAMES, load_sregs
+from memory import Memory, PAGE_SHIFT
+from trace_writer import TraceSink, TRACE_HEADER, AT_INSTR, format_full
+
+MAGIC = b"ISLT"
+INDEX_MAGIC = b"ISLI"
+VERSION = 1
+
+BLOCK_RECORDS = 256 #records per compressed block
+KEYFRAME_EVERY = 16 #blocks between full memory images
+
+#File layout:
+#  FILE_HEADER
+#  blocks: BLOCK_HEADER + zlib(payload)
+#    payload = [keyframe] records
+#    keyframe = u32 run count, runs of (u32 addr, u32 length, bytes)
+#    record = REG_RECORD + memory runs of (u32 addr, u16 length, bytes)
+#Index (<trace>.idx): INDEX_HEADER, then INDEX_ENTRY per block
+FILE_HEADER = struct.Struct("<4sH")
+BLOCK_HEADER = struct.Struct("<IIIB")   #payload length, compressed length, records, has keyframe
+REG_RECORD = struct.Struct("<QI8I6H8QBH") #step, eip, gpr, sreg, mm, flag bits, memory run count
+MEM_RUN = struct.Struct("<IH")
+KEY_COUNT = struct.Struct("<I")
+KEY_RUN = struct.Struct("<II")
+INDEX_HEADER = struct.Struct("<4sHI")   #magic, version, records per block
+INDEX_ENTRY = struct.Struct("<QQQ")     #first record, block offset, offset of its keyframe block
+
+MAX_RUN = 0xFFFF
+
+def index_path(path):
+    return path + ".idx"
+
+def _runs(addrs):
+    """Groups sorted addresses into (start, length) runs of at most MAX_RUN bytes."""
+    runs = []
+    for addr in addrs:
+        if runs and runs[-1][0] + runs[-1][1] == addr and runs[-1][1] < MAX_RUN:
+            runs[-1][1] += 1
+        else:
+            runs.append([addr, 1])
+    return runs
+
+def _defined_runs(mem):
+    """(addr, bytes) for every run of loaded/written bytes."""
+    out = []
+    for page_no in sorted(mem.pages):
+        page, mask = mem.pages[page_no], mem.defined[page_no]
+        base = page_no << PAGE_SHIFT
+        start = mask.find(1)
+        while start != -1:
+            end = mask.find(0, start)
+            if end == -1:
+                end = len(mask)
+            if out and out[-1][0] + len(out[-1][1]) == base + start:
+                out[-1][1] += page[start:end]
+            else:
+                out.append([base + start, bytearray(page[start:end])])
+            start = mask.find(1, end)
+    return out
+
+
+class BinaryTraceWriter(TraceSink):
+    """
+    Binary trace sink, same granularity options as TraceWriter. Each record
+    holds the register file and the memory bytes written since the previous
+    record (drained from state.modified_mem).
+    """
+    reads_written = True
+
+    def __init__(self, path, at=AT_INSTR, every=1, block_records=BLOCK_RECORDS, keyframe_every=KEYFRAME_EVERY):
+        super().__init__(at, every)
+        self.path = path
+        self.block_records = block_records
+        self.keyframe_every = keyframe_every
+        self.f = open(path, "wb")
+        self.f.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.index = []     #INDEX_ENTRY tuples
+        self.payload = []   #pieces of the block being filled
+        self.in_block = 0   #records in the current block
+        self.key_offset = 0 #file offset of the last keyframe block
+
+    def record(self, state, mem):
+        self.stale = False
+        if self.in_block == 0:
+            self._open_block(mem)
+        flags = state.flags
+        flag_bits = 0
+        for i, name in enumerate(FLAG_NAMES):
+            if flags[name]:
+                flag_bits |= 1 << i
+        written = state.modified_mem
+        runs = _runs(sorted(written)) if written else ()
+        written.clear()
+        payload = self.payload
+        payload.append(REG_RECORD.pack(self.retired, state.eip, *state.gpr, *state.sreg, *state.mm, flag_bits, len(runs)))
+        for addr, length in runs:
+            payload.append(MEM_RUN.pack(addr, length))
+            payload.append(mem.read_bytes(addr, length))
+        self.records += 1
+        self.in_block += 1
+        if self.in_block == self.block_records:
+            self._flush_block()
+
+    def _open_block(self, mem):
+        offset = self.f.tell()
+        keyframe = len(self.index) % self.keyframe_every == 0
+        if keyframe:
+            self.key_offset = offset
+            runs = _defined_runs(mem)
+            self.payload.append(KEY_COUNT.pack(len(runs)))
+            for addr, data in runs:
+                self.payload.append(KEY_RUN.pack(addr, len(data)))
+                self.payload.append(bytes(data))
+        self.keyframe = keyframe
+        self.index.append((self.records, offset, self.key_offset))
+
+    def _flush_block(self):
+        raw = b"".join(self.payload)
+        packed = zlib.compress(raw)
+        self.f.write(BLOCK_HEADER.pack(len(raw), len(packed), self.in_block, self.keyframe))
+        self.f.write(packed)
+        self.payload = []
+        self.in_block = 0
+
+    def close(self):
+        if self.in_block:
+            self._flush_block()
+        self.f.close()
+        with open(index_path(self.path), "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION, self.block_records))
+            for entry in self.index:
+                f.write(INDEX_ENTRY.pack(*entry))
+
+
+class BinaryTrace:
+    """
+    Reader. len(trace) is the number of records; states(start, stop) replays
+    records start..stop-1 into a Registers/Memory pair, seeking straight to
+    the keyframe block in front of 'start'.
+    """
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        magic, version = FILE_HEADER.unpack(self.f.read(FILE_HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} binary trace")
+        with open(index_path(path), "rb") as f:
+            data = f.read()
+        magic, version, self.block_records = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != VERSION:
+            raise ValueError(f"{index_path(path)}: not a version {VERSION} trace index")
+        self.index = list(INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:]))
+        self.n_records = 0
+        if self.index:
+            last_first, last_offset, _ = self.index[-1]
+            self.n_records = last_first + self._read_block(last_offset)[0]
+
+    def __len__(self):
+        return self.n_records
+
+    def _read_block(self, offset):
+        """(record count, has keyframe, payload) of the block at offset."""
+        self.f.seek(offset)
+        raw_len, comp_len, n, keyframe = BLOCK_HEADER.unpack(self.f.read(BLOCK_HEADER.size))
+        return n, keyframe, zlib.decompress(self.f.read(comp_len))
+
+    def states(self, start=0, stop=None):
+        """Yields (record number, step, state, mem) for records start..stop-1. state/mem are reused."""
+        if stop is None or stop > self.n_records:
+            stop = self.n_records
+        if start >= stop:
+            return
+        block = start // self.block_records
+        key_offset = self.index[block][2]
+        state, mem = Registers(), Memory()
+        b = block
+        while self.index[b][1] != key_offset:
+            b -= 1
+        while b < len(self.index):
+            first, offset, _ = self.index[b]
+            n, keyframe, payload = self._read_block(offset)
+            pos = 0
+            if keyframe:
+                mem = Memory()
+                (count,) = KEY_COUNT.unpack_from(payload, pos)
+                pos += KEY_COUNT.size
+                for _ in range(count):
+                    addr, length = KEY_RUN.unpack_from(payload, pos)
+                    pos += KEY_RUN.size
+                    mem.write_bytes(addr, payload[pos:pos + length])
+                    pos += length
+            for k in range(first, first + n):
+                if k >= stop:
+                    return
+                fields = REG_RECORD.unpack_from(payload, pos)
+                pos += REG_RECORD.size
+                step, state.eip = fields[0], fields[1]
+                state.gpr[:] = fields[2:10]
+                load_sregs(state, fields[10:16])
+                state.mm[:] = fields[16:24]
+                flag_bits = fields[24]
+                state.flags.restore(({name: (flag_bits >> i) & 1 for i, name in enumerate(FLAG_NAMES)}, None, 0, 0, 0, 4))
+                for _ in range(fields[25]):
+                    addr, length = MEM_RUN.unpack_from(payload, pos)
+                    pos += MEM_RUN.size
+                    mem.write_bytes(addr, payload[pos:pos + length])
+                    pos += length
+                if k >= start:
+                    yield k, step, state, mem
+            b += 1
+
+    def close(self):
+        self.f.close()
+
+
+def render(path, out, start=0, stop=None):
+    """Writes records start..stop-1 of a binary trace in the results.txt layout."""
+    trace = BinaryTrace(path)
+    cache = {}
+    with open(out, "w") as f:
+        f.write(TRACE_HEADER)
+        for _, _, state, mem in trace.states(start, stop):
+            f.write(format_full(state, mem, cache))
+    trace.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="render a binary trace in the results.txt layout")
+    parser.add_argument("trace", help="binary trace written by isl.py --trace-mode binary")
+    parser.add_argument("-o", "--output", default="results.txt")
+    parser.add_argument("--start", type=int, default=0, help="first record to render")
+    parser.add_argument("--stop", type=int, default=None, help="record to stop before (default: end)")
+    args = parser.parse_args()
+    render(args.trace, args.output, args.start, args.stop)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#Cache hierarchy model fed by instruction fetches and guest data accesses
+import random
+from collections import defaultdict
+
+from hooks import EV_MEM_READ, EV_MEM_WRITE, EV_RETIRED
+from execute import CMPXCHG_OPCODE
+
+POLICIES = ("lru", "plru", "random")
+WRITE_BACK = "wb"     #write-back, write-allocate
+WRITE_THROUGH = "wt"  #write-through, no write-allocate
+WRITE_POLICIES = (WRITE_BACK, WRITE_THROUGH)
+
+#Default geometry: size:assoc:line[:policy[:write policy]]
+DEFAULT_L1I = "32k:8:64:lru"
+DEFAULT_L1D = "32k:8:64:lru:wb"
+DEFAULT_L2 = "256k:8:64:lru:wb"
+
+#Latencies in cycles for the memory-boundedness estimate
+DEFAULT_LATENCY = {"L1I": 1, "L1D": 4, "L2": 12, "memory": 200}
+
+def _is_pow2(n):
+    return n > 0 and n & (n - 1) == 0
+
+def _size(n):
+    """Cache size for the report: 32K, 1M, or bytes below 1 KiB."""
+    if n >= 1 << 20 and not n & ((1 << 20) - 1):
+        return f"{n >> 20}M"
+    if n >= 1 << 10 and not n & ((1 << 10) - 1):
+        return f"{n >> 10}K"
+    return f"{n}B"
+
+def parse_spec(spec):
+    """'32k:8:64:plru:wb' -> dict(size, assoc, line, policy, write)"""
+    parts = spec.lower().split(":")
+    if not 3 <= len(parts) <= 5:
+        raise ValueError(f"cache spec {spec!r}: expected size:assoc:line[:policy[:wb|wt]]")
+    size = parts[0]
+    scale = {"k": 1 << 10, "m": 1 << 20}.get(size[-1:], 1)
+    size = int(size.rstrip("km")) * scale
+    out = {"size": size, "assoc": int(parts[1]), "line": int(parts[2]),
+           "policy": parts[3] if len(parts) > 3 else "lru",
+           "write": parts[4] if len(parts) > 4 else WRITE_BACK}
+    if out["policy"] not in POLICIES:
+        raise ValueError(f"cache spec {spec!r}: policy must be one of {', '.join(POLICIES)}")
+    if out["write"] not in WRITE_POLICIES:
+        raise ValueError(f"cache spec {spec!r}: write policy must be wb or wt")
+    return out
+
+
+class Cache:
+    """
+    One set associative level. Lines are tracked by line number (addr >> line
+    bits); 'where' maps a resident line to its way so hits are a dict lookup.
+    Misses, and dirty evictions under write-back, go to next_level (another
+    Cache, or None for memory).
+    """
+    def __init__(self, name, size, assoc, line, policy="lru", write=WRITE_BACK, next_level=None, seed=0):
+        n_sets = size // (assoc * line)
+        if not (_is_pow2(line) and _is_pow2(n_sets)) or n_sets * assoc * line != size:
+            raise ValueError(f"{name}: size/assoc/line must give a power of two number of sets")
+        if policy == "plru" and not _is_pow2(assoc):
+            raise ValueError(f"{name}: plru needs a power of two associativity")
+        self.name = name
+        self.size, self.assoc, self.line, self.policy, self.write = size, assoc, line, policy, write
+        self.line_bits = line.bit_length() - 1
+        self.set_mask = n_sets - 1
+        self.next_level = next_level
+        self.ways = [[None] * assoc for _ in range(n_sets)] #line number per way, None = invalid
+        self.where = {}      #resident line -> way
+        self.dirty = set()
+        self.stamp = [[0] * assoc for _ in range(n_sets)] #lru: last use per way
+        self.tick = 0
+        self.plru = [0] * n_sets #tree bits per set
+        self.rng = random.Random(seed)
+        self.accesses = self.writes = self.misses = self.evictions = self.writebacks = 0 #hits/reads are derived
+        self.memory_accesses = 0 #for the last level: line transfers to/from memory
+        self.access_eips = defaultdict(int) #per EIP counts; hits are accesses - misses
+        self.miss_eips = defaultdict(int)
+        self.evict_eips = defaultdict(int)  #evictions caused by the EIP's line fills
+        self.eip = 0 #instruction the current accesses belong to, set by CacheHierarchy
+
+    def access(self, addr, size, write=False):
+        """Every line of [addr, addr + size) is looked up."""
+        bits = self.line_bits
+        first, last = addr >> bits, (addr + size - 1) >> bits
+        self._line(first, write)
+        while first != last: #crosses a line boundary
+            first += 1
+            self._line(first, write)
+
+    def _line(self, line, write):
+        self.accesses += 1
+        self.access_eips[self.eip] += 1
+        if write:
+            self.writes += 1
+        way = self.where.get(line)
+        s = line & self.set_mask
+        if way is not None:
+            if self.policy == "lru": #inlined _touch, the common case
+                self.tick += 1
+                self.stamp[s][way] = self.tick
+            else:
+                self._touch(s, way)
+            if write:
+                if self.write == WRITE_BACK:
+                    self.dirty.add(line)
+                else:
+                    self._below(line, True)
+            return
+        self.misses += 1
+        self.miss_eips[self.eip] += 1
+        if write and self.write == WRITE_THROUGH: #no write-allocate
+            self._below(line, True)
+            return
+        self._below(line, False) #line fill
+        way = self._victim(s)
+        old = self.ways[s][way]
+        if old is not None:
+            self.evictions += 1
+            self.evict_eips[self.eip] += 1
+            del self.where[old]
+            if old in self.dirty:
+                self.dirty.discard(old)
+                self.writebacks += 1
+                self._below(old, True)
+        self.ways[s][way] = line
+        self.where[line] = way
+        self._touch(s, way)
+        if write:
+            self.dirty.add(line)
+
+    def _below(self, line, write):
+        nxt = self.next_level
+        if nxt is None:
+            self.memory_accesses += 1
+        else:
+            nxt.eip = self.eip
+            nxt.access(line << self.line_bits, self.line, write)
+
+    def _touch(self, s, way):
+        if self.policy == "lru":
+            self.tick += 1
+            self.stamp[s][way] = self.tick
+        elif self.policy == "plru": #point every node on the path away from this way
+            bits = self.plru[s]
+            node = 1
+            span = self.assoc
+            while span > 1:
+                span >>= 1
+                right = way & span
+                if right:
+                    bits &= ~(1 << node)
+                else:
+                    bits |= 1 << node
+                node = node * 2 + (1 if right else 0)
+            self.plru[s] = bits
+
+    def _victim(self, s):
+        ways = self.ways[s]
+        if None in ways:
+            return ways.index(None)
+        if self.policy == "lru":
+            stamps = self.stamp[s]
+            return stamps.index(min(stamps))
+        if self.policy == "plru": #follow the tree bits: set = go right
+            bits = self.plru[s]
+            node, way, span = 1, 0, self.assoc
+            while span > 1:
+                span >>= 1
+                if bits >> node & 1:
+                    way |= span
+                    node = node * 2 + 1
+                else:
+                    node = node * 2
+            return way
+        return self.rng.randrange(self.assoc)
+
+    def eip_stats(self, eip):
+        accesses, misses = self.access_eips.get(eip, 0), self.miss_eips.get(eip, 0)
+        return {"accesses": accesses, "hits": accesses - misses, "misses": misses,
+                "miss_rate": misses / accesses if accesses else 0.0, "evictions": self.evict_eips.get(eip, 0)}
+
+    def stats(self):
+        return {"accesses": self.accesses, "hits": self.accesses - self.misses, "misses": self.misses,
+                "miss_rate": self.misses / self.accesses if self.accesses else 0.0,
+                "reads": self.accesses - self.writes, "writes": self.writes,
+                "evictions": self.evictions, "writebacks": self.writebacks}
+
+
+class CacheHierarchy:
+    """
+    L1I and L1D over an optional shared L2. attach(hooks) feeds it: every
+    retired instruction fetches its bytes through L1I, then its data reads and
+    writes (mem_read/mem_write events) go through L1D in program order. ADD
+    r/m therefore shows up as a read and a write of the same line. A locked
+    CMPXCHG to memory always writes, also when the compare fails.
+    """
+    def __init__(self, l1i=DEFAULT_L1I, l1d=DEFAULT_L1D, l2=DEFAULT_L2, latency=None, seed=0):
+        self.l2 = Cache("L2", next_level=None, seed=seed, **parse_spec(l2)) if l2 else None
+        self.l1i = Cache("L1I", next_level=self.l2, seed=seed, **parse_spec(l1i))
+        self.l1d = Cache("L1D", next_level=self.l2, seed=seed, **parse_spec(l1d))
+        self.levels = [c for c in (self.l1i, self.l1d, self.l2) if c is not None]
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.pending = [] #(addr, size, write) of the executing instruction
+        self.instructions = 0
+        self.l2_misses_after_fetch = 0 #L2 miss count between the fetch and the data accesses
+
+    def attach(self, hooks):
+        hooks.subscribe(EV_MEM_READ, self.on_read)
+        hooks.subscribe(EV_MEM_WRITE, self.on_write)
+        hooks.subscribe(EV_RETIRED, self.on_retired)
+
+    def detach(self, hooks):
+        hooks.unsubscribe(EV_MEM_READ, self.on_read)
+        hooks.unsubscribe(EV_MEM_WRITE, self.on_write)
+        hooks.unsubscribe(EV_RETIRED, self.on_retired)
+
+    def on_read(self, addr, size, val):
+        self.pending.append((addr, size, False))
+
+    def on_write(self, addr, size, val):
+        self.pending.append((addr, size, True))
+
+    def on_retired(self, state, mem, instr):
+        self.instructions += 1
+        eip = instr.eip
+        l1i, l1d = self.l1i, self.l1d
+        l1i.eip = l1d.eip = eip
+        l1i.access(eip, instr.instr_len)
+        if self.l2 is not None:
+            self.l2_misses_after_fetch = self.l2.misses
+        pending = self.pending
+        if not pending:
+            return
+        for addr, size, write in pending:
+            l1d.access(addr, size, write)
+        if len(pending) == 1 and instr.ext_opcode and instr.opcode == CMPXCHG_OPCODE:
+            addr, size, _ = pending[0]
+            l1d.access(addr, size, True) #failed compare: the locked cycle still writes
+        pending.clear()
+
+    #Results
+    def estimate(self):
+        """Cycle estimate from the hit/miss counts and self.latency (no overlap)."""
+        lat = self.latency
+        cycles = self.l1i.accesses * lat["L1I"] + self.l1d.accesses * lat["L1D"]
+        if self.l2 is not None:
+            cycles += self.l2.accesses * lat["L2"]
+            memory = self.l2.memory_accesses
+        else:
+            memory = self.l1i.memory_accesses + self.l1d.memory_accesses
+        cycles += memory * lat["memory"]
+        n = self.instructions or 1
+        return {"instructions": self.instructions, "memory_cycles": cycles,
+                "memory_cycles_per_instr": cycles / n, "memory_transfers": memory}
+
+    def write_report(self, path, top=20):
+        with open(path, "w") as f:
+            f.write(f"Instructions: {self.instructions}\n\n")
+            f.write(f"{'level':<5} {'geometry':<24} {'accesses':>12} {'hits':>12} {'misses':>10} {'miss %':>7} "
+                    f"{'evictions':>10} {'writebacks':>10}\n")
+            for c in self.levels:
+                s = c.stats()
+                geometry = f"{_size(c.size)} {c.assoc}-way {c.line}B {c.policy} {c.write}"
+                f.write(f"{c.name:<5} {geometry:<24} {s['accesses']:>12} {s['hits']:>12} {s['misses']:>10} "
+                        f"{100 * s['miss_rate']:>7.2f} {s['evictions']:>10} {s['writebacks']:>10}\n")
+            est = self.estimate()
+            lat = ", ".join(f"{k} {v}" for k, v in self.latency.items())
+            f.write(f"\nMemory transfers: {est['memory_transfers']}\n")
+            f.write(f"Estimated memory cycles: {est['memory_cycles']} "
+                    f"({est['memory_cycles_per_instr']:.2f} per instruction; latencies: {lat})\n")
+
+            eips = set()
+            for c in self.levels: #every EIP that accessed a level, also the ones that always hit
+                eips.update(c.access_eips)
+            rows = sorted(eips, key=lambda e: (-sum(c.miss_eips.get(e, 0) for c in self.levels),
+                                               -sum(c.access_eips.get(e, 0) for c in self.levels), e))[:top]
+            f.write(f"\nPer EIP, most misses first (top {top})\n")
+            f.write(f"{'':<10}" + "".join(f" | {c.name:<37}" for c in self.levels).rstrip() + "\n")
+            f.write(f"{'eip':<10}" + f" | {'accesses':>8} {'hits':>8} {'misses':>6} {'miss %':>6} {'evict':>6}"
+                    * len(self.levels) + "\n")
+            for eip in rows:
+                cells = []
+                for c in self.levels:
+                    s = c.eip_stats(eip)
+                    cells.append(f" | {s['accesses']:>8} {s['hits']:>8} {s['misses']:>6} {100 * s['miss_rate']:>6.2f} "
+                                 f"{s['evictions']:>6}")
+                f.write(f"0x{eip:08X}" + "".join(cells) + "\n")
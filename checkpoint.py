@@ -0,0 +1,103 @@
+#Machine state checkpoints: registers plus the non-empty memory pages
+import os
+import mmap
+import struct
+import tempfile
+
+from registers import Registers, FLAG_NAMES, load_sregs
+from memory import Memory, PAGE_SIZE
+
+MAGIC = b"ISLK"
+VERSION = 1
+
+#File layout:
+#  HEADER, REGS
+#  page table: PAGE_ENTRY per saved page (page number + defined mask as a bitmap)
+#  zero padding up to a PAGE_SIZE boundary
+#  page contents, PAGE_SIZE bytes each, in page table order
+#Page contents are page aligned so a restore can map them straight from the file.
+HEADER = struct.Struct("<4sHHI")       #magic, version, reserved, saved page count
+REGS = struct.Struct("<I8I6H8QBB")     #eip, gpr, sreg, mm, flag bits, halted
+PAGE_ENTRY = struct.Struct(f"<I{PAGE_SIZE // 8}s")
+
+_EXPAND = [bytes((b >> i) & 1 for i in range(8)) for b in range(256)] #bitmap byte -> 8 mask bytes
+
+def _bitmap(mask):
+    """Defined mask (one byte per address) -> bitmap, bit i of byte k = address 8k+i."""
+    return bytes(sum(b << i for i, b in enumerate(mask[k:k + 8])) for k in range(0, len(mask), 8))
+
+def _unbitmap(bitmap):
+    return bytearray(b"".join(_EXPAND[b] for b in bitmap))
+
+def save_checkpoint(path, state, mem):
+    """
+    Writes state and every page with non-zero or defined bytes to path. The
+    file is written under a temporary name and then renamed over path, as
+    mem's pages may still be views of a checkpoint mapped from path itself.
+    """
+    saved = [p for p in sorted(mem.pages) if any(mem.pages[p]) or any(mem.defined[p])]
+    flags = state.flags
+    flag_bits = 0
+    for i, name in enumerate(FLAG_NAMES):
+        if flags[name]:
+            flag_bits |= 1 << i
+    fd, tmp = tempfile.mkstemp(prefix=".ckpt-", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            _write_checkpoint(f, state, mem, saved, flag_bits)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _write_checkpoint(f, state, mem, saved, flag_bits):
+    f.write(HEADER.pack(MAGIC, VERSION, 0, len(saved)))
+    f.write(REGS.pack(state.eip & 0xFFFFFFFF, *state.gpr, *state.sreg, *state.mm, flag_bits, int(state.halted)))
+    for page_no in saved:
+        f.write(PAGE_ENTRY.pack(page_no, _bitmap(mem.defined[page_no])))
+    f.write(bytes(-f.tell() % PAGE_SIZE))
+    for page_no in saved:
+        f.write(mem.pages[page_no])
+
+def load_checkpoint(path, state=None, mem=None, mapped=True):
+    """
+    Restores a checkpoint into state/mem (fresh ones if not given) and returns
+    them. With mapped=True the page contents stay in a private copy-on-write
+    mapping of the file, so only the pages the run touches are ever copied.
+    """
+    state = state if state is not None else Registers()
+    mem = mem if mem is not None else Memory()
+    with open(path, "rb") as f:
+        magic, version, _, n_pages = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a version {VERSION} checkpoint")
+        fields = REGS.unpack(f.read(REGS.size))
+        table = [PAGE_ENTRY.unpack(f.read(PAGE_ENTRY.size)) for _ in range(n_pages)]
+        data_start = f.tell() + (-f.tell() % PAGE_SIZE)
+        mapped = mapped and n_pages > 0
+        if mapped:
+            image = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+            mem.backing = image
+        else:
+            f.seek(data_start)
+            image = f.read(n_pages * PAGE_SIZE)
+            data_start = 0
+
+    state.eip = fields[0]
+    state.gpr[:] = fields[1:9]
+    load_sregs(state, fields[9:15])
+    state.mm[:] = fields[15:23]
+    flag_bits = fields[23]
+    state.flags.restore(({name: (flag_bits >> i) & 1 for i, name in enumerate(FLAG_NAMES)}, None, 0, 0, 0, 4))
+    state.halted = bool(fields[24])
+
+    mem.pages.clear()
+    mem.defined.clear()
+    for k, (page_no, bitmap) in enumerate(table):
+        off = data_start + k * PAGE_SIZE
+        if mapped:
+            mem.pages[page_no] = image[off:off + PAGE_SIZE]
+        else:
+            mem.pages[page_no] = bytearray(image[off:off + PAGE_SIZE])
+        mem.defined[page_no] = _unbitmap(bitmap)
+    return state, mem
@@ -0,0 +1,454 @@
+#Breakpoints, watchpoints and stepping on top of Simulator (and TimeTravel)
+#
+#    dbg = Debugger(sim)
+#    dbg.break_at(0x1C, "ecx == 0")
+#    dbg.watch(0x2000, 4, "w")
+#    stop = dbg.cont(); print(stop)
+#    dbg.step(); dbg.next()
+#
+#    python3 debugger.py mem.txt [--reverse]      #interactive, 'help' lists the commands
+import cmd
+import shlex
+import argparse
+
+from hooks import EV_MEM_READ, EV_MEM_WRITE
+from memory import PAGE_SHIFT, ADDR_MASK
+from simulator import Simulator
+from registers import FLAG_NAMES
+from decoder import DecodeError
+
+#Watchpoint access kinds
+WATCH_READ = "r"
+WATCH_WRITE = "w"
+WATCH_ACCESS = "rw"
+
+def _spans(addr, size):
+    """[addr, addr + size) in the 32-bit address space as non-wrapping (start, end) pieces."""
+    addr &= ADDR_MASK
+    end = addr + size
+    if end <= ADDR_MASK + 1:
+        return ((addr, end),)
+    return ((addr, ADDR_MASK + 1), (0, end - ADDR_MASK - 1))
+
+class Breakpoint:
+    """Stop before the instruction at eip, when condition (callable(sim) or expression) holds."""
+    __slots__ = ("id", "eip", "condition", "code", "hits", "enabled")
+
+    def __init__(self, point_id, eip, condition=None):
+        self.id = point_id
+        self.eip = eip
+        self.condition = condition
+        self.code = compile(condition, "<condition>", "eval") if isinstance(condition, str) else None
+        self.hits = 0
+        self.enabled = True
+
+    def holds(self, sim):
+        if self.condition is None:
+            return True
+        if self.code is not None:
+            return bool(eval(self.code, {"__builtins__": {}}, RegisterNames(sim)))
+        return bool(self.condition(sim))
+
+    def __str__(self):
+        cond = f" if {self.condition}" if isinstance(self.condition, str) else (" if <fn>" if self.condition else "")
+        return f"#{self.id} break 0x{self.eip:08X}{cond}  hits {self.hits}{'' if self.enabled else '  (disabled)'}"
+
+
+class Watchpoint:
+    """
+    Stop after an instruction that reads and/or writes [start, end). A range
+    running past 0xFFFFFFFF wraps to address 0, like guest accesses do.
+    """
+    __slots__ = ("id", "start", "end", "spans", "access", "hits", "enabled")
+
+    def __init__(self, point_id, start, size, access=WATCH_WRITE):
+        if access not in (WATCH_READ, WATCH_WRITE, WATCH_ACCESS):
+            raise ValueError(f"watchpoint access must be r, w or rw, not {access!r}")
+        if not 1 <= size <= ADDR_MASK + 1:
+            raise ValueError("watchpoint size must be between 1 and 4G")
+        self.id = point_id
+        self.start = start & ADDR_MASK
+        self.end = (self.start + size) & ADDR_MASK
+        self.spans = _spans(self.start, size)
+        self.access = access
+        self.hits = 0
+        self.enabled = True
+
+    def pages(self):
+        for start, end in self.spans:
+            yield from range(start >> PAGE_SHIFT, ((end - 1) >> PAGE_SHIFT) + 1)
+
+    def overlaps(self, addr, size):
+        return any(a < e and s < b for a, b in _spans(addr, size) for s, e in self.spans)
+
+    def __str__(self):
+        return (f"#{self.id} watch {self.access:<2} 0x{self.start:08X}..0x{(self.end - 1) & ADDR_MASK:08X}  hits {self.hits}"
+                f"{'' if self.enabled else '  (disabled)'}")
+
+
+class Stop:
+    """Why a run command returned: reason is breakpoint, watchpoint, step, halt or limit."""
+    __slots__ = ("reason", "retired", "eip", "point", "access")
+
+    def __init__(self, reason, retired, eip, point=None, access=None):
+        self.reason = reason
+        self.retired = retired #instructions executed by the command
+        self.eip = eip
+        self.point = point     #the Breakpoint / Watchpoint hit
+        self.access = access   #(kind, addr, size, value) of a watchpoint hit
+
+    def __str__(self):
+        text = f"{self.reason} at 0x{self.eip:08X} after {self.retired} instructions"
+        if self.point is not None:
+            text += f" ({self.point})"
+        if self.access is not None:
+            kind, addr, size, val = self.access
+            text += f"\n  {'read' if kind == WATCH_READ else 'write'} of {size} bytes at 0x{addr:08X}: 0x{val:X}"
+        return text
+
+
+class RegisterNames(dict):
+    """eval() namespace for conditions: register and flag names read from the machine on use."""
+    def __init__(self, sim):
+        super().__init__()
+        self.sim = sim
+
+    def __missing__(self, name):
+        if name in FLAG_NAMES:
+            return self.sim.state.flags[name]
+        try:
+            return self.sim.reg(name)
+        except KeyError:
+            raise NameError(f"unknown name {name!r} in breakpoint condition") from None
+
+
+class Debugger:
+    """
+    EIP breakpoints and memory watchpoints for a Simulator. With no points
+    set cont() is Simulator.run(), and the memory hooks are only subscribed
+    while a watchpoint of that kind exists. Watchpoints are indexed by page
+    number, so an access to an unwatched page costs one dict lookup. A
+    watchpoint hit stops after the accessing instruction completes.
+    Given a TimeTravel, execution is recorded and reverse_step() /
+    reverse_cont() work too (they stop at breakpoints, not watchpoints).
+    """
+    def __init__(self, sim, timetravel=None):
+        self.sim = sim
+        self.tt = timetravel
+        self.points = {}      #id -> Breakpoint / Watchpoint
+        self.breakpoints = {} #eip -> [Breakpoint]
+        self.read_pages = {}  #page number -> [Watchpoint] with read access
+        self.write_pages = {} #page number -> [Watchpoint] with write access
+        self.next_id = 1
+        self._hit = None      #(watchpoint, access) seen during the current instruction
+
+    #Points
+    def break_at(self, eip, condition=None):
+        """Adds a breakpoint; condition is an expression over register/flag names or a callable(sim)."""
+        bp = Breakpoint(self.next_id, eip & 0xFFFFFFFF, condition)
+        self._add(bp)
+        self.breakpoints.setdefault(bp.eip, []).append(bp)
+        return bp
+
+    def watch(self, addr, size=1, access=WATCH_WRITE):
+        """Adds a watchpoint on [addr, addr + size) for r, w or rw accesses."""
+        wp = Watchpoint(self.next_id, addr, size, access)
+        self._add(wp)
+        for index, kind, event, fn in self._indexes(wp):
+            if not index:
+                self.sim.hooks.subscribe(event, fn)
+            for page_no in wp.pages():
+                index.setdefault(page_no, []).append(wp)
+        return wp
+
+    def _add(self, point):
+        self.points[point.id] = point
+        self.next_id += 1
+
+    def _indexes(self, wp):
+        if WATCH_READ in wp.access:
+            yield self.read_pages, WATCH_READ, EV_MEM_READ, self._on_read
+        if WATCH_WRITE in wp.access:
+            yield self.write_pages, WATCH_WRITE, EV_MEM_WRITE, self._on_write
+
+    def delete(self, point_id):
+        point = self.points.pop(point_id)
+        if isinstance(point, Breakpoint):
+            bps = self.breakpoints[point.eip]
+            bps.remove(point)
+            if not bps:
+                del self.breakpoints[point.eip]
+            return
+        for index, kind, event, fn in self._indexes(point):
+            for page_no in point.pages():
+                wps = index[page_no]
+                wps.remove(point)
+                if not wps:
+                    del index[page_no]
+            if not index:
+                self.sim.hooks.unsubscribe(event, fn)
+
+    def clear(self):
+        for point_id in list(self.points):
+            self.delete(point_id)
+
+    #Watchpoint checks (mem_read / mem_write subscribers)
+    def _check(self, index, kind, addr, size, val):
+        """Slow path, for accesses to a watched page."""
+        first, last = addr >> PAGE_SHIFT, ((addr + size - 1) & ADDR_MASK) >> PAGE_SHIFT
+        wps = index.get(first, [])
+        if last != first:
+            wps = wps + index.get(last, [])
+        for wp in wps:
+            if wp.enabled and self._hit is None and wp.overlaps(addr, size):
+                wp.hits += 1
+                self._hit = (wp, (kind, addr, size, val))
+
+    def _on_read(self, addr, size, val):
+        addr &= ADDR_MASK
+        pages = self.read_pages
+        if addr >> PAGE_SHIFT in pages or ((addr + size - 1) & ADDR_MASK) >> PAGE_SHIFT in pages:
+            self._check(pages, WATCH_READ, addr, size, val)
+
+    def _on_write(self, addr, size, val):
+        addr &= ADDR_MASK
+        pages = self.write_pages
+        if addr >> PAGE_SHIFT in pages or ((addr + size - 1) & ADDR_MASK) >> PAGE_SHIFT in pages:
+            self._check(pages, WATCH_WRITE, addr, size, val & ((1 << (size * 8)) - 1))
+
+    #Running
+    def _breakpoint(self, eip):
+        """The first enabled breakpoint at eip whose condition holds, or None."""
+        for bp in self.breakpoints.get(eip, ()):
+            if bp.enabled and bp.holds(self.sim):
+                bp.hits += 1
+                return bp
+        return None
+
+    def _run(self, limit=None, until=None):
+        """
+        Executes until a breakpoint (not checked for the first instruction),
+        a watchpoint hit, EIP reaching 'until', HLT or 'limit' instructions.
+        """
+        sim = self.sim
+        state = sim.state
+        step = self.tt.step if self.tt is not None else sim.step
+        if not self.points and until is None: #nothing to check between instructions
+            n = self.tt.run(limit) if self.tt is not None else sim.run(limit)
+            return Stop("halt" if state.halted else "limit", n, state.eip)
+        breakpoints = self.breakpoints
+        self._hit = None
+        n = 0
+        while not state.halted and n != limit:
+            step()
+            n += 1
+            if self._hit is not None:
+                wp, access = self._hit
+                self._hit = None
+                return Stop("watchpoint", n, state.eip, wp, access)
+            if state.eip == until:
+                return Stop("step", n, state.eip)
+            if state.eip in breakpoints:
+                bp = self._breakpoint(state.eip)
+                if bp is not None:
+                    return Stop("breakpoint", n, state.eip, bp)
+        return Stop("halt" if state.halted else "limit", n, state.eip)
+
+    def cont(self, max_instructions=None):
+        """Runs to the next breakpoint or watchpoint hit, HLT or max_instructions."""
+        return self._run(max_instructions)
+
+    def step(self, n=1):
+        """Executes n instructions, stopping early at breakpoints and watchpoint hits."""
+        stop = self._run(n)
+        if stop.reason == "limit":
+            stop.reason = "step"
+        return stop
+
+    def next(self):
+        """
+        Runs until execution reaches the address after the current instruction:
+        a backward JNE runs its loop to the exit. (Would step over calls; this
+        instruction set has none.)
+        """
+        if self.sim.state.halted:
+            return Stop("halt", 0, self.sim.state.eip)
+        instr = self.sim.cache.fetch(self.sim.state.eip)
+        return self._run(until=instr.eip_new)
+
+    def advance(self, eip):
+        """Runs until EIP reaches eip (or a breakpoint / watchpoint stops it earlier)."""
+        return self._run(until=eip & 0xFFFFFFFF)
+
+    #Reverse (needs a TimeTravel)
+    def _need_tt(self):
+        if self.tt is None:
+            raise RuntimeError("reverse execution needs Debugger(sim, timetravel=TimeTravel(sim))")
+        return self.tt
+
+    def reverse_step(self, n=1):
+        tt = self._need_tt()
+        start = tt.pos
+        tt.step_back(n)
+        return Stop("step", start - tt.pos, self.sim.state.eip)
+
+    def reverse_cont(self):
+        """Runs backwards to the previous position where a breakpoint holds, or the start of the history."""
+        tt = self._need_tt()
+        start = tt.pos
+        hit = []
+        def at_breakpoint(sim):
+            bp = self._breakpoint(sim.state.eip) if sim.state.eip in self.breakpoints else None
+            if bp is not None:
+                hit.append(bp)
+            return bp is not None
+        tt.reverse_continue(at_breakpoint)
+        if hit:
+            return Stop("breakpoint", start - tt.pos, self.sim.state.eip, hit[0])
+        return Stop("start of history", start - tt.pos, self.sim.state.eip)
+
+
+class DebuggerShell(cmd.Cmd):
+    """Line oriented front end: break/watch/delete/info, continue/step/next/advance, reverse-*, print/x."""
+    prompt = "(isl) "
+
+    def __init__(self, dbg):
+        super().__init__()
+        self.dbg = dbg
+
+    def _show(self, stop):
+        print(stop)
+        self._where()
+
+    def _where(self):
+        from disasm import format_instr
+        sim = self.dbg.sim
+        if sim.halted:
+            print("halted")
+            return
+        try:
+            instr = sim.cache.fetch(sim.eip)
+        except DecodeError as e:
+            print(f"0x{sim.eip:08X}: {e}")
+            return
+        print(f"=> 0x{sim.eip:08X}:  {format_instr(instr) or 'db'}")
+
+    def _guard(self, fn, *args):
+        try:
+            self._show(fn(*args))
+        except DecodeError as e:
+            print(f"decode error: {e}")
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except (ValueError, KeyError, NameError, RuntimeError, SyntaxError) as e:
+            print(f"error: {e}")
+
+    def do_break(self, arg):
+        """break ADDR [if CONDITION]   e.g. break 0x1c if ecx == 0 and ZF"""
+        addr, _, cond = arg.partition(" if ")
+        print(self.dbg.break_at(int(addr, 0), cond.strip() or None))
+    do_b = do_break
+
+    def do_watch(self, arg):
+        """watch ADDR [SIZE] [r|w|rw]   (default: 1 byte, writes)"""
+        parts = shlex.split(arg)
+        if not parts:
+            raise ValueError("watch needs an address")
+        size = int(parts[1], 0) if len(parts) > 1 else 1
+        access = parts[2] if len(parts) > 2 else WATCH_WRITE
+        print(self.dbg.watch(int(parts[0], 0), size, access))
+    do_w = do_watch
+
+    def do_delete(self, arg):
+        """delete [ID ...]   (no ID: all)"""
+        if not arg.strip():
+            self.dbg.clear()
+        for point_id in arg.split():
+            self.dbg.delete(int(point_id))
+
+    def do_info(self, arg):
+        """info: breakpoints, watchpoints and the current position"""
+        for point in self.dbg.points.values():
+            print(point)
+        if self.dbg.tt is not None:
+            tt = self.dbg.tt
+            print(f"position {tt.pos} (history {tt.first}..{tt.end})")
+        self._where()
+
+    def do_continue(self, arg):
+        """continue [MAX_INSTRUCTIONS]"""
+        self._guard(self.dbg.cont, int(arg, 0) if arg.strip() else None)
+    do_c = do_continue
+
+    def do_step(self, arg):
+        """step [N]   execute N instructions (default 1)"""
+        self._guard(self.dbg.step, int(arg, 0) if arg.strip() else 1)
+    do_s = do_step
+
+    def do_next(self, arg):
+        """next: run until the address after this instruction (finishes a backward JNE loop)"""
+        self._guard(self.dbg.next)
+    do_n = do_next
+
+    def do_advance(self, arg):
+        """advance ADDR"""
+        self._guard(self.dbg.advance, int(arg, 0))
+
+    def do_reverse_step(self, arg):
+        """reverse_step [N]"""
+        self._guard(self.dbg.reverse_step, int(arg, 0) if arg.strip() else 1)
+    do_rs = do_reverse_step
+
+    def do_reverse_continue(self, arg):
+        """reverse_continue: back to the previous breakpoint"""
+        self._guard(self.dbg.reverse_cont)
+    do_rc = do_reverse_continue
+
+    def do_print(self, arg):
+        """print [REG ...]   (no REG: all registers and flags)"""
+        sim = self.dbg.sim
+        if arg.strip():
+            for name in arg.split():
+                print(f"{name} = 0x{sim.reg(name):X}")
+            return
+        print("  ".join(f"{k}={v:08X}" for k, v in sim.regs().items() if not k.startswith("mm")))
+        print("  ".join(f"{k}:{v}" for k, v in sim.flags().items()))
+    do_p = do_print
+
+    def do_x(self, arg):
+        """x ADDR [LENGTH]   hex dump of memory (default 16 bytes)"""
+        parts = arg.split()
+        addr = int(parts[0], 0)
+        data = self.dbg.sim.read_bytes(addr, int(parts[1], 0) if len(parts) > 1 else 16)
+        for off in range(0, len(data), 16):
+            print(f"0x{addr + off:08X}: {data[off:off + 16].hex(' ').upper()}")
+
+    def do_quit(self, arg):
+        """quit"""
+        return True
+    do_q = do_quit
+    do_EOF = do_quit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="interactive debugger for the x86 subset simulator")
+    parser.add_argument("mem_file", help="memory image (0xADDR: bytes format, or a flat binary with --raw)")
+    parser.add_argument("--raw", action="store_true", help="mem_file is a flat binary image")
+    parser.add_argument("--load-addr", type=lambda x: int(x, 0), default=0, help="where --raw images are loaded")
+    parser.add_argument("--reverse", action="store_true", help="record the run so reverse_step/reverse_continue work")
+    args = parser.parse_args()
+
+    sim = Simulator()
+    sim.load_file(args.mem_file, args.raw, args.load_addr)
+    tt = None
+    if args.reverse:
+        from timetravel import TimeTravel
+        tt = TimeTravel(sim)
+    shell = DebuggerShell(Debugger(sim, tt))
+    shell.do_info("")
+    shell.cmdloop()
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
-from instr_class import *
+from instr_class import DecodedInstruction, PREFIX_SEG, PREFIX_OPSIZE, PREFIX_REP, SEG_OVERRIDE_SHIFT
+from memory import PAGE_SHIFT
+from opcodes import (OPCODE_TABLE, MODRM_TABLE, IMM_SIZE_MUX, IMM_DOUBLE, SELECTOR_SIZE, SEG_OVERRIDE,
+                     PREFIX_CLASS, PFX_NONE, PFX_SEG, PFX_OPSIZE, PFX_REP)
+from execute import bind
+from hooks import Hooks, EV_DECODED
 
 #Testbench Tools: Pass in a hex string with spaces between every 2 hex characters (between every byte) OR a continuous hex string
 def format_instr_in(instr_str, spaces):
@@ -10,248 +15,132 @@ def format_instr_in(instr_str, spaces):
     return instr_bytes
 
 
-def is_prefix(byte): 
-    return byte in {0xF3, #rep
-                    0x66, #segment register override
-                    0x26, 0x2E, 0x36, 0x3E, 0x64, 0x65,} #operand size override
+class DecodeError(Exception):
+    """Raised for undefined opcodes and instructions cut off by the end of the input."""
+    pass
+
+class UndefinedMemory(DecodeError):
+    """Raised when execution reaches bytes that were never loaded or written (no HLT at the end)."""
+    pass
+
+def is_prefix(byte):
+    return PREFIX_CLASS[byte] != PFX_NONE
 
 #Opcode input into the function should not contain 0x0F byte and should only contain the main byte of the opcode
 def needs_modrm(opcode, ext_opcode):
-     modrm_list_single = (0x00, 0x01, 0x02, 0x03, 0x08, 0x09, 0x0A, 0x0B, 0x20, 0x21, 0x22, 0x23, 0x80, 0x81, 0x83, 0x86, 0x87, 0x88, 0x89, 0x8A, 0x8B, 0x8C, 0x8E, 0x8F, 0xC0, 0xC1, 0xC6, 0xC7, 0xD0, 0xD1, 0xD2, 0xD3, 0xF6, 0xF7, 0xFF)
-     modrm_list_double = (0x42, 0x63, 0x6B, 0x68, 0x69, 0x6F, 0x7F, 0xB0, 0xB1, 0xBC, 0xFD, 0xFE)
-     if (ext_opcode == 1): #indicates a 2 byte opcode 
-         return opcode in modrm_list_double
-     else: #indicates a single byte opcode
-        return opcode in modrm_list_single
+    return OPCODE_TABLE[(ext_opcode << 8) | opcode].has_modrm
 
 """Returns a boolean on whether a certain opcode uses the SIB byte"""
 def needs_sib(modrm, reg0_mux):
-    mod = (modrm >> 6) & 0b11      # bits [7:6]
-    reg = (modrm >> 3) & 0b111     # bits [5:3]
-    rm  = modrm & 0b111            # bits [2:0]
-
-    if (rm == 0b100) and (mod != 0b11): #indicates presence of SIB byte
+    if MODRM_TABLE[modrm][0]: #indicates presence of SIB byte
         reg0_mux[0] = 0b10
         return True
-    else:
-        return False
+    return False
 
 """Returns displacement size in bytes (0, 1, 4) for a given modrm for some opcode"""
 def disp_bytes(modrm, sib_byte):
-    mod = (modrm >> 6) & 0b11      # bits [7:6]
-    rm  = modrm & 0b111            # bits [2:0]
-    sib = sib_byte & 0x07
-
-    if mod == 0b01:
-        return 1      # disp8
-    if mod == 0b10 or (mod == 0b00 and sib == 0b101 and rm == 0b100) or (mod == 0b00 and rm == 0b101):
-        return 4      # disp32
-    if mod == 0b00 and rm == 0b100:
-        return 4      # disp32
-    return 0          # no displacement
+    has_sib, disp_size = MODRM_TABLE[modrm]
+    if has_sib and modrm < 0x40 and sib_byte & 0b111 == 0b101: #mod 00, SIB base 101: disp32, no base
+        return 4
+    return disp_size
 
 """Returns immediate size in bytes (0, 1, 2, 4) for a given opcode"""
 def imm_bytes(opcode, ext_opcode, operand_size_prefix, imm_type):
+    info = OPCODE_TABLE[(ext_opcode << 8) | opcode]
+    imm_type[0] = info.imm_type
+    return info.imm16 if operand_size_prefix == 1 else info.imm32
 
-    #Use to update imm_type list object
-    IMM_REGULAR = 0b00
-    IMM_REL     = 0b01
-    IMM_DOUBLE  = 0b10
-    IMM_UNUSED  = 0b11
-    imm_type[0] = IMM_REGULAR
-
-    #Handles 2-byte opcode
-    if (ext_opcode == 1):
-        if opcode in (0x85, 0x87): #2 vs 4 byte immediate with operand_size_prefix
-            imm_type[0] = IMM_REL
-            if (operand_size_prefix == 1): #override (default is 32, override is 16)
-                return 2 #cw next to opcode in instruction sheet
-            else:
-                return 4 #cd next to opcode in instruction sheet
-
-
-    #Handles 1-byte opcode
-    else:
-        if (opcode & 0xF8 == 0xB0): #retrive base opcode range for 1 byte immediate
-            return 1
-        elif (opcode & 0xF8 == 0xB8): #retrieve base opcode range for 2 byte imediate
-            if (operand_size_prefix == 1): #override (default is 32, override is 16)
-                return 2 #cw next to opcode in instruction sheet
-            else:
-                return 4 #cd next to opcode in instruction sheet
-            
-        elif opcode in (0x04, 0x0C, 0x24, 0x6A, 0x75, 0x77, 0x80, 0x83, 0xB0, 0xC0, 0xC1, 0xC6, 0xEB): #1 byte immediate
-            #Update Immediate Type
-            if opcode in (0x75, 0x77, 0xEB):
-                imm_type[0] = IMM_REL
-            return 1
-        elif opcode in (0xC2, 0xCA): #2 byte immediate
-            return 2
-        elif opcode in (0x05, 0x0D, 0x25, 0x68, 0x81, 0xC7, 0xE8, 0xE9): #either 2 byte or 4 byte immediate depending on prefix
-            #Update Immediate Type
-            if opcode in (0xE8, 0xE9):
-                imm_type[0] = IMM_REL
-            
-            #Choose operand size
-            if (operand_size_prefix == 1): #override (default is 32, override is 16)
-                return 2 #cw next to opcode in instruction sheet
-            else:
-                return 4 #cd next to opcode in instruction sheet
-        elif opcode in (0x9A, 0xEA): #double immediate instruction
-            imm_type[0] = IMM_DOUBLE
-            if (operand_size_prefix == 1 and opcode == 0xEA): #tells the size of the 2nd operand bc in all cases it is 16 bits for first operand
-                return 2
-            else: 
-                return 4
-    
-def predecode(instr_str, eip, instr_cnt, dump_file=None):
+def predecode(instr_str, eip, instr_cnt, dump_file=None, base_addr=0):
 
     #Initialize all Ouput Registers
     if isinstance(instr_str, (bytes, bytearray)):
-        has_spaces = False  # bytes never contain spaces
+        instr = instr_str #raw bytes straight from memory
     else:
-        has_spaces = " " in instr_str
-
-    instr = format_instr_in(instr_str, has_spaces) #Autodetect if test has spaces
-    prefix_mux = [0, 0, 0] 
+        instr = bytes(format_instr_in(instr_str, " " in instr_str)) #Autodetect if test has spaces
+    prefixes = 0 #prefix_mux bits and segment override, see instr_class
     ext_opcode = 0
-    opcode = 0x00 #byte
     modrm = 0x00 #byte
     sib = 0x00 #byte
     disp = 0x0000 #4 bytes
     disp_size_mux = 0 #32 bit or all 0 if 0, 8 bit if 1
     imm = 0x0000 #4 bytes
-    imm_size_mux = 0 #8, 16, 32, unused (2 bits)
-    eip_new = 0x00 #4 bytes
-    reg0_mux = [0b00]; #zero val, modrm[2:0], sib[2:0], unused (2 bits)
-    imm_type = [0] #placeholder value will be modified in imm_bytes
-
-    #Parse Prefixes
-    i = eip #index to access current part of instruction
-    length = 1
-    while (i < len(instr)):
-        if (is_prefix(instr[i]) == False): #Iterate only as long as there are prefixes
-            break
-        prefix = instr[i]
-        if prefix in (0xF3,): prefix_mux[2] = 1 #rep
-        if prefix in (0x66,): prefix_mux[1] = 1 #operand size override
-        if prefix in (0x26, 0x2E, 0x36, 0x3E, 0x64, 0x65): prefix_mux[0] = 1 #segment register override
-        i += 1    
-        length += 1    
-
-    #Parse Opcode
-    if (instr[i] == 0x0F):
-        ext_opcode = 1
+    reg0_mux = 0b00 #zero val, modrm[2:0], sib[2:0], unused (2 bits)
+
+    start = i = eip - base_addr #index to access current part of instruction (instr[0] sits at base_addr)
+    end = len(instr)
+    try:
+        #Parse Prefixes
+        while True:
+            prefix_class = PREFIX_CLASS[instr[i]]
+            if prefix_class == PFX_NONE:
+                break
+            if prefix_class == PFX_SEG: #segment register override, the last one wins
+                prefixes = (prefixes & ~(0b111 << SEG_OVERRIDE_SHIFT)) | PREFIX_SEG \
+                    | (SEG_OVERRIDE[instr[i]] + 1) << SEG_OVERRIDE_SHIFT
+            elif prefix_class == PFX_OPSIZE: prefixes |= PREFIX_OPSIZE #operand size override
+            elif prefix_class == PFX_REP: prefixes |= PREFIX_REP #rep
+            i += 1
+
+        #Parse Opcode
+        opcode = instr[i]
         i += 1
-        length += 1
-    opcode = instr[i]
-    i += 1
-
-    #Parse MODRM
-    if (needs_modrm(opcode, ext_opcode)):
+        if opcode == 0x0F:
+            ext_opcode = 1
+            opcode = instr[i]
+            i += 1
+    except IndexError:
+        raise DecodeError(f"truncated instruction at {hex(eip)}") from None
+
+    info = OPCODE_TABLE[(ext_opcode << 8) | opcode]
+    if not info.defined:
+        raise DecodeError(f"undefined opcode {'0f ' if ext_opcode else ''}{opcode:02x} at {hex(eip)}")
+
+    #Parse MODRM / SIB
+    disp_size = 0
+    if info.has_modrm:
+        if i >= end:
+            raise DecodeError(f"truncated instruction at {hex(eip)}")
         modrm = instr[i]
         i += 1
-        length += 1
-        reg0_mux[0] = 0b01 #indicates modrm
-    else:  
-        modrm = 0x0
-
-    #Parse SIB
-    if (needs_sib(modrm, reg0_mux)):
-        sib = instr[i]
-        i += 1
-        length += 1
-    else:
-        sib = 0x0
-
-    #Parse Displacement
-    disp_size = disp_bytes(modrm, sib)
-    if (disp_size == 1):
-        disp_size_mux = 1
-        b0 = instr[i]
-        disp = b0 & 0xFF
-        i += 1
-        length += 1
-    elif (disp_size == 4):
-        b0 = instr[i]
-        i += 1
-        length += 1
-        b1 = instr[i]
-        i += 1
-        length += 1
-        b2 = instr[i]
-        i += 1
-        length += 1
-        b3 = instr[i]
-        i += 1
-        length += 1
-        disp = b0 | (b1 << 8) | (b2 << 16) | (b3 << 24) #little endian
-
-    #Parse Immediate
-    imm_size = imm_bytes(opcode, ext_opcode, prefix_mux[1], imm_type)
-    if (imm_size == 0):
-        imm = 0x0
-    elif (imm_size == 1):
-        imm_size_mux = 0b00 #1 byte
-        b0 = instr[i]
-        imm = b0 & 0xFF
-        i += 1
-        length += 1
-    elif (imm_size == 2):
-        imm_size_mux = 0b01 #2 bytes
-        b0 = instr[i]
-        i += 1
-        length += 1
-        b1 = instr[i]
-        i +=1
-        length += 1
-        imm = b0 | (b1 << 8)
-    elif (imm_size == 4):
-        imm_size_mux = 0b10 #4 bytes
-        b0 = instr[i]
-        i += 1
-        length += 1
-        b1 = instr[i]
-        i += 1
-        length += 1
-        b2 = instr[i]
-        i += 1
-        length += 1
-        b3 = instr[i]
-        i += 1
-        length += 1
-        imm = b0 | (b1 << 8) | (b2 << 16) | (b3 << 24) #little endian
-    
+        reg0_mux = 0b01 #indicates modrm
+        has_sib, disp_size = MODRM_TABLE[modrm]
+        if has_sib:
+            if i >= end:
+                raise DecodeError(f"truncated instruction at {hex(eip)}")
+            sib = instr[i]
+            i += 1
+            reg0_mux = 0b10
+            if modrm < 0x40 and sib & 0b111 == 0b101: #mod 00, SIB base 101: disp32, no base
+                disp_size = 4
+
+    #Parse Displacement / Immediate (little endian)
+    imm_size = info.imm16 if prefixes & PREFIX_OPSIZE else info.imm32
+    if i + disp_size + imm_size > end:
+        raise DecodeError(f"truncated instruction at {hex(eip)}")
+    if disp_size:
+        disp = int.from_bytes(instr[i:i + disp_size], "little")
+        disp_size_mux = 1 if disp_size == 1 else 0
+        i += disp_size
+    if imm_size:
+        imm = int.from_bytes(instr[i:i + imm_size], "little")
+        i += imm_size
+    if info.imm_type == IMM_DOUBLE: #far pointer: offset in imm, selector in disp
+        if i + SELECTOR_SIZE > end:
+            raise DecodeError(f"truncated instruction at {hex(eip)}")
+        disp = int.from_bytes(instr[i:i + SELECTOR_SIZE], "little")
+        i += SELECTOR_SIZE
+    imm_size_mux = IMM_SIZE_MUX[imm_size] #8, 16, 32, unused (2 bits)
+    imm_type = info.imm_type
 
     #New EIP
-    #print("i value: ", i)
-    eip_new = i #add length of instruction + 1 to pc to jump to start of next instruction
+    eip_new = base_addr + i #start of next instruction
+    length = i - start
     instr_cnt[0] += 1
 
-    #Print to dumpfile 
-    if dump_file is not None:
-        with open(dump_file, "a") as f:  # append mode
-            f.write("=== Predecode Output ===\n")
-            f.write(f"Instruction count: {instr_cnt[0]}\n")
-            f.write(f"prefix_mux       : {prefix_mux}\n")
-            f.write(f"ext_opcode       : {ext_opcode}\n")
-            f.write(f"opcode           : {hex(opcode)}\n")
-            f.write(f"modrm            : {hex(modrm)}\n")
-            f.write(f"sib              : {hex(sib)}\n")
-            f.write(f"disp             : {hex(disp)}\n")
-            f.write(f"disp_size_mux    : {disp_size_mux}\n")
-            f.write(f"imm              : {hex(imm)}\n")
-            f.write(f"imm_size_mux     : {imm_size_mux}\n")
-            f.write(f"eip              : {hex(eip)}\n")
-            f.write(f"eip_new          : {hex(eip_new)}\n")
-            f.write(f"reg0_mux         : {reg0_mux[0]}\n")
-            f.write(f"imm_type         : {imm_type[0]:02b}\n")
-            f.write("========================\n")
-
     instr_obj = DecodedInstruction(
         eip=eip,
         eip_new=eip_new,
-        prefix_mux=prefix_mux,
+        prefixes=prefixes,
         ext_opcode=ext_opcode,
         opcode=opcode,
         modrm=modrm,
@@ -260,46 +149,139 @@ def predecode(instr_str, eip, instr_cnt, dump_file=None):
         disp_size_mux=disp_size_mux,
         imm=imm,
         imm_size_mux=imm_size_mux,
-        reg0_mux=reg0_mux[0],
-        imm_type=imm_type[0],
+        reg0_mux=reg0_mux,
+        imm_type=imm_type,
         instr_len=length
     )
 
+    #Print to dumpfile (the simulator itself uses a DecodeDump subscriber instead)
+    if dump_file is not None:
+        with open(dump_file, "a") as f:  # append mode
+            f.write(format_decode_dump(instr_obj, instr_cnt[0]))
+
     return instr_obj
 
+def format_decode_dump(instr, count):
+    """The 15 line predecode report for one instruction."""
+    return (
+        "=== Predecode Output ===\n"
+        f"Instruction count: {count}\n"
+        f"prefix_mux       : {instr.prefix_mux}\n"
+        f"ext_opcode       : {instr.ext_opcode}\n"
+        f"opcode           : {hex(instr.opcode)}\n"
+        f"modrm            : {hex(instr.modrm)}\n"
+        f"sib              : {hex(instr.sib)}\n"
+        f"disp             : {hex(instr.disp)}\n"
+        f"disp_size_mux    : {instr.disp_size_mux}\n"
+        f"imm              : {hex(instr.imm)}\n"
+        f"imm_size_mux     : {instr.imm_size_mux}\n"
+        f"eip              : {hex(instr.eip)}\n"
+        f"eip_new          : {hex(instr.eip_new)}\n"
+        f"reg0_mux         : {instr.reg0_mux}\n"
+        f"imm_type         : {instr.imm_type:02b}\n"
+        "========================\n"
+    )
 
-def decode(mem, eip):    
+class DecodeDump:
+    """'decoded' event subscriber writing the predecode report of each new instruction."""
+    def __init__(self, path="decode_dump.txt"):
+        self.f = open(path, "w")
+        self.count = 0
+
+    def __call__(self, instr):
+        self.count += 1
+        self.f.write(format_decode_dump(instr, self.count))
+
+    def close(self):
+        self.f.close()
+
+
+MAX_INSTR_LEN = 15 #architectural limit, bounds the fetch window
+
+class DecodeCache:
+    """
+    Decoded instructions keyed by EIP. Each address is decoded once, straight
+    from the raw memory bytes; the pages an entry covers are registered with
+    the Memory so writes to them (self-modifying code) drop stale entries.
+    """
+    def __init__(self, mem, hooks=None):
+        self.mem = mem
+        self.decoded = hooks.decoded if hooks is not None else [] #'decoded' event subscribers
+        self.entries = {}    #eip -> DecodedInstruction
+        self.page_eips = {}  #page number -> set of cached eips touching that page
+        self.instr_cnt = [0]
+        self.drop_listeners = [] #callables(eip) told when an entry is invalidated
+        mem.code_cache = self
+
+    def fetch(self, eip):
+        instr = self.entries.get(eip)
+        if instr is None:
+            instr = self.decode_at(eip)
+        return instr
+
+    def decode_at(self, eip):
+        if not self.mem.is_defined(eip):
+            raise UndefinedMemory(f"undefined memory at {hex(eip)}")
+        window = self.mem.read_bytes(eip, MAX_INSTR_LEN)
+        instr = predecode(window, eip, self.instr_cnt, base_addr=eip)
+        instr.handler = bind(instr)
+        for fn in self.decoded:
+            fn(instr)
+        self.entries[eip] = instr
+        for page_no in {eip >> PAGE_SHIFT, (eip + instr.instr_len - 1) >> PAGE_SHIFT}:
+            self.page_eips.setdefault(page_no, set()).add(eip)
+            self.mem.code_pages.add(page_no)
+        return instr
+
+    def invalidate(self, addr, size):
+        """Drops every cached instruction overlapping [addr, addr + size)."""
+        end = addr + size
+        for page_no in {addr >> PAGE_SHIFT, (end - 1) >> PAGE_SHIFT}:
+            eips = self.page_eips.get(page_no)
+            if not eips:
+                continue
+            for eip in [e for e in eips if e < end and addr < e + self.entries[e].instr_len]:
+                self._drop(eip)
+
+    def _drop(self, eip):
+        instr = self.entries.pop(eip)
+        for listener in self.drop_listeners:
+            listener(eip)
+        for page_no in {eip >> PAGE_SHIFT, (eip + instr.instr_len - 1) >> PAGE_SHIFT}:
+            eips = self.page_eips[page_no]
+            eips.discard(eip)
+            if not eips:
+                del self.page_eips[page_no]
+                self.mem.code_pages.discard(page_no)
+
+    def clear(self):
+        for eip in list(self.entries):
+            for listener in self.drop_listeners:
+                listener(eip)
+        self.entries.clear()
+        self.page_eips.clear()
+        self.mem.code_pages.clear()
+
+
+def decode(mem, eip, cache=None):
     #Dumpfile
-    dump_file = "decode_dump.txt"
-    open(dump_file, "w").close() # Clear previous dump
+    dump = None
+    if cache is None:
+        hooks = Hooks()
+        dump = hooks.subscribe(EV_DECODED, DecodeDump("decode_dump.txt"))
+        cache = DecodeCache(mem, hooks)
 
+    #Linear sweep over the loaded bytes, skipping gaps between regions
     instrs = []
-    instr_cnt = [0]
-    decoded = None
     while True:
-        #Choose correct eip value
-        if eip not in mem:
-            greater_keys = [addr for addr in mem.keys() if addr > eip]
-            if not greater_keys:
-                #print(f"No more instructions after {hex(eip)}")
+        if not mem.is_defined(eip):
+            eip = mem.next_defined(eip)
+            if eip is None:
                 break
-            
-            eip = min(greater_keys)
-            #print(f"Jumping to next instruction at {hex(eip)}")
-        else: 
-            #print("eip in mem")
-        
-            #decode all instructions
-            sorted_addrs = sorted(mem.keys())
-            instr_str = bytes(int(mem[addr], 16) for addr in sorted_addrs)
-            formatted_instr_str = " ".join(f"{b:02x}" for b in instr_str)
-            decoded = predecode(formatted_instr_str, eip, instr_cnt, dump_file=dump_file)
-            instrs.append(decoded)
-            eip = decoded.eip_new
+        decoded = cache.fetch(eip)
+        instrs.append(decoded)
+        eip = decoded.eip_new
 
+    if dump is not None:
+        dump.close()
     return instrs
-
-
-
-
-
@@ -0,0 +1,238 @@
+#Disassembler: Intel syntax listings of memory images, built on predecode()
+#
+#    python3 disasm.py mem.txt [-o listing.txt] [-j N]
+#
+#    00000055  01 05 04 B0 00 00               add     dword ptr [0xB004], eax
+import os
+import sys
+import argparse
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from registers import REG32, REG16, REG8, SREGS
+from memory import Memory, load_mem_file, load_binary_file
+from decoder import predecode, DecodeError, MAX_INSTR_LEN
+from instr_class import PREFIX_OPSIZE, PREFIX_REP
+from opcodes import IMM_REL
+from utils import decode_modrm, sext, ea_parts
+
+CHUNK_SIZE = 1 << 18 #bytes per parallel job
+TEXT_CACHE = 1 << 16 #encodings whose text is remembered during a sweep
+RAW_COLUMN = 10      #instruction bytes shown before the text column is pushed right
+
+PTR = {1: "byte", 2: "word", 4: "dword", 8: "qword"}
+GROUP1 = ("add", "or", "adc", "sbb", "and", "sub", "xor", "cmp")
+BYTE_OPS = (0x00, 0x02, 0x04, 0x80, 0x86, 0x88, 0x8A, 0xC6) #r/m8 forms (plus B0-B7)
+
+#Opcodes without operands (0F map entries are (1 << 8) | opcode)
+PLAIN = {
+    0x90: "nop", 0xC3: "ret", 0xC9: "leave", 0xCB: "retf", 0xCC: "int3", 0xCF: "iret", 0xF4: "hlt", 0xF5: "cmc",
+    0xF8: "clc", 0xF9: "stc", 0xFA: "cli", 0xFB: "sti", 0xFC: "cld", 0xFD: "std", 0x9C: "pushfd", 0x9D: "popfd",
+    0x9E: "sahf", 0x9F: "lahf", 0x99: "cdq", 0x98: "cwde", 0xA4: "movsb", 0xA5: "movsd", 0xAA: "stosb",
+    0xAB: "stosd", 0xAC: "lodsb", 0xAD: "lodsd", 0xA6: "cmpsb", 0xA7: "cmpsd", 0xAE: "scasb", 0xAF: "scasd",
+    0x100 | 0x05: "syscall", 0x100 | 0x0B: "ud2", 0x100 | 0x31: "rdtsc", 0x100 | 0xA2: "cpuid",
+    0x100 | 0x77: "emms", 0x100 | 0x30: "wrmsr", 0x100 | 0x32: "rdmsr",
+}
+SHORT_JUMPS = {0x75: "jne", 0x77: "ja", 0xEB: "jmp", 0xE8: "call", 0xE9: "jmp", 0x100 | 0x85: "jne", 0x100 | 0x87: "ja"}
+
+def _hex(v, digits=1):
+    return f"0x{v:0{digits}X}"
+
+def _mem(instr, size):
+    """'dword ptr [ebx+esi*4+0x10]' with any segment override in front of the brackets."""
+    base, index, scale, disp, _ = ea_parts(instr)
+    terms = []
+    if base is not None:
+        terms.append(REG32[base])
+    if index is not None:
+        terms.append(REG32[index] + (f"*{1 << scale}" if scale else ""))
+    if not terms:
+        addr = _hex(disp & 0xFFFFFFFF, 4)
+    elif disp:
+        addr = "+".join(terms) + (f"-{_hex(-disp)}" if disp < 0 else f"+{_hex(disp)}")
+    else:
+        addr = "+".join(terms)
+    seg = instr.seg_override
+    seg = SREGS[seg] + ":" if seg is not None else ""
+    return f"{PTR[size]} ptr {seg}[{addr}]" if size else f"{seg}[{addr}]"
+
+def _reg(idx, size):
+    return (REG8, REG16, None, REG32)[size - 1][idx]
+
+def _rm(instr, size):
+    mod, _, rm = decode_modrm(instr.modrm)
+    return _reg(rm, size) if mod == 0b11 else _mem(instr, size)
+
+def _imm(instr, size):
+    return _hex(instr.imm, 2 * min(size, 4))
+
+def operand_size(instr):
+    """Architectural operand size (1, 2 or 4) of an integer instruction."""
+    op = instr.opcode
+    if (op in BYTE_OPS or 0xB0 <= op <= 0xB7) and not instr.ext_opcode or (instr.ext_opcode and op == 0xB0):
+        return 1
+    return 2 if instr.prefixes & PREFIX_OPSIZE else 4
+
+def format_instr(instr):
+    """Intel syntax text of a DecodedInstruction, e.g. 'add     dword ptr [0x2000], 1'."""
+    op, ext = instr.opcode, instr.ext_opcode
+    key = (ext << 8) | op
+    size = operand_size(instr)
+    mod, reg, rm = decode_modrm(instr.modrm)
+    mn = ops = None
+    if key in PLAIN:
+        mn = PLAIN[key]
+        if instr.prefixes & PREFIX_REP and 0xA4 <= op <= 0xAF:
+            mn = "rep " + mn
+    elif key in SHORT_JUMPS:
+        target = (instr.eip_new + (sext(instr.imm, 8) if op in (0x75, 0x77, 0xEB) else instr.imm)) & 0xFFFFFFFF
+        mn, ops = SHORT_JUMPS[key], _hex(target)
+    elif not ext:
+        if op in (0x00, 0x01):
+            mn, ops = "add", f"{_rm(instr, size)}, {_reg(reg, size)}"
+        elif op in (0x02, 0x03):
+            mn, ops = "add", f"{_reg(reg, size)}, {_rm(instr, size)}"
+        elif op in (0x04, 0x05):
+            mn, ops = "add", f"{_reg(0, size)}, {_imm(instr, size)}"
+        elif op in (0x80, 0x81, 0x83):
+            src = str(sext(instr.imm, 8)) if op == 0x83 else _imm(instr, size)
+            mn, ops = GROUP1[reg], f"{_rm(instr, size)}, {src}"
+        elif op in (0x86, 0x87): #register operand first, as in mnemonic.txt
+            mn, ops = "xchg", f"{_reg(reg, size)}, {_rm(instr, size)}"
+        elif op in (0x88, 0x89):
+            mn, ops = "mov", f"{_rm(instr, size)}, {_reg(reg, size)}"
+        elif op in (0x8A, 0x8B):
+            mn, ops = "mov", f"{_reg(reg, size)}, {_rm(instr, size)}"
+        elif op == 0x8C and reg < 6:
+            mn, ops = "mov", f"{_rm(instr, 2)}, {SREGS[reg]}"
+        elif op == 0x8E and reg < 6:
+            mn, ops = "mov", f"{SREGS[reg]}, {_rm(instr, 2)}"
+        elif 0xB0 <= op <= 0xBF:
+            mn, ops = "mov", f"{_reg(op & 7, size)}, {_imm(instr, size)}"
+        elif op in (0xC6, 0xC7) and reg == 0:
+            mn, ops = "mov", f"{_rm(instr, size)}, {_imm(instr, size)}"
+        elif 0x40 <= op <= 0x5F:
+            mn, ops = ("inc", "dec", "push", "pop")[(op - 0x40) >> 3], _reg(op & 7, size)
+        elif 0x91 <= op <= 0x97:
+            mn, ops = "xchg", f"{_reg(0, size)}, {_reg(op & 7, size)}"
+        elif op in (0xEA, 0x9A): #ptr16:32, selector in disp
+            mn, ops = "jmp" if op == 0xEA else "call", f"{_hex(instr.disp, 4)}:{_hex(instr.imm, 2 * size)}"
+    elif op in (0xB0, 0xB1):
+        mn, ops = "cmpxchg", f"{_rm(instr, size)}, {_reg(reg, size)}"
+    elif op == 0x6F:
+        mn, ops = "movq", f"mm{reg}, " + (f"mm{rm}" if mod == 0b11 else _mem(instr, 8))
+    elif op == 0x7F:
+        mn, ops = "movq", (f"mm{rm}" if mod == 0b11 else _mem(instr, 8)) + f", mm{reg}"
+    if mn is None: #decodes, but has no mnemonic here
+        return None
+    return f"{mn:<8}{ops}" if ops else mn
+
+def format_line(eip, raw, text):
+    return f"{eip:08X}  {raw.hex(' ').upper():<{3 * RAW_COLUMN}}  {text}"
+
+def _bad_line(eip, raw):
+    return format_line(eip, raw, "db      " + ", ".join(_hex(b, 2) for b in raw))
+
+def sweep(data, base, start, stop):
+    """
+    Linear sweep of data (the bytes at base...) from start until an instruction
+    starts at or after stop or the data runs out. Bytes that do not decode are
+    listed as 'db' one at a time. Returns (instruction eips, listing lines, next eip).
+    """
+    eips, lines = [], []
+    texts = {} #raw bytes -> text, for everything but relative branches
+    end = base + len(data)
+    cnt = [0]
+    eip = start
+    while eip < stop and eip < end:
+        try:
+            instr = predecode(data, eip, cnt, base_addr=base)
+        except DecodeError:
+            eips.append(eip)
+            lines.append(_bad_line(eip, data[eip - base:eip - base + 1]))
+            eip += 1
+            continue
+        raw = data[eip - base:instr.eip_new - base]
+        text = texts.get(raw)
+        if text is None:
+            text = format_instr(instr)
+            if instr.imm_type != IMM_REL:
+                if len(texts) >= TEXT_CACHE:
+                    texts.clear()
+                texts[raw] = text
+        eips.append(eip)
+        lines.append(format_line(eip, raw, text) if text is not None else _bad_line(eip, raw))
+        eip = instr.eip_new
+    return eips, lines, eip
+
+def _sweep_job(job):
+    data, base, start, stop = job
+    return sweep(data, base, start, stop)
+
+def _chunks(mem, chunk_size):
+    """(region bytes, region start, chunk start, chunk stop) jobs; a job carries the bytes it may read."""
+    for start, end in mem.regions():
+        for s in range(start, end, chunk_size):
+            e = min(s + chunk_size, end)
+            data = mem.read_bytes(s, min(e + MAX_INSTR_LEN - 1, end) - s)
+            yield data, s, s, e
+
+def disassemble(mem, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Listing lines for every loaded region of mem, in address order. With
+    jobs > 1 the regions are cut into chunks swept in parallel from the chunk
+    start; a chunk's lines are used from the first instruction where the
+    previous chunk's sweep lands, and the few instructions before that
+    resync point are swept again here.
+    """
+    work = list(_chunks(mem, chunk_size))
+    if jobs > 1 and len(work) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_sweep_job, work, chunksize=max(1, len(work) // (4 * jobs))))
+    else:
+        results = map(_sweep_job, work)
+    nxt = None
+    for (data, base, start, stop), (eips, lines, after) in zip(work, results):
+        if nxt is None or nxt <= start: #first chunk of a region (or in step with the previous one)
+            yield from lines
+            nxt = after
+            continue
+        #the previous chunk ran past our start: sweep on from there until both sweeps agree
+        i = bisect_left(eips, nxt)
+        while nxt < stop and (i == len(eips) or eips[i] != nxt):
+            e, l, nxt = sweep(data, base, nxt, nxt + 1)
+            yield from l
+            i = bisect_left(eips, nxt)
+        if nxt < stop:
+            yield from lines[i:]
+            nxt = after
+
+def load_image(path, raw=False, load_addr=0):
+    mem = Memory()
+    if raw:
+        load_binary_file(mem, path, load_addr)
+    else:
+        load_mem_file(mem, path)
+    return mem
+
+def main():
+    parser = argparse.ArgumentParser(description="Intel syntax listing of a memory image")
+    parser.add_argument("mem_file", help="memory image (0xADDR: bytes format, or a flat binary with --raw)")
+    parser.add_argument("--raw", action="store_true", help="mem_file is a flat binary image")
+    parser.add_argument("--load-addr", type=lambda x: int(x, 0), default=0, help="where --raw images are placed")
+    parser.add_argument("-o", "--output", default=None, help="listing file (default: stdout)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="bytes per parallel job (default %(default)s)")
+    args = parser.parse_args()
+
+    mem = load_image(args.mem_file, args.raw, args.load_addr)
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for line in disassemble(mem, args.jobs, max(args.chunk, MAX_INSTR_LEN)):
+            out.write(line + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#Event hooks for instrumentation (decode dump, traces, profilers, debuggers)
+
+#Events and the arguments subscribers are called with
+EV_DECODED = "decoded"      #(instr)                  new DecodeCache entry
+EV_RETIRED = "retired"      #(state, mem, instr)      after an instruction executed
+EV_MEM_READ = "mem_read"    #(addr, size, val)        guest data read
+EV_MEM_WRITE = "mem_write"  #(addr, size, val)        guest data write, before it happens
+EV_BRANCH = "branch"        #(state, instr, target)   control left the fall-through path
+EVENTS = (EV_DECODED, EV_RETIRED, EV_MEM_READ, EV_MEM_WRITE, EV_BRANCH)
+
+class Hooks:
+    """
+    Subscriber lists, one per event, exposed as attributes (hooks.retired,
+    hooks.mem_write, ...). Producers only do work for an event whose list is
+    non-empty: the run loop picks an uninstrumented loop when nobody listens
+    to retired/branch, and the memory events are delivered by wrappers that
+    attach_memory() installs on the Memory only while they have subscribers.
+    Subscribe before starting a run.
+    """
+    def __init__(self):
+        for event in EVENTS:
+            setattr(self, event, [])
+        self.memories = [] #Memory objects whose read/write are wrapped on demand
+
+    def subscribe(self, event, fn):
+        if event not in EVENTS:
+            raise ValueError(f"unknown event {event!r}")
+        getattr(self, event).append(fn)
+        self._sync()
+        return fn
+
+    def unsubscribe(self, event, fn):
+        getattr(self, event).remove(fn)
+        self._sync()
+
+    def active(self, event):
+        return bool(getattr(self, event))
+
+    def attach_memory(self, mem):
+        """Delivers mem_read/mem_write events for mem while they have subscribers."""
+        self.memories.append(mem)
+        self._sync()
+
+    def _sync(self):
+        for mem in self.memories:
+            _wrap(mem, "read", self.mem_read)
+            _wrap(mem, "write", self.mem_write)
+
+
+def _wrap(mem, name, subscribers):
+    """Shadows mem.read / mem.write with a notifying version, or removes the shadow."""
+    wrapped = name in vars(mem)
+    if not subscribers:
+        if wrapped:
+            delattr(mem, name)
+        return
+    if wrapped:
+        return
+    method = getattr(type(mem), name)
+    if name == "read":
+        def read(addr, size):
+            val = method(mem, addr, size)
+            for fn in subscribers:
+                fn(addr, size, val)
+            return val
+        mem.read = read
+    else:
+        def write(addr, val, size):
+            for fn in subscribers:
+                fn(addr, size, val)
+            method(mem, addr, val, size)
+        mem.write = write
@@ -1,11 +1,31 @@
-from enum import Enum
+#Prefix bitfield (DecodedInstruction.prefixes): bits 0-2 are prefix_mux[0..2],
+#bits 3-5 hold the segment override register number + 1 (0 = no override)
+PREFIX_SEG = 0b001    #segment register override
+PREFIX_OPSIZE = 0b010 #0x66 operand size override
+PREFIX_REP = 0b100    #rep
+SEG_OVERRIDE_SHIFT = 3
+
+def pack_prefixes(prefix_mux, seg_override=None):
+    """[seg, opsize, rep] flags (+ override register number) -> prefixes bitfield"""
+    bits = prefix_mux[0] | prefix_mux[1] << 1 | prefix_mux[2] << 2
+    if seg_override is not None:
+        bits |= (seg_override + 1) << SEG_OVERRIDE_SHIFT
+    return bits
 
 class DecodedInstruction:
+    """
+    One predecoded instruction. Fixed __slots__ (no per-instance dict) and the
+    prefixes packed into one int; prefix_mux and seg_override are derived
+    from it. See instr_table.InstrTable for whole decoded programs.
+    """
+    __slots__ = ("eip", "eip_new", "prefixes", "ext_opcode", "opcode", "modrm", "sib", "disp", "disp_size_mux",
+                 "imm", "imm_size_mux", "reg0_mux", "imm_type", "instr_len", "handler")
+
     def __init__(
         self,
         eip,
         eip_new,
-        prefix_mux,
+        prefixes,
         ext_opcode,
         opcode,
         modrm,
@@ -20,7 +40,7 @@ class DecodedInstruction:
     ):
         self.eip = eip
         self.eip_new = eip_new
-        self.prefix_mux = prefix_mux
+        self.prefixes = prefixes
         self.ext_opcode = ext_opcode
         self.opcode = opcode
         self.modrm = modrm
@@ -32,6 +52,19 @@ class DecodedInstruction:
         self.reg0_mux = reg0_mux
         self.imm_type = imm_type
         self.instr_len = instr_len
+        self.handler = None #pre-specialized handler(state, mem), see execute.bind()
+
+    @property
+    def prefix_mux(self):
+        """[segment override, operand size override, rep] as 0/1 (a new list each time)."""
+        bits = self.prefixes
+        return [bits & 1, (bits >> 1) & 1, (bits >> 2) & 1]
+
+    @property
+    def seg_override(self):
+        """Segment register number from an override prefix, or None."""
+        seg = self.prefixes >> SEG_OVERRIDE_SHIFT
+        return seg - 1 if seg else None
 
     def __repr__(self):
         return (
@@ -0,0 +1,182 @@
+#Struct-of-arrays storage for whole decoded programs
+#
+#    table = decode_table(mem, 0)
+#    len(table), table.nbytes
+#    for ins in table:           #one reused cursor, no object per instruction
+#        if ins.opcode == 0x75: ...
+#    table.at(0x1C)              #-> DecodedInstruction
+#    table.numpy("opcode")       #zero copy column (needs NumPy)
+from array import array
+from bisect import bisect_left
+
+from instr_class import DecodedInstruction, SEG_OVERRIDE_SHIFT
+from decoder import predecode, MAX_INSTR_LEN
+
+try:
+    import numpy as np
+except ImportError: #only InstrTable.numpy() needs it
+    np = None
+
+#(field, array typecode) per column; eip_new is not stored, it is eip + instr_len
+COLUMNS = (
+    ("eip", "I"), ("prefixes", "B"), ("ext_opcode", "B"), ("opcode", "B"), ("modrm", "B"), ("sib", "B"),
+    ("disp", "I"), ("disp_size_mux", "B"), ("imm", "I"), ("imm_size_mux", "B"), ("reg0_mux", "B"),
+    ("imm_type", "B"), ("instr_len", "B"),
+)
+FIELDS = tuple(name for name, _ in COLUMNS)
+
+def _column(name):
+    """Property reading field 'name' of the view's row."""
+    def get(self):
+        return getattr(self.table, name)[self.index]
+    return property(get)
+
+class InstrView:
+    """
+    Read-only cursor on one row of an InstrTable, with the DecodedInstruction
+    attribute names. Iterating a table moves a single view along, so keep
+    materialize() (or table[i]) for rows that must outlive the next step.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index=0):
+        self.table = table
+        self.index = index
+
+    @property
+    def eip_new(self):
+        i = self.index
+        return self.table.eip[i] + self.table.instr_len[i]
+
+    @property
+    def prefix_mux(self):
+        bits = self.table.prefixes[self.index]
+        return [bits & 1, (bits >> 1) & 1, (bits >> 2) & 1]
+
+    @property
+    def seg_override(self):
+        seg = self.table.prefixes[self.index] >> SEG_OVERRIDE_SHIFT
+        return seg - 1 if seg else None
+
+    def materialize(self):
+        return self.table[self.index]
+
+    def __repr__(self):
+        return f"InstrView({self.index}, eip={hex(self.eip)}, opcode={hex(self.opcode)}, len={self.instr_len})"
+
+for _name in FIELDS:
+    setattr(InstrView, _name, _column(_name))
+
+
+class InstrTable:
+    """
+    A decoded program as one typed array per field, indexed by instruction
+    number (about 22 bytes per instruction). Rows are looked up by EIP with a
+    binary search while they are appended in ascending EIP order (a linear
+    sweep), and through an EIP -> index dict built on first use otherwise.
+    """
+    def __init__(self):
+        for name, code in COLUMNS:
+            setattr(self, name, array(code))
+        self._by_eip = None   #eip -> index, only for tables not in EIP order
+        self._ascending = True
+
+    @classmethod
+    def from_instrs(cls, instrs):
+        table = cls()
+        for instr in instrs:
+            table.append(instr)
+        return table
+
+    def append(self, instr):
+        """Adds a DecodedInstruction (or InstrView) as the next row."""
+        eip = self.eip
+        if eip and instr.eip <= eip[-1]:
+            self._ascending = False
+        if self._by_eip is not None:
+            self._by_eip.setdefault(instr.eip, len(eip))
+        for name in FIELDS:
+            getattr(self, name).append(getattr(instr, name))
+
+    def __len__(self):
+        return len(self.eip)
+
+    def __getitem__(self, i):
+        """Row i as a standalone DecodedInstruction (handler not bound)."""
+        if i < 0:
+            i += len(self.eip)
+        eip, prefixes, ext, op, modrm, sib, disp, disp_mux, imm, imm_mux, reg0, imm_type, length = (
+            getattr(self, name)[i] for name in FIELDS)
+        return DecodedInstruction(eip, eip + length, prefixes, ext, op, modrm, sib, disp, disp_mux,
+                                  imm, imm_mux, reg0, imm_type, length)
+
+    def __iter__(self):
+        view = InstrView(self)
+        for i in range(len(self.eip)):
+            view.index = i
+            yield view
+
+    def index(self, eip):
+        """Row number of the instruction at eip (ValueError if there is none)."""
+        if self._ascending:
+            i = bisect_left(self.eip, eip)
+            if i < len(self.eip) and self.eip[i] == eip:
+                return i
+        else:
+            if self._by_eip is None:
+                self._by_eip = {}
+                for i, e in enumerate(self.eip):
+                    self._by_eip.setdefault(e, i)
+            i = self._by_eip.get(eip)
+            if i is not None:
+                return i
+        raise ValueError(f"no decoded instruction at {hex(eip)}")
+
+    def __contains__(self, eip):
+        try:
+            self.index(eip)
+        except ValueError:
+            return False
+        return True
+
+    def at(self, eip):
+        return self[self.index(eip)]
+
+    def view(self, i):
+        return InstrView(self, i)
+
+    def column(self, name):
+        """The array.array behind field 'name'."""
+        if name not in FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def numpy(self, name):
+        """Zero copy NumPy view of column 'name'."""
+        if np is None:
+            raise ImportError("InstrTable.numpy() needs NumPy")
+        col = self.column(name)
+        return np.frombuffer(col, dtype=np.dtype(col.typecode)) if len(col) else np.zeros(0, np.dtype(col.typecode))
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).buffer_info()[1] * getattr(self, name).itemsize for name in FIELDS)
+
+
+def decode_table(mem, eip=0, stop=None):
+    """
+    decoder.decode()'s linear sweep (skipping undefined gaps) into an
+    InstrTable, without a DecodeCache or bound handlers, so only the columns
+    stay alive. Stops at the end of the defined bytes or at 'stop'.
+    """
+    table = InstrTable()
+    instr_cnt = [0]
+    while stop is None or eip < stop:
+        if not mem.is_defined(eip):
+            eip = mem.next_defined(eip)
+            if eip is None or (stop is not None and eip >= stop):
+                break
+        instr = predecode(mem.read_bytes(eip, MAX_INSTR_LEN), eip, instr_cnt, base_addr=eip)
+        table.append(instr)
+        eip = instr.eip_new
+    return table
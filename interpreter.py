@@ -0,0 +1,31 @@
+#Fetch/decode/execute loop shared by isl.py and the Simulator API
+def run(state, mem, cache, max_instrs=None, hooks=None):
+    """
+    Fetch/decode/execute loop driven by state.eip. Stops when HLT sets
+    state.halted or after max_instrs instructions (None = no limit); raises
+    DecodeError, UndefinedMemory if it runs past the loaded image.
+    'retired' and 'branch' subscribers in hooks are called per instruction;
+    without any the loop has no instrumentation at all.
+    Returns the number of instructions retired.
+    """
+    limit = max_instrs if max_instrs is not None else -1
+    retired_subs = hooks.retired if hooks is not None else ()
+    branch_subs = hooks.branch if hooks is not None else ()
+    fetch = cache.fetch
+    retired = 0
+    if not retired_subs and not branch_subs:
+        while not state.halted and retired != limit:
+            fetch(state.eip).handler(state, mem) #bound at decode time, see execute.bind()
+            retired += 1
+        return retired
+
+    while not state.halted and retired != limit:
+        instr = fetch(state.eip)
+        instr.handler(state, mem)
+        retired += 1
+        if branch_subs and state.eip != instr.eip_new and not state.halted:
+            for fn in branch_subs:
+                fn(state, instr, state.eip)
+        for fn in retired_subs:
+            fn(state, mem, instr)
+    return retired
@@ -1,12 +1,167 @@
 #Libraries
+import os
 import sys
+import time
+import argparse
 
 #Files
-from utils import *
-from registers import *
-from decoder import *
-from execute import *
-from memory import *
+from registers import Registers
+from decoder import DecodeCache, DecodeDump, DecodeError, UndefinedMemory
+from memory import Memory, load_mem_file, load_binary_file, write_mem_dump
+from interpreter import run
+from translate import Translator
+from trace_writer import TraceWriter, MODE_FULL, MODE_DELTA, MODE_BINARY, AT_INSTR, AT_BRANCH, AT_FINAL
+from bintrace import BinaryTraceWriter
+from hooks import Hooks, EV_RETIRED, EV_DECODED
+from checkpoint import save_checkpoint, load_checkpoint
+from profiler import Profiler, DEFAULT_PERIOD
+from cache import CacheHierarchy, parse_spec, DEFAULT_L1I, DEFAULT_L1D, DEFAULT_L2
+from pipeline import PipelineModel, parse_config
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="x86 subset instruction set simulator")
+    parser.add_argument("mem_file", nargs="?", help="input memory image (0xADDR: bytes format, or a flat binary with --raw)")
+    parser.add_argument("--raw", action="store_true", help="mem_file is a flat binary image")
+    parser.add_argument("--load-addr", type=lambda x: int(x, 0), default=0,
+                        help="where --raw images are loaded (default 0)")
+    parser.add_argument("--mem-dump", action="store_true", help="write the loaded image to mem_dump.txt")
+    parser.add_argument("--max-instrs", type=int, default=None,
+                        help="stop after this many instructions (default: run until HLT)")
+    parser.add_argument("--translate", action="store_true",
+                        help="compile hot basic blocks to Python (trace holds the final state only)")
+    parser.add_argument("--trace-mode", choices=(MODE_FULL, MODE_DELTA, MODE_BINARY), default=MODE_FULL,
+                        help="full: whole state per record (default), delta: only what changed, "
+                             "binary: results.trace + index (render with bintrace.py)")
+    parser.add_argument("--trace-at", choices=(AT_INSTR, AT_BRANCH, AT_FINAL), default=AT_INSTR,
+                        help="write a record every instruction (default), after branches, or at the end only")
+    parser.add_argument("--trace-every", type=int, default=1, metavar="N",
+                        help="with --trace-at instr, write every N-th instruction")
+    parser.add_argument("--trace-thread", action="store_true",
+                        help="write the trace file from a background thread")
+    parser.add_argument("--no-trace", action="store_true", help="do not write results.txt / results.trace")
+    parser.add_argument("--no-dump", action="store_true", help="do not write decode_dump.txt")
+    parser.add_argument("--resume", metavar="FILE", help="start from a checkpoint instead of mem_file")
+    parser.add_argument("--save-checkpoint", metavar="FILE", help="write a checkpoint (see --checkpoint-at)")
+    parser.add_argument("--checkpoint-at", type=int, default=None, metavar="N",
+                        help="save the checkpoint after N instructions (default: at the end of the run)")
+    parser.add_argument("--profile", action="store_true",
+                        help="write profile.txt (hot EIPs, instruction mix, host time per handler) and profile.folded")
+    parser.add_argument("--profile-period", type=int, default=DEFAULT_PERIOD, metavar="N",
+                        help="with --profile, time one instruction in N (default %(default)s)")
+    parser.add_argument("--cache", action="store_true",
+                        help="run the accesses through an L1I/L1D/L2 cache model and write cache.txt")
+    parser.add_argument("--l1i", default=DEFAULT_L1I, metavar="SPEC",
+                        help="size:assoc:line[:lru|plru|random[:wb|wt]] (default %(default)s)")
+    parser.add_argument("--l1d", default=DEFAULT_L1D, metavar="SPEC", help="(default %(default)s)")
+    parser.add_argument("--l2", default=DEFAULT_L2, metavar="SPEC", help="'none' for no L2 (default %(default)s)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="time the run on an in-order pipeline model and write pipeline.txt (cycles, CPI, stalls)")
+    parser.add_argument("--pipeline-config", default="", metavar="K=V,...",
+                        help="pipeline settings, e.g. mem_latency=5,forwarding=0,predict=btfn")
+    return parser
+
+def run_case(args, out_dir="."):
+    """
+    One simulation as configured by build_parser() options. Output files
+    (results.txt, results.trace, decode_dump.txt, mem_dump.txt) go to out_dir.
+    Returns a summary dict: retired, reason, eip, halted, elapsed.
+    """
+    def out(name):
+        return os.path.join(out_dir, name)
+
+    print("Run Successful")
+    hooks = Hooks()
+    trace = None
+    if not args.no_trace:
+        at = AT_FINAL if args.translate else args.trace_at
+        if args.trace_mode == MODE_BINARY:
+            trace = BinaryTraceWriter(out("results.trace"), at=at, every=args.trace_every)
+        else:
+            trace = TraceWriter(out("results.txt"), mode=args.trace_mode, at=at,
+                                every=args.trace_every, threaded=args.trace_thread)
+        hooks.subscribe(EV_RETIRED, trace.retire)
+    dump = None
+    if not args.no_dump:
+        dump = hooks.subscribe(EV_DECODED, DecodeDump(out("decode_dump.txt")))
+
+    mem = Memory()
+    state = Registers()
+    state.eip = 0
+    dump_file = out("mem_dump.txt") if args.mem_dump else None
+    if args.resume:
+        load_checkpoint(args.resume, state, mem)
+        if dump_file is not None:
+            write_mem_dump(mem, dump_file)
+    elif args.raw:
+        load_binary_file(mem, args.mem_file, args.load_addr, dump_file)
+    else:
+        load_mem_file(mem, args.mem_file, dump_file) #parse inpute file
+    hooks.attach_memory(mem)
+    caches = None
+    if args.cache:
+        caches = CacheHierarchy(args.l1i, args.l1d, None if args.l2.lower() == "none" else args.l2)
+        caches.attach(hooks)
+    pipeline = None
+    if args.pipeline: #after the caches, so it sees this instruction's misses
+        pipeline = PipelineModel(parse_config(args.pipeline_config), caches)
+        pipeline.attach(hooks)
+    cache = DecodeCache(mem, hooks)
+    translator = Translator(cache, track_writes=trace is not None and trace.reads_written) if args.translate else None
+    profiler = Profiler(args.profile_period) if args.profile else None
+
+    def execute_for(budget):
+        if translator is not None:
+            return translator.run(state, mem, budget)
+        if profiler is not None:
+            return profiler.run(state, mem, cache, budget, hooks)
+        return run(state, mem, cache, budget, hooks)
+
+    was_halted = state.halted
+    start = time.perf_counter()
+    reason = None
+    retired = 0
+    try:
+        budget = args.max_instrs
+        if args.save_checkpoint and args.checkpoint_at is not None:
+            first = args.checkpoint_at if budget is None else min(args.checkpoint_at, budget)
+            retired = execute_for(first)
+            save_checkpoint(args.save_checkpoint, state, mem)
+            print(f"Checkpoint saved to {args.save_checkpoint} after {retired} instructions")
+            if budget is not None:
+                budget -= retired
+        retired += execute_for(budget)
+        if args.save_checkpoint and args.checkpoint_at is None:
+            save_checkpoint(args.save_checkpoint, state, mem)
+            print(f"Checkpoint saved to {args.save_checkpoint} after {retired} instructions")
+    except UndefinedMemory:
+        retired = None
+        reason = "undefined memory"
+    except DecodeError as e:
+        retired = None
+        reason = f"decode error ({e})"
+    elapsed = time.perf_counter() - start
+    if state.halted and not was_halted:
+        print("hlt")
+    if trace is not None:
+        trace.final(state, mem)
+        trace.close()
+    if dump is not None:
+        dump.close()
+    if profiler is not None:
+        profiler.write_report(out("profile.txt"))
+        profiler.write_folded(out("profile.folded"))
+    if caches is not None:
+        caches.write_report(out("cache.txt"))
+    if pipeline is not None:
+        pipeline.write_report(out("pipeline.txt"))
+
+    if reason is None:
+        reason = "HLT" if state.halted else "instruction limit"
+    print(f"Stopped on {reason} at EIP 0x{state.eip:08X}")
+    if retired is not None:
+        ips = retired / elapsed if elapsed > 0 else 0.0
+        print(f"Instructions retired: {retired} in {elapsed:.3f}s ({ips:,.0f} instr/s)")
+    return {"retired": retired, "reason": reason, "eip": state.eip, "halted": state.halted, "elapsed": elapsed}
 
 #Main
 def main():
@@ -15,28 +170,25 @@ def main():
         print("Try Run Command: <python3 isl.py mem.txt>")
         return
 
-    print("Run Successful")
-    with open("results.txt", "w") as f:
-        f.write("START OF SIMULATION TRACE\n")
-        f.write("="*60 + "\n\n")
-
-    mem_file = sys.argv[1]
-
-    mem = {}
-    load_mem_file(mem, mem_file) #parse inpute file
-    
-    eip = 0
-    instrs_decoded = decode(mem, eip)
-
-    state = Registers()
-    for instr in instrs_decoded:
-        execute(instr, state, mem)
-        write_results(state, mem, "results.txt")
-
-    #     dump_state_to_results()
+    parser = build_parser()
+    args = parser.parse_args()
+    if (args.mem_file is None) == (args.resume is None):
+        parser.error("pass either a memory image or --resume FILE")
+    if (args.profile or args.cache or args.pipeline) and args.translate:
+        parser.error("--profile, --cache and --pipeline need the interpreter, drop --translate")
+    if args.pipeline:
+        try:
+            parse_config(args.pipeline_config)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.cache:
+        try:
+            for spec in (args.l1i, args.l1d) + ((args.l2,) if args.l2.lower() != "none" else ()):
+                parse_spec(spec)
+        except ValueError as e:
+            parser.error(str(e))
 
-    #     if instr.mnemonic == "HLT"
-    #         break
+    run_case(args)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,578 @@
+#Lockstep engine: runs one program in many independent contexts ("lanes") at once
+#with NumPy array operations, for parameter sweeps over registers or memory.
+#
+#    eng = Lockstep(mem, lanes=1000)          # mem: Memory with the program loaded
+#    eng.set_reg("eax", range(1000))          # per-lane initial values
+#    eng.run()
+#    eng.reg("ebx")                           # -> array of 1000 final values
+import sys
+import time
+import argparse
+
+try:
+    import numpy as np
+except ImportError: #optional: only this module needs it
+    np = None
+
+from registers import Registers, REG32, FLAG_NAMES, SIZE_MASK, PARITY, CS, reg_slot, load_sregs
+from memory import Memory, PAGE_SHIFT, PAGE_SIZE, PAGE_MASK, ADDR_MASK, load_mem_file
+from decoder import DecodeCache, DecodeError
+from execute import ADD_OPCODES, MOV_OPCODES, XCHG_OPCODE, CMPXCHG_OPCODE, JMP_OPCODE, JNE_OPCODE, HLT_OPCODE
+from utils import decode_modrm, get_operand_size, sext, ea_parts
+from simulator import _reg_name
+
+OP_NONE, OP_ADD, OP_SUB = 0, 1, 2 #pending flag record, see LazyFlags
+ZF = FLAG_NAMES.index("ZF")
+
+class Lockstep:
+    """
+    N copies of one machine stored as arrays: gpr (N, 8) uint32, sreg (N, 6),
+    mm (N, 8) uint64, eip/halted (N,), flags as a lazy record per lane (op,
+    operands, result, size) plus (N, 7) flag bits, and memory as a page table
+    of (N, PAGE_SIZE) byte arrays that are copied from the template on first
+    use. Every step runs the lowest EIP among the live lanes for all lanes
+    sitting at it, so lanes split when a JNE goes different ways and merge
+    again where their paths meet.
+
+    Instructions are decoded once from the template memory. A lane that
+    writes to a page holding decoded code, or whose own bytes differ from
+    the template where an instruction is decoded, is detached: it leaves
+    the arrays and finishes on the scalar interpreter with exact semantics.
+    """
+    def __init__(self, mem, lanes, state=None):
+        if np is None:
+            raise ImportError("lockstep execution needs NumPy (pip install numpy)")
+        state = state if state is not None else Registers()
+        n = self.n = lanes
+        self.template = mem
+        self.cache = DecodeCache(mem) #decodes the template; lanes never write to it
+        self.handlers = {}            #eip -> vector handler(eng, lanes)
+        self.eip = np.full(n, state.eip, np.uint64)
+        self.gpr = np.tile(np.array(state.gpr, np.uint32), (n, 1))
+        self.sreg = np.tile(np.array(state.sreg, np.uint16), (n, 1))
+        self.mm = np.tile(np.array(state.mm, np.uint64), (n, 1))
+        self.halted = np.full(n, state.halted, bool)
+        values, op, a, b, res, size = state.flags.snapshot()
+        self.fl_values = np.tile(np.array([values[f] for f in FLAG_NAMES], np.uint8), (n, 1))
+        self.fl_op = np.full(n, {None: OP_NONE, "add": OP_ADD, "sub": OP_SUB, "cmp": OP_SUB}[op], np.uint8)
+        self.fl_a = np.full(n, a & 0xFFFFFFFF, np.uint64)
+        self.fl_b = np.full(n, b & 0xFFFFFFFF, np.uint64)
+        self.fl_res = np.full(n, res & 0xFFFFFFFFFFFFFFFF, np.uint64)
+        self.fl_size = np.full(n, size, np.uint8)
+        self.pages = {}   #page number -> (N, PAGE_SIZE) uint8
+        self.defined = {} #page number -> (N, PAGE_SIZE) bool
+        self.retired = np.zeros(n, np.int64)
+        self.attached = np.ones(n, bool)
+        self.detached = {} #lane -> (Registers, Memory) finishing on the scalar interpreter
+        self.errors = {}   #lane -> DecodeError message of a lane that stopped on undecodable bytes
+
+    #Per-lane setup and inspection
+    def _values(self, values):
+        if np.isscalar(values):
+            return np.full(self.n, values, np.uint64)
+        values = np.asarray(list(values) if isinstance(values, range) else values).astype(np.uint64)
+        if values.shape != (self.n,):
+            raise ValueError(f"expected {self.n} values, got shape {values.shape}")
+        return values
+
+    def set_reg(self, name, values):
+        """Sets a register in every lane: one value for all or one per lane."""
+        kind, idx, size = _reg_name(name)
+        values = self._values(values)
+        if kind == "gpr":
+            self._write_reg(np.arange(self.n), idx, size, values)
+        elif kind == "eip":
+            self.eip[:] = values & ADDR_MASK
+        else:
+            getattr(self, kind)[:, idx] = values & (0xFFFF if kind == "sreg" else SIZE_MASK[8])
+
+    def reg(self, name):
+        """The register in every lane as an array (detached lanes included)."""
+        kind, idx, size = _reg_name(name)
+        if kind == "gpr":
+            g, shift, mask = reg_slot(idx, size)
+            return (self.gpr[:, g].astype(np.uint64) >> np.uint64(shift)) & np.uint64(mask)
+        if kind == "eip":
+            return self.eip.copy()
+        return getattr(self, kind)[:, idx].copy()
+
+    def flag(self, name):
+        """One flag in every lane as an array of 0/1."""
+        i = FLAG_NAMES.index(name)
+        out = self.fl_values[:, i].copy()
+        pending = np.flatnonzero(self.fl_op != OP_NONE)
+        if name != "DF" and pending.size:
+            out[pending] = self._compute_flag(pending, name)
+        return out
+
+    def write_mem(self, addr, values, size=4, lanes=None):
+        """Little endian write of per-lane (or one shared) values at addr."""
+        lanes = np.arange(self.n) if lanes is None else np.asarray(lanes, np.intp)
+        values = self._values(values)[lanes]
+        self._scatter(lanes, np.full(lanes.size, addr & ADDR_MASK, np.uint64), values, size)
+
+    def read_mem(self, addr, size=4):
+        """Little endian value at addr in every lane."""
+        lanes = np.arange(self.n)
+        out = self._gather(lanes, np.full(self.n, addr & ADDR_MASK, np.uint64), size)
+        for lane, (_, mem) in self.detached.items():
+            out[lane] = mem.read(addr, size)
+        return out
+
+    def lane(self, i):
+        """Lane i as a scalar (Registers, Memory) pair."""
+        if i in self.detached:
+            return self.detached[i]
+        return self._export(i)
+
+    #Execution
+    def run(self, max_instrs=None):
+        """
+        Runs every lane until HLT, max_instrs instructions or a decode error
+        (recorded in self.errors). Returns the per-lane retired counts (also
+        kept in self.retired).
+        """
+        limit = max_instrs
+        live = None
+        while True:
+            if live is None or self._changed:
+                self._changed = False
+                ok = self.attached & ~self.halted
+                if limit is not None:
+                    ok &= self.retired < limit
+                live = np.flatnonzero(ok)
+                if not live.size:
+                    break
+            eips = self.eip[live]
+            pc = int(eips.min())
+            lanes = live if eips[0] == pc and (eips == pc).all() else live[eips == pc]
+            handler = self.handlers.get(pc)
+            if handler is None:
+                try:
+                    handler = self._decode(pc)
+                except DecodeError as e:
+                    for lane in lanes:
+                        self.errors[int(lane)] = str(e)
+                    self.attached[lanes] = False
+                    self._changed = True
+                    continue
+                if self._changed: #the decode check detached some lanes
+                    continue
+            handler(self, lanes)
+            if self._changed: #lanes detached by the handler have not executed it
+                lanes = lanes[self.attached[lanes]]
+            self.retired[lanes] += 1
+            if limit is not None and (self.retired[lanes] >= limit).any():
+                self._changed = True
+        self._finish_detached(limit)
+        return self.retired
+
+    _changed = False
+
+    def _decode(self, pc):
+        instr = self.cache.fetch(pc)
+        #lanes whose own copy of the instruction bytes differs run it on their own
+        for addr in range(pc, pc + instr.instr_len):
+            page = self.pages.get((addr & ADDR_MASK) >> PAGE_SHIFT)
+            if page is not None:
+                differs = page[:, addr & PAGE_MASK] != self.template.read(addr, 1)
+                self._detach(np.flatnonzero(differs & self.attached & ~self.halted))
+        handler = self.handlers[pc] = vector_bind(instr)
+        return handler
+
+    def _detach(self, lanes):
+        """Moves lanes (not yet executed their current instruction) to the scalar interpreter."""
+        for lane in lanes:
+            lane = int(lane)
+            if self.attached[lane]:
+                self.detached[lane] = self._export(lane)
+                self.attached[lane] = False
+                self._changed = True
+
+    def _finish_detached(self, limit):
+        from interpreter import run
+        for lane, (state, mem) in self.detached.items():
+            budget = None if limit is None else max(limit - int(self.retired[lane]), 0)
+            if not state.halted and budget != 0:
+                try:
+                    self.retired[lane] += run(state, mem, DecodeCache(mem), budget)
+                except DecodeError as e:
+                    self.errors[lane] = str(e) #retired then misses the scalar part
+            self._import(lane, state)
+
+    #Lane <-> scalar machine
+    def _export(self, i):
+        state = Registers()
+        state.eip = int(self.eip[i])
+        state.gpr[:] = [int(v) for v in self.gpr[i]]
+        load_sregs(state, [int(v) for v in self.sreg[i]])
+        state.mm[:] = [int(v) for v in self.mm[i]]
+        op = {OP_NONE: None, OP_ADD: "add", OP_SUB: "sub"}[int(self.fl_op[i])]
+        values = {name: int(v) for name, v in zip(FLAG_NAMES, self.fl_values[i])}
+        state.flags.restore((values, op, int(self.fl_a[i]), int(self.fl_b[i]), int(self.fl_res[i]), int(self.fl_size[i])))
+        state.halted = bool(self.halted[i])
+        mem = Memory()
+        for page_no in set(self.template.pages) | set(self.pages):
+            if page_no in self.pages:
+                data, mask = self.pages[page_no][i].tobytes(), self.defined[page_no][i].astype(np.uint8).tobytes()
+            else:
+                data, mask = self.template.pages[page_no], self.template.defined[page_no]
+            if 1 in mask: #Memory only holds pages that were loaded or written
+                mem.pages[page_no] = bytearray(data)
+                mem.defined[page_no] = bytearray(mask)
+        return state, mem
+
+    def _import(self, i, state):
+        self.eip[i] = state.eip
+        self.gpr[i] = state.gpr
+        self.sreg[i] = state.sreg
+        self.mm[i] = state.mm
+        self.halted[i] = state.halted
+        values, op, a, b, res, size = state.flags.snapshot()
+        self.fl_values[i] = [values[f] for f in FLAG_NAMES]
+        self.fl_op[i] = {None: OP_NONE, "add": OP_ADD, "sub": OP_SUB, "cmp": OP_SUB}[op]
+        self.fl_a[i], self.fl_b[i] = a & SIZE_MASK[8], b & SIZE_MASK[8]
+        self.fl_res[i], self.fl_size[i] = res & SIZE_MASK[8], size
+
+    #Registers and flags
+    def _read_reg(self, lanes, idx, size):
+        g, shift, mask = reg_slot(idx, size)
+        val = self.gpr[lanes, g].astype(np.uint64)
+        if shift:
+            val >>= np.uint64(shift)
+        return val & np.uint64(mask)
+
+    def _write_reg(self, lanes, idx, size, val):
+        g, shift, mask = reg_slot(idx, size)
+        if size == 4:
+            self.gpr[lanes, g] = val & np.uint64(0xFFFFFFFF)
+            return
+        keep = np.uint64(0xFFFFFFFF ^ (mask << shift))
+        cur = self.gpr[lanes, g].astype(np.uint64)
+        self.gpr[lanes, g] = (cur & keep) | ((val & np.uint64(mask)) << np.uint64(shift))
+
+    def _record(self, lanes, a, b, res, size, op):
+        self.fl_op[lanes] = op
+        self.fl_a[lanes] = a
+        self.fl_b[lanes] = b
+        self.fl_res[lanes] = res
+        self.fl_size[lanes] = size
+
+    def _compute_flag(self, lanes, name):
+        """LazyFlags._compute for the pending records of lanes."""
+        size = self.fl_size[lanes].astype(np.uint64)
+        mask = (np.uint64(1) << (size * np.uint64(8))) - np.uint64(1) #sizes are 1, 2 or 4
+        sign = np.uint64(1) << (size * np.uint64(8) - np.uint64(1))
+        res = self.fl_res[lanes] & mask
+        if name == "ZF":
+            return (res == 0).astype(np.uint8)
+        if name == "SF":
+            return ((res & sign) != 0).astype(np.uint8)
+        if name == "PF":
+            return _PARITY[(res & np.uint64(0xFF)).astype(np.intp)]
+        a, b = self.fl_a[lanes] & mask, self.fl_b[lanes] & mask
+        if name == "AF":
+            return (((a ^ b ^ res) & np.uint64(0x10)) != 0).astype(np.uint8)
+        add = self.fl_op[lanes] == OP_ADD
+        if name == "CF":
+            return np.where(add, res < a, a < b).astype(np.uint8)
+        overflow = np.where(add, (a ^ res) & (b ^ res), (a ^ b) & (a ^ res))
+        return ((overflow & sign) != 0).astype(np.uint8)
+
+    def _zf(self, lanes):
+        zf = self.fl_values[lanes, ZF]
+        pending = self.fl_op[lanes] != OP_NONE
+        if pending.any():
+            zf = np.where(pending, self._compute_flag(lanes, "ZF"), zf)
+        return zf
+
+    #Memory
+    def _store(self, page_no):
+        """(N, PAGE_SIZE) bytes and defined mask of a page, copied from the template on first use."""
+        page = self.pages.get(page_no)
+        if page is None:
+            src = self.template.pages.get(page_no)
+            if src is None:
+                page = np.zeros((self.n, PAGE_SIZE), np.uint8)
+                mask = np.zeros((self.n, PAGE_SIZE), bool)
+            else:
+                page = np.tile(np.frombuffer(bytes(src), np.uint8), (self.n, 1))
+                mask = np.tile(np.frombuffer(bytes(self.template.defined[page_no]), np.uint8).astype(bool), (self.n, 1))
+            self.pages[page_no] = page
+            self.defined[page_no] = mask
+        return page
+
+    def _split(self, addr, size):
+        """(page numbers, offsets, single page number or None) per byte, shaped (len(addr), size)."""
+        a = (addr[:, None] + _BYTE_OFFSETS[:size]) & np.uint64(ADDR_MASK)
+        page_nos = (a >> np.uint64(PAGE_SHIFT)).astype(np.int64)
+        first = int(page_nos[0, 0])
+        return page_nos, (a & np.uint64(PAGE_MASK)).astype(np.intp), first if (page_nos == first).all() else None
+
+    def _gather(self, lanes, addr, size):
+        if not lanes.size:
+            return np.zeros(0, np.uint64)
+        page_nos, offs, single = self._split(addr, size)
+        rows = lanes[:, None]
+        if single is not None:
+            out = self._store(single)[rows, offs]
+        else:
+            rows = np.broadcast_to(rows, offs.shape)
+            out = np.empty(offs.shape, np.uint8)
+            for page_no in np.unique(page_nos):
+                sel = page_nos == page_no
+                out[sel] = self._store(int(page_no))[rows[sel], offs[sel]]
+        return (out.astype(np.uint64) << _BYTE_SHIFTS[:size]).sum(axis=1, dtype=np.uint64)
+
+    def _scatter(self, lanes, addr, val, size):
+        if not lanes.size:
+            return
+        page_nos, offs, single = self._split(addr, size)
+        rows = lanes[:, None]
+        data = ((val[:, None] >> _BYTE_SHIFTS[:size]) & np.uint64(0xFF)).astype(np.uint8)
+        if single is not None:
+            self._store(single)[rows, offs] = data
+            self.defined[single][rows, offs] = True
+            return
+        rows = np.broadcast_to(rows, offs.shape)
+        for page_no in np.unique(page_nos):
+            sel = page_nos == page_no
+            page_no = int(page_no)
+            self._store(page_no)[rows[sel], offs[sel]] = data[sel]
+            self.defined[page_no][rows[sel], offs[sel]] = True
+
+    def _writable(self, lanes, addr, size):
+        """Detaches lanes about to write to a page holding decoded code; returns the rest."""
+        code = self.template.code_pages
+        if not code or not lanes.size:
+            return lanes, addr
+        first = addr >> np.uint64(PAGE_SHIFT)
+        last = ((addr + np.uint64(size - 1)) & np.uint64(ADDR_MASK)) >> np.uint64(PAGE_SHIFT)
+        lo, hi = int(min(first.min(), last.min())), int(max(first.max(), last.max()))
+        if not any(lo <= page_no <= hi for page_no in code): #usual case: nowhere near the code
+            return lanes, addr
+        pages = list(code)
+        hit = np.isin(first, pages) | np.isin(last, pages)
+        if not hit.any():
+            return lanes, addr
+        self._detach(lanes[hit])
+        return lanes[~hit], addr[~hit]
+
+
+#Vector handlers: vector_bind() resolves an instruction like execute.bind()
+#and returns handler(eng, lanes) applying it to the lanes sitting at its EIP.
+if np is not None:
+    _BYTE_SHIFTS = np.arange(0, 64, 8, dtype=np.uint64)
+    _BYTE_OFFSETS = np.arange(8, dtype=np.uint64)
+    _PARITY = np.frombuffer(PARITY, np.uint8)
+
+def _vaddr(eng, lanes, ea):
+    base, index, scale, disp, seg = ea
+    addr = np.full(lanes.size, disp & ADDR_MASK, np.uint64)
+    if base is not None:
+        addr += eng.gpr[lanes, base]
+    if index is not None:
+        addr += eng.gpr[lanes, index].astype(np.uint64) << np.uint64(scale)
+    addr += eng.sreg[lanes, seg].astype(np.uint64) << np.uint64(16)
+    return addr & np.uint64(ADDR_MASK)
+
+def _v_add(dst, src, size, nxt):
+    """dst/src: ("reg", idx), ("mem", ea) or ("imm", value)."""
+    mask = np.uint64(SIZE_MASK[size])
+    def handler(eng, lanes):
+        addr = None
+        if dst[0] == "mem" or src[0] == "mem":
+            addr = _vaddr(eng, lanes, dst[1] if dst[0] == "mem" else src[1])
+        if dst[0] == "mem":
+            lanes, addr = eng._writable(lanes, addr, size)
+            a = eng._gather(lanes, addr, size)
+        else:
+            a = eng._read_reg(lanes, dst[1], size)
+        if src[0] == "imm":
+            b = np.full(lanes.size, src[1] & SIZE_MASK[8], np.uint64)
+        elif src[0] == "reg":
+            b = eng._read_reg(lanes, src[1], size)
+        else:
+            b = eng._gather(lanes, addr, size)
+        res = a + b
+        eng._record(lanes, a, b, res, size, OP_ADD)
+        if dst[0] == "mem":
+            eng._scatter(lanes, addr, res & mask, size)
+        else:
+            eng._write_reg(lanes, dst[1], size, res)
+        eng.eip[lanes] = nxt
+    return handler
+
+def _bind_add(instr):
+    op = instr.opcode
+    size = get_operand_size(op, instr.prefix_mux)
+    mod, reg, rm = decode_modrm(instr.modrm)
+    nxt = instr.eip_new
+    rm_operand = ("reg", rm) if mod == 0b11 else ("mem", ea_parts(instr))
+    if op in (0x04, 0x05):
+        return _v_add(("reg", 0), ("imm", instr.imm), size, nxt)
+    if op in (0x80, 0x81, 0x83):
+        src = sext(instr.imm, 8) if op == 0x83 else instr.imm
+        return _v_add(rm_operand, ("imm", src), size, nxt)
+    if op in (0x00, 0x01):
+        return _v_add(rm_operand, ("reg", reg), size, nxt)
+    return _v_add(("reg", reg), rm_operand, size, nxt)
+
+def _bind_mov(instr):
+    op = instr.opcode
+    size = get_operand_size(op, instr.prefix_mux)
+    mod, reg, rm = decode_modrm(instr.modrm)
+    nxt = instr.eip_new
+    imm = np.uint64(instr.imm & SIZE_MASK[8])
+
+    if 0xB0 <= op <= 0xBF or (op in (0xC6, 0xC7) and mod == 0b11): # MOV reg, imm
+        if op in (0xC6, 0xC7):
+            idx, width = rm, size
+        else:
+            idx, width = op & 0x07, 1 if op <= 0xB7 else size
+        def handler(eng, lanes):
+            eng._write_reg(lanes, idx, width, np.full(lanes.size, imm, np.uint64))
+            eng.eip[lanes] = nxt
+        return handler
+
+    if op in (0xC6, 0xC7):
+        ea = ea_parts(instr)
+        def handler(eng, lanes):
+            lanes, addr = eng._writable(lanes, _vaddr(eng, lanes, ea), size)
+            eng._scatter(lanes, addr, np.full(lanes.size, imm, np.uint64), size)
+            eng.eip[lanes] = nxt
+        return handler
+
+    if op in (0x8E, 0x6F):
+        field, idx, width = ("sreg", reg % 6, 2) if op == 0x8E else ("mm", reg, 8)
+        ea = None if mod == 0b11 else ea_parts(instr)
+        def handler(eng, lanes):
+            if ea is not None:
+                val = eng._gather(lanes, _vaddr(eng, lanes, ea), width)
+            elif op == 0x8E:
+                val = eng._read_reg(lanes, rm, 2)
+            else:
+                val = eng.mm[lanes, rm]
+            getattr(eng, field)[lanes, idx] = val
+            eng.eip[lanes] = nxt
+        return handler
+
+    return _v_skip(nxt) #0x88-0x8B, as in execute.bind_MOV
+
+def _bind_xchg(instr):
+    mod, reg, rm = decode_modrm(instr.modrm)
+    nxt = instr.eip_new
+    ea = None if mod == 0b11 else ea_parts(instr)
+    def handler(eng, lanes):
+        if ea is None:
+            val_r = eng._read_reg(lanes, reg, 1)
+            val_rm = eng._read_reg(lanes, rm, 1)
+            eng._write_reg(lanes, rm, 1, val_r)
+        else:
+            lanes, addr = eng._writable(lanes, _vaddr(eng, lanes, ea), 1)
+            val_r = eng._read_reg(lanes, reg, 1)
+            val_rm = eng._gather(lanes, addr, 1)
+            eng._scatter(lanes, addr, val_r, 1)
+        eng._write_reg(lanes, reg, 1, val_rm)
+        eng.eip[lanes] = nxt
+    return handler
+
+def _bind_cmpxchg(instr):
+    mod, reg, rm = decode_modrm(instr.modrm)
+    size = get_operand_size(instr.opcode, instr.prefix_mux)
+    nxt = instr.eip_new
+    ea = None if mod == 0b11 else ea_parts(instr)
+    def handler(eng, lanes):
+        if ea is not None:
+            lanes, addr = eng._writable(lanes, _vaddr(eng, lanes, ea), size)
+        acc = eng._read_reg(lanes, 0, size)
+        dest = eng._gather(lanes, addr, size) if ea is not None else eng._read_reg(lanes, rm, size)
+        src = eng._read_reg(lanes, reg, size)
+        eng._record(lanes, acc, dest, acc - dest, size, OP_SUB)
+        equal = acc == dest
+        #masked writeback: r/m <- src where equal, accumulator <- r/m elsewhere
+        hit, miss = lanes[equal], lanes[~equal]
+        if ea is not None:
+            eng._scatter(hit, addr[equal], src[equal], size)
+        else:
+            eng._write_reg(hit, rm, size, src[equal])
+        eng._write_reg(miss, 0, size, dest[~equal])
+        eng.eip[lanes] = nxt
+    return handler
+
+def _bind_jne(instr):
+    taken = np.uint64((instr.eip_new + sext(instr.imm, 8)) & ADDR_MASK)
+    nxt = np.uint64(instr.eip_new)
+    def handler(eng, lanes):
+        eng.eip[lanes] = np.where(eng._zf(lanes) == 0, taken, nxt)
+    return handler
+
+def _bind_jmp(instr):
+    target, selector = instr.imm & ADDR_MASK, instr.disp & 0xFFFF
+    def handler(eng, lanes):
+        eng.eip[lanes] = target
+        eng.sreg[lanes, CS] = selector
+    return handler
+
+def _bind_hlt(instr):
+    def handler(eng, lanes):
+        eng.halted[lanes] = True
+        eng._changed = True
+    return handler
+
+def _v_skip(nxt):
+    def handler(eng, lanes):
+        eng.eip[lanes] = nxt
+    return handler
+
+def vector_bind(instr):
+    """Vector counterpart of execute.bind(), same opcode priority."""
+    op, ext = instr.opcode, instr.ext_opcode
+    if op in ADD_OPCODES:
+        return _bind_add(instr)
+    if op == CMPXCHG_OPCODE and ext == 1:
+        return _bind_cmpxchg(instr)
+    if op in MOV_OPCODES:
+        return _bind_mov(instr)
+    if op == XCHG_OPCODE:
+        return _bind_xchg(instr)
+    if op == JMP_OPCODE:
+        return _bind_jmp(instr)
+    if op == JNE_OPCODE:
+        return _bind_jne(instr)
+    if op == HLT_OPCODE:
+        return _bind_hlt(instr)
+    return _v_skip(instr.eip_new)
+
+def main():
+    parser = argparse.ArgumentParser(description="run one memory image in many lanes at once (needs NumPy)")
+    parser.add_argument("mem_file", help="memory image (0xADDR: bytes format)")
+    parser.add_argument("-n", "--lanes", type=int, default=1000)
+    parser.add_argument("--vary", action="append", default=[], metavar="REG",
+                        help="lane i starts with REG = i (repeatable)")
+    parser.add_argument("--max-instrs", type=int, default=None, help="per lane")
+    parser.add_argument("--csv", metavar="FILE", help="write each lane's final registers to FILE")
+    args = parser.parse_args()
+
+    mem = Memory()
+    load_mem_file(mem, args.mem_file)
+    eng = Lockstep(mem, args.lanes)
+    for name in args.vary:
+        eng.set_reg(name, range(args.lanes))
+    start = time.perf_counter()
+    retired = eng.run(args.max_instrs)
+    elapsed = time.perf_counter() - start
+    total = int(retired.sum())
+    print(f"{args.lanes} lanes, {total} instructions in {elapsed:.3f}s ({total / elapsed if elapsed else 0:,.0f} instr/s)")
+    print(f"halted: {int(eng.halted.sum())}, detached to the scalar interpreter: {len(eng.detached)}")
+    if args.csv:
+        names = ["eip"] + REG32
+        cols = [eng.reg(r) for r in names]
+        with open(args.csv, "w") as f:
+            f.write("lane,retired,halted," + ",".join(names) + "\n")
+            for i in range(args.lanes):
+                f.write(f"{i},{retired[i]},{int(eng.halted[i])}," + ",".join(f"0x{int(c[i]):08X}" for c in cols) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
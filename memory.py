@@ -1,51 +1,230 @@
-def load_mem_file(mem, mem_file):
-    with open(mem_file, 'r') as f:
-        hex_str = ""
-        hex_part2 = ""
-        cur_addr = None
-        prev_addr_num = None
-        broken_line = False
-        prev_line = None
-        for line in f:
-
-            #Remove Comments / Whitespace
-            l = line.split('//')[0].strip()
-            if not l:
-                continue #skip empty lines
-            
-            #Parse
-            if l.startswith("0x"): #new address line
-                addr_str, hex_str = l.split(":", 1) #split line once into two
-                addr_num = int(addr_str, 16)
-                prev_addr_num = addr_num
-            else: #continuation of previous hex
-                hex_str = l.strip()
-                broken_line = True
-
-            #Convert hex into bytes
-            byte_list = hex_str.split()
-            for i in byte_list:
-                if broken_line:
+#Paged guest memory: fixed size bytearray pages behind a page table
+import os
+import mmap
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+ADDR_MASK = 0xFFFFFFFF
+
+ZERO_PAGE = bytes(PAGE_SIZE) #shared backing for reads of pages that were never written
+_DEFINED = b"\x01" * PAGE_SIZE
+
+class Memory:
+    """
+    Sparse 32-bit guest memory. Pages are allocated on first write; reads of
+    untouched pages return zeros without allocating anything. A per-page mask
+    remembers which bytes were loaded or written so dumps only show those.
+    """
+    def __init__(self):
+        self.pages = {}   #page number -> bytearray(PAGE_SIZE)
+        self.defined = {} #page number -> bytearray mask (1 = loaded/written)
+        self.code_pages = set() #pages holding cached decoded instructions
+        self.code_cache = None  #DecodeCache notified when code_pages are written
+        self.backing = None     #checkpoint mapping the pages may be views of, see checkpoint.py
+
+    def _page(self, page_no):
+        page = self.pages.get(page_no)
+        if page is None:
+            page = self.pages[page_no] = bytearray(PAGE_SIZE)
+            self.defined[page_no] = bytearray(PAGE_SIZE)
+        return page
+
+    def read(self, addr, size):
+        """Little endian read of 'size' bytes as an int."""
+        off = addr & PAGE_MASK
+        if off + size <= PAGE_SIZE:
+            page = self.pages.get((addr & ADDR_MASK) >> PAGE_SHIFT)
+            if page is None:
+                return 0
+            return int.from_bytes(page[off:off + size], "little")
+        return int.from_bytes(self.read_bytes(addr, size), "little")
+
+    def write(self, addr, val, size):
+        """Little endian write of the low 'size' bytes of val."""
+        addr &= ADDR_MASK
+        off = addr & PAGE_MASK
+        if off + size <= PAGE_SIZE:
+            page_no = addr >> PAGE_SHIFT
+            page = self.pages.get(page_no) or self._page(page_no)
+            page[off:off + size] = (val & ((1 << (size * 8)) - 1)).to_bytes(size, "little")
+            self.defined[page_no][off:off + size] = _DEFINED[:size]
+            if page_no in self.code_pages: #self-modifying code
+                self.code_cache.invalidate(addr, size)
+        else:
+            self.write_bytes(addr, (val & ((1 << (size * 8)) - 1)).to_bytes(size, "little"))
+
+    def read_bytes(self, addr, length):
+        """Returns 'length' raw bytes starting at addr (zeros where unmapped)."""
+        out = bytearray()
+        while length > 0:
+            addr &= ADDR_MASK
+            off = addr & PAGE_MASK
+            n = min(length, PAGE_SIZE - off)
+            page = self.pages.get(addr >> PAGE_SHIFT, ZERO_PAGE)
+            out += page[off:off + n]
+            addr += n
+            length -= n
+        return bytes(out)
+
+    def write_bytes(self, addr, data):
+        """Copies raw bytes into memory, splitting at page boundaries."""
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            addr &= ADDR_MASK
+            off = addr & PAGE_MASK
+            n = min(len(data) - pos, PAGE_SIZE - off)
+            page_no = addr >> PAGE_SHIFT
+            self._page(page_no)[off:off + n] = data[pos:pos + n]
+            self.defined[page_no][off:off + n] = _DEFINED[:n]
+            if page_no in self.code_pages:
+                self.code_cache.invalidate(addr, n)
+            addr += n
+            pos += n
+
+    def read_defined(self, addr, length):
+        """The defined mask (1 = loaded/written) of 'length' bytes from addr."""
+        out = bytearray()
+        while length > 0:
+            addr &= ADDR_MASK
+            off = addr & PAGE_MASK
+            n = min(length, PAGE_SIZE - off)
+            out += self.defined.get(addr >> PAGE_SHIFT, ZERO_PAGE)[off:off + n]
+            addr += n
+            length -= n
+        return bytes(out)
+
+    def restore_bytes(self, addr, data, mask):
+        """write_bytes() that also puts back an earlier defined mask (undo logs)."""
+        self.write_bytes(addr, data)
+        pos = 0
+        while pos < len(mask):
+            addr &= ADDR_MASK
+            off = addr & PAGE_MASK
+            n = min(len(mask) - pos, PAGE_SIZE - off)
+            self.defined[addr >> PAGE_SHIFT][off:off + n] = mask[pos:pos + n]
+            addr += n
+            pos += n
+
+    def restore_page(self, page_no, data, mask):
+        """Replaces a whole page and its defined mask; data None removes the page (snapshot restores)."""
+        if page_no in self.code_pages:
+            self.code_cache.invalidate(page_no << PAGE_SHIFT, PAGE_SIZE)
+        if data is None:
+            self.pages.pop(page_no, None)
+            self.defined.pop(page_no, None)
+            return
+        self._page(page_no)[:] = data
+        self.defined[page_no][:] = mask
+
+    def is_defined(self, addr):
+        mask = self.defined.get((addr & ADDR_MASK) >> PAGE_SHIFT)
+        return mask is not None and mask[addr & PAGE_MASK] == 1
+
+    def next_defined(self, addr):
+        """Lowest loaded/written address >= addr, or None if there is none."""
+        addr &= ADDR_MASK
+        for page_no in sorted(p for p in self.defined if p >= addr >> PAGE_SHIFT):
+            start = addr & PAGE_MASK if page_no == addr >> PAGE_SHIFT else 0
+            off = self.defined[page_no].find(1, start)
+            if off != -1:
+                return (page_no << PAGE_SHIFT) + off
+        return None
+
+    def regions(self):
+        """Yields (start, end) for each run of consecutive loaded/written bytes, in address order."""
+        start = end = None
+        for page_no in sorted(self.defined):
+            mask = self.defined[page_no]
+            base = page_no << PAGE_SHIFT
+            off = mask.find(1)
+            while off != -1:
+                if base + off != end: #not a continuation of the run from the previous page
+                    if start is not None:
+                        yield start, end
+                    start = base + off
+                stop = mask.find(0, off)
+                if stop == -1:
+                    end = base + PAGE_SIZE
                     break
-                else:
-                    mem[addr_num] = i
-                    addr_num += 1
-            
-            if broken_line:
-                count = 0
-                for b in reversed(byte_list):
-                    bytes_num = len(prev_line) 
-                    blah = prev_addr_num + bytes_num + count
-                    mem[prev_addr_num + bytes_num + count] = b
-                    count += 1
-                    broken_line = False
-            prev_line = byte_list
+                end = base + stop
+                off = mask.find(1, stop)
+        if start is not None:
+            yield start, end
+
+    def page_items(self, page_no):
+        """Yields (addr, byte) for the loaded/written bytes of one page."""
+        page = self.pages[page_no]
+        mask = self.defined[page_no]
+        base = page_no << PAGE_SHIFT
+        off = mask.find(1)
+        while off != -1:
+            yield base + off, page[off]
+            off = mask.find(1, off + 1)
+
+    def items(self):
+        """Yields (addr, byte) for every loaded/written byte in address order."""
+        for page_no in sorted(self.pages):
+            yield from self.page_items(page_no)
 
-            with open("mem_dump.txt", "w") as dump:
-                for addr, byte in sorted(mem.items()):
-                    dump.write(f"{addr:08X}: {byte}\n")
+    def __bool__(self):
+        return bool(self.pages)
 
 
+def load_mem_file(mem, mem_file, dump_file=None):
+    """
+    Loads a text image: "0xADDR: hex bytes" lines, '//' comments. A line
+    without an address continues right after the bytes of the previous one.
+    Contiguous lines are merged and copied into memory in one go. Writes
+    dump_file ("ADDR: byte" per loaded byte) once at the end if given.
+    Returns the number of bytes loaded.
+    """
+    loaded = 0
+    run_addr = None    #start of the run being collected
+    run = bytearray()
+    with open(mem_file, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            l = line.split("//", 1)[0].strip()
+            if not l:
+                continue #skip empty lines
+            if l[:2].lower() == "0x": #new address line
+                addr_str, _, hex_str = l.partition(":")
+                addr = int(addr_str, 16)
+            else: #continuation of the previous line
+                if run_addr is None:
+                    raise ValueError(f"{mem_file}:{line_no}: continuation line before any address")
+                addr = run_addr + len(run)
+                hex_str = l
+            try:
+                data = bytes.fromhex(hex_str)
+            except ValueError:
+                raise ValueError(f"{mem_file}:{line_no}: bad hex bytes {hex_str.strip()!r}") from None
+            if run_addr is not None and addr != run_addr + len(run):
+                mem.write_bytes(run_addr, run)
+                loaded += len(run)
+                run = bytearray()
+            if not run:
+                run_addr = addr
+            run += data
+    if run:
+        mem.write_bytes(run_addr, run)
+        loaded += len(run)
+    if dump_file is not None:
+        write_mem_dump(mem, dump_file)
+    return loaded
 
+def load_binary_file(mem, path, load_addr=0, dump_file=None):
+    """Maps a raw flat binary image and copies it into memory at load_addr."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as image:
+                mem.write_bytes(load_addr, image)
+    if dump_file is not None:
+        write_mem_dump(mem, dump_file)
+    return size
 
-                
+def write_mem_dump(mem, dump_file="mem_dump.txt"):
+    with open(dump_file, "w") as dump:
+        dump.write("".join(f"{addr:08X}: {byte:02x}\n" for addr, byte in mem.items()))
@@ -0,0 +1,102 @@
+#Precomputed opcode property tables for the length decoder
+from collections import namedtuple
+
+#Prefix classes (PREFIX_CLASS[byte])
+PFX_NONE   = 0
+PFX_SEG    = 1 #segment register override, prefix_mux[0]
+PFX_OPSIZE = 2 #operand size override, prefix_mux[1]
+PFX_REP    = 3 #rep, prefix_mux[2]
+PFX_LOCK   = 4 #lock, accepted and otherwise ignored
+
+#Immediate types (imm_type field)
+IMM_REGULAR = 0b00
+IMM_REL     = 0b01
+IMM_DOUBLE  = 0b10
+IMM_UNUSED  = 0b11
+
+PREFIXES = {
+    0xF3: PFX_REP,
+    0xF0: PFX_LOCK,
+    0x66: PFX_OPSIZE,
+    0x26: PFX_SEG, 0x2E: PFX_SEG, 0x36: PFX_SEG, 0x3E: PFX_SEG, 0x64: PFX_SEG, 0x65: PFX_SEG,
+}
+
+#Segment override prefix -> segment register number (ES CS SS DS FS GS)
+SEG_OVERRIDE = {0x26: 0, 0x2E: 1, 0x36: 2, 0x3E: 3, 0x64: 4, 0x65: 5}
+
+#Opcodes followed by a modrm byte (0F map opcodes without the 0x0F byte)
+MODRM_ONE_BYTE = (0x00, 0x01, 0x02, 0x03, 0x08, 0x09, 0x0A, 0x0B, 0x20, 0x21, 0x22, 0x23, 0x80, 0x81, 0x83, 0x86, 0x87, 0x88, 0x89, 0x8A, 0x8B, 0x8C, 0x8E, 0x8F, 0xC0, 0xC1, 0xC6, 0xC7, 0xD0, 0xD1, 0xD2, 0xD3, 0xF6, 0xF7, 0xFF)
+MODRM_TWO_BYTE = (0x42, 0x63, 0x6B, 0x68, 0x69, 0x6F, 0x7F, 0xB0, 0xB1, 0xBC, 0xFD, 0xFE)
+
+#Immediates: opcode -> (size with 0x66, size without 0x66, imm_type)
+IMM_ONE_BYTE = {}
+for op in range(0xB0, 0xB8):
+    IMM_ONE_BYTE[op] = (1, 1, IMM_REGULAR) #ib
+for op in range(0xB8, 0xC0):
+    IMM_ONE_BYTE[op] = (2, 4, IMM_REGULAR) #cw / cd
+for op in (0x04, 0x0C, 0x24, 0x6A, 0x80, 0x83, 0xC0, 0xC1, 0xC6):
+    IMM_ONE_BYTE[op] = (1, 1, IMM_REGULAR)
+for op in (0x75, 0x77, 0xEB):
+    IMM_ONE_BYTE[op] = (1, 1, IMM_REL)
+for op in (0xC2, 0xCA):
+    IMM_ONE_BYTE[op] = (2, 2, IMM_REGULAR)
+for op in (0x05, 0x0D, 0x25, 0x68, 0x81, 0xC7):
+    IMM_ONE_BYTE[op] = (2, 4, IMM_REGULAR)
+for op in (0xE8, 0xE9):
+    IMM_ONE_BYTE[op] = (2, 4, IMM_REL)
+#Far pointers: the offset is the immediate, the 16-bit selector after it goes to disp
+IMM_ONE_BYTE[0x9A] = (2, 4, IMM_DOUBLE)
+IMM_ONE_BYTE[0xEA] = (2, 4, IMM_DOUBLE)
+SELECTOR_SIZE = 2
+
+IMM_TWO_BYTE = {0x85: (2, 4, IMM_REL), 0x87: (2, 4, IMM_REL)}
+
+#Opcodes that are complete without modrm or immediate
+NO_OPERAND_ONE_BYTE = (
+    0x06, 0x07, 0x0E, 0x16, 0x17, 0x1E, 0x1F, 0x27, 0x2F, 0x37, 0x3F,
+    *range(0x40, 0x62), *range(0x6C, 0x70), *range(0x90, 0x9A), *range(0x9B, 0xA0),
+    0xA4, 0xA5, 0xA6, 0xA7, 0xAA, 0xAB, 0xAC, 0xAD, 0xAE, 0xAF,
+    0xC3, 0xC9, 0xCB, 0xCC, 0xCE, 0xCF, 0xD7, 0xEC, 0xED, 0xEE, 0xEF,
+    0xF4, 0xF5, 0xF8, 0xF9, 0xFA, 0xFB, 0xFC, 0xFD,
+)
+NO_OPERAND_TWO_BYTE = (
+    0x05, 0x06, 0x07, 0x08, 0x09, 0x0B, 0x30, 0x31, 0x32, 0x33, 0x34, 0x35, 0x77,
+    0xA0, 0xA1, 0xA2, 0xA8, 0xA9, 0xAA, *range(0xC8, 0xD0),
+)
+
+#Per-opcode descriptor, OPCODE_TABLE[(ext_opcode << 8) | opcode]
+OpcodeInfo = namedtuple("OpcodeInfo", ["defined", "has_modrm", "imm16", "imm32", "imm_type"])
+
+def _build_opcode_table():
+    table = []
+    for ext, modrm_ops, imm_ops, plain_ops in ((0, MODRM_ONE_BYTE, IMM_ONE_BYTE, NO_OPERAND_ONE_BYTE),
+                                               (1, MODRM_TWO_BYTE, IMM_TWO_BYTE, NO_OPERAND_TWO_BYTE)):
+        for op in range(256):
+            has_modrm = op in modrm_ops
+            imm16, imm32, imm_type = imm_ops.get(op, (0, 0, IMM_REGULAR))
+            defined = has_modrm or op in imm_ops or op in plain_ops
+            if ext == 0 and op == 0x0F:
+                defined = False #escape byte, never looked up as an opcode
+            table.append(OpcodeInfo(defined, has_modrm, imm16, imm32, imm_type))
+    return tuple(table)
+
+#MODRM_TABLE[modrm] = (has_sib, disp_size)
+def _build_modrm_table():
+    table = []
+    for modrm in range(256):
+        mod = (modrm >> 6) & 0b11
+        rm = modrm & 0b111
+        has_sib = rm == 0b100 and mod != 0b11
+        if mod == 0b01:
+            disp = 1
+        elif mod == 0b10 or (mod == 0b00 and rm == 0b101):
+            disp = 4 #mod 00 with a SIB byte has a disp32 only for SIB base 101, see predecode()
+        else:
+            disp = 0
+        table.append((has_sib, disp))
+    return tuple(table)
+
+PREFIX_CLASS = bytes(PREFIXES.get(b, PFX_NONE) for b in range(256))
+OPCODE_TABLE = _build_opcode_table()
+MODRM_TABLE = _build_modrm_table()
+IMM_SIZE_MUX = {0: 0b00, 1: 0b00, 2: 0b01, 4: 0b10}
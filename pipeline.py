@@ -0,0 +1,268 @@
+#In-order pipeline timing model: cycles, CPI and a stall breakdown for any run
+from collections import defaultdict
+
+from hooks import EV_RETIRED
+from instr_class import PREFIX_OPSIZE
+from registers import CS
+from execute import ADD_OPCODES, MOV_OPCODES, XCHG_OPCODE, CMPXCHG_OPCODE, JMP_OPCODE, JNE_OPCODE
+from decoder import needs_modrm
+from utils import decode_modrm, get_operand_size, sext, ea_parts
+
+STAGES = ("fetch", "predecode", "decode", "agen", "execute", "writeback")
+F, PD, D, AG, EX, WB = range(len(STAGES))
+
+PREDICT_NOT_TAKEN = "not-taken" #every taken branch redirects at execute
+PREDICT_BTFN = "btfn"           #backward JNE predicted taken (redirect at decode), forward not taken
+
+DEFAULT_CONFIG = {
+    "fetch": 1, "predecode": 1, "decode": 1, "agen": 1, "execute": 1, "writeback": 1, #cycles per stage
+    "prefix_penalty": 1,  #extra predecode cycles for a 0x66 prefix
+    "escape_penalty": 1,  #extra predecode cycles for a 0x0F two byte opcode
+    "mem_latency": 3,     #extra execute cycles of a memory read (L1 hit when a cache model is attached)
+    "store_latency": 0,   #extra execute cycles of a memory write
+    "forwarding": 1,      #results bypass to execute/agen; 0 = readable after writeback
+    "predict": PREDICT_NOT_TAKEN,
+}
+
+#Stall causes, in the order an instruction's excess cycles are charged to them
+#(latest stage first: back end stalls hide front end ones)
+STALL_CAUSES = ("memory", "data", "prefix", "icache", "branch")
+
+FLAGS = "flags"
+
+def _gpr(idx, size):
+    """Scoreboard entry of a register operand (AH..BH live in EAX..EBX)."""
+    return idx - 4 if size == 1 and idx >= 4 else idx
+
+def operands(instr):
+    """
+    Scoreboard view of an instruction:
+    (sources, destinations, address sources, reads memory, writes memory, branch)
+    with GPR numbers, ("sreg", i), ("mm", i) and FLAGS as resources. branch
+    is None, "jmp" or the target of a JNE.
+    """
+    op = instr.opcode
+    srcs, dsts, agen = set(), set(), set()
+    mem_r = mem_w = False
+    branch = None
+    has_modrm = needs_modrm(op, instr.ext_opcode)
+    mod, reg, rm = decode_modrm(instr.modrm) if has_modrm else (0, 0, 0)
+    is_mem = has_modrm and mod != 0b11
+    if is_mem:
+        base, index, _, _, seg = ea_parts(instr)
+        agen.update(r for r in (base, index) if r is not None)
+        agen.add(("sreg", seg))
+    size = get_operand_size(op, instr.prefix_mux)
+
+    if op == CMPXCHG_OPCODE and instr.ext_opcode:
+        srcs.update((0, _gpr(reg, size)))
+        dsts.update((0, FLAGS))
+        if is_mem:
+            mem_r = mem_w = True
+        else:
+            srcs.add(_gpr(rm, size))
+            dsts.add(_gpr(rm, size))
+    elif op in ADD_OPCODES:
+        dsts.add(FLAGS)
+        if op in (0x04, 0x05):
+            srcs.add(0)
+            dsts.add(0)
+        elif op in (0x80, 0x81, 0x83, 0x00, 0x01): #r/m is the destination
+            if op in (0x00, 0x01):
+                srcs.add(_gpr(reg, size))
+            if is_mem:
+                mem_r = mem_w = True
+            else:
+                srcs.add(_gpr(rm, size))
+                dsts.add(_gpr(rm, size))
+        else: #reg += r/m
+            srcs.add(_gpr(reg, size))
+            dsts.add(_gpr(reg, size))
+            if is_mem:
+                mem_r = True
+            else:
+                srcs.add(_gpr(rm, size))
+    elif op in MOV_OPCODES:
+        if 0xB0 <= op <= 0xBF:
+            dsts.add(_gpr(op & 7, 1 if op <= 0xB7 else size))
+        elif op in (0xC6, 0xC7):
+            if is_mem:
+                mem_w = True
+            else:
+                dsts.add(_gpr(rm, size))
+        elif op == 0x8E:
+            dsts.add(("sreg", reg % 6))
+            if is_mem:
+                mem_r = True
+            else:
+                srcs.add(_gpr(rm, 2))
+        elif op == 0x6F:
+            dsts.add(("mm", reg))
+            if is_mem:
+                mem_r = True
+            else:
+                srcs.add(("mm", rm))
+        #0x88-0x8B are skipped by execute, nothing is read or written
+    elif op == XCHG_OPCODE:
+        srcs.add(_gpr(reg, 1))
+        dsts.add(_gpr(reg, 1))
+        if is_mem:
+            mem_r = mem_w = True
+        else:
+            srcs.add(_gpr(rm, 1))
+            dsts.add(_gpr(rm, 1))
+    elif op == JNE_OPCODE:
+        srcs.add(FLAGS)
+        branch = (instr.eip_new + sext(instr.imm, 8)) & 0xFFFFFFFF
+    elif op == JMP_OPCODE:
+        dsts.add(("sreg", CS))
+        branch = "jmp"
+    return frozenset(srcs), frozenset(dsts), frozenset(agen), mem_r, mem_w, branch
+
+
+class PipelineModel:
+    """
+    Single issue in-order pipeline (fetch, predecode, decode, agen, execute,
+    writeback), one instruction per stage. An instruction waits in a stage
+    while the next one is still occupied, in agen until its address
+    registers are ready and in execute until its sources are ready (register
+    scoreboard). Timing comes from the retired instruction stream, so it is
+    driven by the 'retired' hook and works for any interpreted run.
+
+    With a CacheHierarchy attached before this model, instruction fetch and
+    memory operands also pay the L2/memory latency of their misses.
+    """
+    def __init__(self, config=None, caches=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        cfg = self.config
+        self.lat = [cfg[s] for s in STAGES]
+        self.ideal = max(self.lat) #cycles between completions with no stalls
+        self.caches = caches
+        self.info = {}  #DecodedInstruction -> operands()
+        self.ready = defaultdict(int) #resource -> cycle its latest value can be read
+        self.prev = [0] * len(STAGES) #stage entry cycles of the previous instruction
+        self.prev_done = 0
+        self.redirect = 0 #earliest fetch after the last taken branch
+        self.instructions = 0
+        self.cycles = 0
+        self.stalls = dict.fromkeys(STALL_CAUSES + ("structural", "fill"), 0)
+        self.eip_stalls = defaultdict(int)
+        self._misses = (0, 0, 0) #L1I, L1D, L2 miss counters at the previous instruction
+
+    def attach(self, hooks):
+        hooks.subscribe(EV_RETIRED, self.on_retired)
+
+    def detach(self, hooks):
+        hooks.unsubscribe(EV_RETIRED, self.on_retired)
+
+    def _cache_penalties(self):
+        """(fetch, data) extra cycles from the cache misses of the instruction just retired."""
+        c = self.caches
+        lat = c.latency
+        i_misses, d_misses = c.l1i.misses, c.l1d.misses
+        fetch = (i_misses - self._misses[0]) * lat["memory" if c.l2 is None else "L2"]
+        data = (d_misses - self._misses[1]) * lat["memory" if c.l2 is None else "L2"]
+        l2_misses = 0
+        if c.l2 is not None:
+            l2_misses = c.l2.misses
+            fetch += (c.l2_misses_after_fetch - self._misses[2]) * lat["memory"]
+            data += (l2_misses - c.l2_misses_after_fetch) * lat["memory"]
+        self._misses = (i_misses, d_misses, l2_misses)
+        return fetch, data
+
+    def on_retired(self, state, mem, instr):
+        info = self.info.get(instr)
+        if info is None:
+            info = self.info[instr] = operands(instr)
+        srcs, dsts, agen_srcs, mem_r, mem_w, branch = info
+        cfg, lat, ready, prev = self.config, self.lat, self.ready, self.prev
+        fetch_extra, data_extra = self._cache_penalties() if self.caches is not None else (0, 0)
+
+        #front end
+        f = max(prev[PD], self.redirect)
+        branch_wait = max(0, self.redirect - prev[PD])
+        prefix = cfg["prefix_penalty"] * (instr.prefixes & PREFIX_OPSIZE != 0) + cfg["escape_penalty"] * (instr.ext_opcode == 1)
+        pd = max(f + lat[F] + fetch_extra, prev[D])
+        d = max(pd + lat[PD] + prefix, prev[AG])
+        #address generation waits for its base (and segment) register
+        ag = max(d + lat[D], prev[EX])
+        ag_ready = max((ready[r] for r in agen_srcs), default=0)
+        data_wait = max(0, ag_ready - ag)
+        ag += data_wait
+        #execute waits for its sources
+        ex = max(ag + lat[AG], prev[WB])
+        ex_ready = max((ready[r] for r in srcs), default=0)
+        wait = max(0, ex_ready - ex)
+        data_wait += wait
+        ex += wait
+        mem_cycles = (cfg["mem_latency"] + data_extra if mem_r else 0) + (cfg["store_latency"] if mem_w else 0)
+        ex_done = ex + lat[EX] + mem_cycles
+        wb = max(ex_done, self.prev_done)
+        done = wb + lat[WB]
+
+        avail = ex_done if cfg["forwarding"] else done
+        for r in dsts:
+            ready[r] = avail
+        if branch == "jmp":
+            self.redirect = d + lat[D] #target known at the end of decode
+        elif branch is not None:
+            taken = state.eip != instr.eip_new
+            predicted = cfg["predict"] == PREDICT_BTFN and branch < instr.eip
+            if taken != predicted:
+                self.redirect = ex_done #mispredicted, resolved in execute
+            elif taken:
+                self.redirect = d + lat[D]
+        self.prev = [f, pd, d, ag, ex, wb]
+
+        #stall accounting: cycles beyond the ideal spacing, charged back to front
+        if self.instructions == 0:
+            self.stalls["fill"] += max(0, done - self.ideal)
+            excess = 0
+        else:
+            excess = max(0, done - self.prev_done - self.ideal)
+        if excess:
+            self.eip_stalls[instr.eip] += excess
+            for cause, cycles in zip(STALL_CAUSES, (mem_cycles, data_wait, prefix, fetch_extra, branch_wait)):
+                charged = min(cycles, excess)
+                self.stalls[cause] += charged
+                excess -= charged
+            self.stalls["structural"] += excess
+        self.prev_done = done
+        self.cycles = done
+        self.instructions += 1
+
+    #Results
+    def summary(self):
+        n = self.instructions
+        return {"instructions": n, "cycles": self.cycles, "cpi": self.cycles / n if n else 0.0,
+                "stalls": dict(self.stalls)}
+
+    def write_report(self, path, top=20):
+        s = self.summary()
+        with open(path, "w") as f:
+            f.write(f"Instructions: {s['instructions']}\nCycles: {s['cycles']}\nCPI: {s['cpi']:.3f}\n")
+            f.write("Config: " + ", ".join(f"{k}={v}" for k, v in self.config.items()) + "\n")
+            f.write(f"\n{'cycles':<12} {'count':>12} {'CPI':>8}\n")
+            n = s["instructions"] or 1
+            base = s["instructions"] * self.ideal
+            f.write(f"{'base':<12} {base:>12} {base / n:>8.3f}\n")
+            for cause, cycles in s["stalls"].items():
+                f.write(f"{cause:<12} {cycles:>12} {cycles / n:>8.3f}\n")
+            f.write(f"\nStall cycles per EIP (top {top})\n")
+            for eip, cycles in sorted(self.eip_stalls.items(), key=lambda r: (-r[1], r[0]))[:top]:
+                f.write(f"0x{eip:08X} {cycles:>12}\n")
+
+def parse_config(text):
+    """'mem_latency=5,predict=btfn' -> dict for PipelineModel"""
+    config = {}
+    for item in filter(None, (t.strip() for t in text.split(","))):
+        key, _, val = item.partition("=")
+        if key not in DEFAULT_CONFIG:
+            raise ValueError(f"unknown pipeline setting {key!r} (known: {', '.join(DEFAULT_CONFIG)})")
+        if key == "predict":
+            if val not in (PREDICT_NOT_TAKEN, PREDICT_BTFN):
+                raise ValueError(f"predict must be {PREDICT_NOT_TAKEN} or {PREDICT_BTFN}")
+            config[key] = val
+        else:
+            config[key] = int(val)
+    return config
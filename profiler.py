@@ -0,0 +1,232 @@
+#Guest profiler: per-EIP execution counts, dynamic instruction mix and sampled host time per handler
+import time
+from collections import defaultdict
+
+import execute
+from execute import generic_handler
+from decoder import needs_modrm
+
+DEFAULT_PERIOD = 1000 #one instruction in this many is timed
+HOT_ROWS = 30         #rows of the hot EIP table in the report
+
+MEMORY_FORMS = ("ind", "disp8", "disp32", "abs") #addressing forms that call calc_effective_addr()
+FLAG_HANDLERS = ("exec_ADD", "exec_CMPXCHG")     #handlers that call update_flags()
+
+def handler_name(instr):
+    """exec_* function behind the instruction's bound handler ('skip' for unsupported opcodes)."""
+    fn = generic_handler(instr)
+    return fn.__name__ if fn is not None else "skip"
+
+def addressing_form(instr):
+    """reg, ind, disp8, disp32 or abs for the r/m operand; '-' without a modrm byte."""
+    if not needs_modrm(instr.opcode, instr.ext_opcode):
+        return "-"
+    mod, rm = instr.modrm >> 6, instr.modrm & 7
+    if mod == 0b11:
+        return "reg"
+    if mod == 0b00:
+        return "abs" if rm == 0b101 else "ind"
+    return "disp8" if mod == 0b01 else "disp32"
+
+def has_memory_operand(instr):
+    return addressing_form(instr) in MEMORY_FORMS
+
+def opcode_label(instr):
+    """e.g. 'ADD 01 disp8', 'CMPXCHG 0f b1 ind', 'MOV b8'."""
+    name = handler_name(instr)
+    name = name[5:] if name.startswith("exec_") else name
+    op = f"0f {instr.opcode:02x}" if instr.ext_opcode else f"{instr.opcode:02x}"
+    form = addressing_form(instr)
+    return f"{name} {op}" if form == "-" else f"{name} {op} {form}"
+
+
+class Profiler:
+    """
+    Run loop with profiling, same contract as isl.run(). Every instruction is
+    counted (per DecodedInstruction, so the counts are exact). One in 'period'
+    is also timed; those samples alternate between the bound handler (what
+    normally runs) and the reference exec_* function with its
+    calc_effective_addr()/update_flags() calls timed separately. Host times
+    in the report are sampled averages scaled by the exact counts.
+    """
+    def __init__(self, period=DEFAULT_PERIOD):
+        self.period = max(1, period)
+        self.counts = defaultdict(int)  #DecodedInstruction -> times retired
+        self.retired = 0
+        #(handler name, opcode label) -> [samples, seconds] / [samples, seconds, ea seconds, flags seconds]
+        self.bound = defaultdict(lambda: [0, 0.0])
+        self.reference = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+        self.ea_time = 0.0
+        self.flags_time = 0.0
+        self.samples = 0
+
+    def _timed(self, fn, attr):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                setattr(self, attr, getattr(self, attr) + time.perf_counter() - start)
+        return wrapper
+
+    def _sample(self, instr, state, mem):
+        key = handler_name(instr), opcode_label(instr)
+        fn = generic_handler(instr)
+        self.samples += 1
+        if fn is None or self.samples & 1:
+            start = time.perf_counter()
+            instr.handler(state, mem)
+            entry = self.bound[key]
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+            return
+        self.ea_time = self.flags_time = 0.0
+        start = time.perf_counter()
+        fn(instr, state, mem)
+        elapsed = time.perf_counter() - start
+        entry = self.reference[key]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += self.ea_time
+        entry[3] += self.flags_time
+
+    def run(self, state, mem, cache, max_instrs=None, hooks=None):
+        limit = max_instrs if max_instrs is not None else -1
+        retired_subs = hooks.retired if hooks is not None else ()
+        branch_subs = hooks.branch if hooks is not None else ()
+        fetch = cache.fetch
+        counts = self.counts
+        period = self.period
+        countdown = period - self.retired % period
+        retired = 0
+        #exec_* look these up as module globals, so the wrappers only affect sampled instructions
+        saved = execute.calc_effective_addr, execute.update_flags
+        execute.calc_effective_addr = self._timed(saved[0], "ea_time")
+        execute.update_flags = self._timed(saved[1], "flags_time")
+        try:
+            while not state.halted and retired != limit:
+                instr = fetch(state.eip)
+                counts[instr] += 1
+                countdown -= 1
+                if countdown:
+                    instr.handler(state, mem)
+                else:
+                    self._sample(instr, state, mem)
+                    countdown = period
+                retired += 1
+                if branch_subs and state.eip != instr.eip_new and not state.halted:
+                    for fn in branch_subs:
+                        fn(state, instr, state.eip)
+                for fn in retired_subs:
+                    fn(state, mem, instr)
+        finally:
+            execute.calc_effective_addr, execute.update_flags = saved
+            self.retired += retired
+        return retired
+
+    #Results
+    def eip_counts(self):
+        """
+        [(eip, count, label, handler name)] hottest first; entries re-decoded
+        after self-modifying writes are merged per label.
+        """
+        merged = defaultdict(int)
+        for instr, n in self.counts.items():
+            merged[(instr.eip, opcode_label(instr), handler_name(instr))] += n
+        return sorted(((eip, n, label, name) for (eip, label, name), n in merged.items()), key=lambda r: (-r[1], r[0]))
+
+    def mix(self):
+        """[(label, count)] by opcode and addressing form, most frequent first."""
+        merged = defaultdict(int)
+        for instr, n in self.counts.items():
+            merged[opcode_label(instr)] += n
+        return sorted(merged.items(), key=lambda r: (-r[1], r[0]))
+
+    def handler_costs(self, by_label=False):
+        """
+        {handler: {count, bound_us, reference_us, ea_us, flags_us}}: exact dynamic
+        count and mean sampled host microseconds per instruction (None if never
+        sampled). by_label=True breaks it down by opcode_label() instead.
+        """
+        counts = defaultdict(int)
+        for instr, n in self.counts.items():
+            counts[opcode_label(instr) if by_label else handler_name(instr)] += n
+        bound = defaultdict(lambda: [0, 0.0])
+        reference = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+        for samples, merged in ((self.bound, bound), (self.reference, reference)):
+            for (name, label), entry in samples.items():
+                total = merged[label if by_label else name]
+                for i, v in enumerate(entry):
+                    total[i] += v
+        out = {}
+        for key, n in counts.items():
+            b = bound.get(key)
+            r = reference.get(key)
+            out[key] = {
+                "count": n,
+                "bound_us": b[1] * 1e6 / b[0] if b else None,
+                "reference_us": r[1] * 1e6 / r[0] if r else None,
+                "ea_us": r[2] * 1e6 / r[0] if r else None,
+                "flags_us": r[3] * 1e6 / r[0] if r else None,
+            }
+        return out
+
+    def write_report(self, path):
+        total = self.retired or 1
+        with open(path, "w") as f:
+            f.write(f"Instructions retired: {self.retired}, host time sampled on 1 in {self.period} ({self.samples} samples)\n")
+
+            f.write(f"\nHot instructions (top {HOT_ROWS})\n")
+            f.write(f"{'count':>12} {'%':>6}  {'eip':<10}  instruction\n")
+            for eip, n, label, _ in self.eip_counts()[:HOT_ROWS]:
+                f.write(f"{n:>12} {100 * n / total:>6.2f}  0x{eip:08X}  {label}\n")
+
+            f.write("\nInstruction mix\n")
+            f.write(f"{'count':>12} {'%':>6}  opcode / form\n")
+            for label, n in self.mix():
+                f.write(f"{n:>12} {100 * n / total:>6.2f}  {label}\n")
+
+            f.write("\nHost time per handler (us per instruction; est. total = bound x count)\n")
+            f.write(f"{'handler':<14} {'count':>12} {'bound':>8} {'exec_*':>8} {'eff.addr':>8} {'flags':>8} {'est. ms':>9}\n")
+            costs = sorted(self.handler_costs().items(),
+                           key=lambda r: -(r[1]["count"] * (r[1]["bound_us"] or 0)))
+            for name, c in costs:
+                cols = [f"{c[k]:>8.2f}" if c[k] is not None else f"{'-':>8}"
+                        for k in ("bound_us", "reference_us", "ea_us", "flags_us")]
+                est = c["count"] * c["bound_us"] / 1000 if c["bound_us"] is not None else 0.0
+                f.write(f"{name:<14} {c['count']:>12} {' '.join(cols)} {est:>9.2f}\n")
+
+    def write_folded(self, path):
+        """
+        Folded stacks for flamegraph.pl / speedscope: guest instruction;handler[;helper]
+        weighted by estimated host microseconds. Costs come from the samples of the
+        same opcode and form, or of the handler as a whole if there are none; the
+        calc_effective_addr/update_flags share comes from the reference samples,
+        and is only split out for instructions that make those calls (a memory
+        operand, a flag writing handler).
+        """
+        costs = self.handler_costs()
+        label_costs = self.handler_costs(by_label=True)
+        memory_operand = {(instr.eip, opcode_label(instr)): has_memory_operand(instr) for instr in self.counts}
+        with open(path, "w") as f:
+            for eip, n, label, name in sorted(self.eip_counts()):
+                c = label_costs[label]
+                if c["bound_us"] is None or c["reference_us"] is None:
+                    c = costs[name]
+                if c["bound_us"] is None:
+                    continue
+                total = n * c["bound_us"]
+                frame = f"guest;0x{eip:08X} {label};{name}"
+                ea = flags = 0.0
+                if c["reference_us"]:
+                    if memory_operand[(eip, label)]:
+                        ea = total * c["ea_us"] / c["reference_us"]
+                    if name in FLAG_HANDLERS:
+                        flags = total * c["flags_us"] / c["reference_us"]
+                self_us = max(total - ea - flags, 0.0)
+                if round(self_us):
+                    f.write(f"{frame} {round(self_us)}\n")
+                if round(ea):
+                    f.write(f"{frame};calc_effective_addr {round(ea)}\n")
+                if round(flags):
+                    f.write(f"{frame};update_flags {round(flags)}\n")
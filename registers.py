@@ -1,58 +1,218 @@
 # registers.py
 
+# Register numbers as encoded in the opcode / modrm fields
+REG32 = ["eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"]
+REG16 = ["ax", "cx", "dx", "bx", "sp", "bp", "si", "di"]
+REG8  = ["al", "cl", "dl", "bl", "ah", "ch", "dh", "bh"]
+SREGS = ["es", "cs", "ss", "ds", "fs", "gs"]
+EAX, ECX, EDX, EBX, ESP, EBP, ESI, EDI = range(8)
+ES, CS, SS, DS, FS, GS = range(6)
+
+SIZE_MASK = {1: 0xFF, 2: 0xFFFF, 4: 0xFFFFFFFF, 8: 0xFFFFFFFFFFFFFFFF}
+
+FLAG_NAMES = ("CF", "PF", "AF", "ZF", "SF", "DF", "OF")
+ARITH_FLAGS = ("CF", "PF", "AF", "ZF", "SF", "OF") #the ones ADD/SUB/CMP results define
+
+# PARITY[b] = 1 when byte b has an even number of set bits (x86 PF)
+PARITY = bytes(1 if bin(i).count("1") % 2 == 0 else 0 for i in range(256))
+
+class LazyFlags:
+    """
+    EFLAGS status bits, evaluated lazily. A flag producing instruction only
+    records its operation, operands and unmasked result (record()); each flag
+    is worked out from that record when it is read. Reads and writes use the
+    same dict style interface as before: flags["ZF"], flags["DF"] = 1, items().
+    """
+    __slots__ = ("values", "op", "a", "b", "res", "size")
+
+    def __init__(self):
+        self.values = dict.fromkeys(FLAG_NAMES, 0)
+        self.op = None #pending operation, None when values is up to date
+        self.a = self.b = self.res = 0
+        self.size = 4
+
+    def record(self, a, b, res, size, op="add"):
+        if op not in ("add", "sub", "cmp"): #only ZF/SF/PF/AF change, keep CF/OF as they are
+            self.materialize()
+        self.op = op
+        self.a = a
+        self.b = b
+        self.res = res
+        self.size = size
+
+    def _compute(self, name):
+        bits = self.size * 8
+        mask = (1 << bits) - 1
+        sign_bit = 1 << (bits - 1)
+        res_m = self.res & mask
+        if name == "ZF":
+            return 1 if res_m == 0 else 0
+        if name == "SF":
+            return 1 if res_m & sign_bit else 0
+        if name == "PF":
+            return PARITY[res_m & 0xFF]
+        a_m = self.a & mask
+        b_m = self.b & mask
+        if name == "AF":
+            return 1 if (a_m ^ b_m ^ res_m) & 0x10 else 0
+        op = self.op
+        if op == "add":
+            if name == "CF":
+                return 1 if res_m < a_m else 0
+            return 1 if (a_m ^ res_m) & (b_m ^ res_m) & sign_bit else 0
+        if op in ("sub", "cmp"):
+            if name == "CF":
+                return 1 if a_m < b_m else 0
+            return 1 if (a_m ^ b_m) & (a_m ^ res_m) & sign_bit else 0
+        return self.values[name]
+
+    def __getitem__(self, name):
+        if self.op is not None and name != "DF":
+            return self._compute(name)
+        return self.values[name]
+
+    def materialize(self):
+        """Folds the pending record into values."""
+        if self.op is not None:
+            values = self.values
+            for name in ARITH_FLAGS:
+                values[name] = self._compute(name)
+            self.op = None
+
+    def __setitem__(self, name, val):
+        self.materialize()
+        self.values[name] = val
+
+    def items(self):
+        self.materialize()
+        return self.values.items()
+
+    def keys(self):
+        return self.values.keys()
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __eq__(self, other):
+        self.materialize()
+        if isinstance(other, LazyFlags):
+            other.materialize()
+            other = other.values
+        return self.values == other
+
+    def __repr__(self):
+        self.materialize()
+        return repr(self.values)
+
+    def snapshot(self):
+        return (dict(self.values), self.op, self.a, self.b, self.res, self.size)
+
+    def restore(self, snap):
+        values, self.op, self.a, self.b, self.res, self.size = snap
+        self.values = dict(values)
+
+
+def reg_slot(idx, size):
+    """
+    Where a sub-register lives in the GPR array: (gpr index, shift, mask).
+    For 8-bit operands numbers 4-7 are AH/CH/DH/BH, bits 8-15 of EAX..EBX.
+    """
+    if size == 1 and idx >= 4:
+        return idx - 4, 8, 0xFF
+    return idx, 0, SIZE_MASK[size]
+
+def read_reg(state, idx, size):
+    g, shift, mask = reg_slot(idx, size)
+    return (state.gpr[g] >> shift) & mask
+
+def write_reg(state, idx, val, size):
+    g, shift, mask = reg_slot(idx, size)
+    gpr = state.gpr
+    gpr[g] = (gpr[g] & (0xFFFFFFFF ^ (mask << shift))) | ((val & mask) << shift)
+
+
+def write_sreg(state, idx, val):
+    """Segment register write; keeps the cached base (seg_base[idx] = sreg << 16) in step."""
+    val &= 0xFFFF
+    state.sreg[idx] = val
+    state.seg_base[idx] = val << 16
+
+def load_sregs(state, values):
+    """Replaces all six segment registers (restores, checkpoints)."""
+    state.sreg[:] = values
+    state.seg_base[:] = [v << 16 for v in values]
+
+
+def _named(field, idx):
+    """Property exposing field[idx] under a register name (state.eax, state.ss, state.mm0)."""
+    def get(self):
+        return getattr(self, field)[idx]
+    def set(self, val):
+        getattr(self, field)[idx] = val
+    return property(get, set)
+
+def _named_sreg(idx):
+    """state.ds style view onto sreg[idx]; writes go through write_sreg()."""
+    def get(self):
+        return self.sreg[idx]
+    def set(self, val):
+        write_sreg(self, idx, val)
+    return property(get, set)
+
 class Registers:
+    """
+    Register file. GPRs, segment registers and MMX registers are lists indexed
+    by their encoding number (gpr[EAX], sreg[SS], mm[3]); the named attributes
+    (state.eax, state.ss, state.mm3) are views onto the same slots. seg_base
+    caches sreg << 16 for address generation, so segment registers are only
+    written through write_sreg() / load_sregs() (or the named attributes).
+    """
+    __slots__ = ("eip", "gpr", "sreg", "seg_base", "mm", "flags", "modified_mem", "halted")
+
     def __init__(self):
         # Program counter
         self.eip = 0
 
-        # General Purpose Registers (32-bit)
-        self.eax = 0
-        self.ecx = 0
-        self.edx = 0
-        self.ebx = 0
-        self.esp = 0
-        self.ebp = 0
-        self.esi = 0
-        self.edi = 0
-
-        # Segment registers (16-bit)
-        self.cs = 0
-        self.ds = 0
-        self.es = 0
-        self.ss = 0
-        self.fs = 0
-        self.gs = 0
+        # General Purpose Registers (32-bit), EAX ECX EDX EBX ESP EBP ESI EDI
+        self.gpr = [0] * 8
+
+        # Segment registers (16-bit), ES CS SS DS FS GS
+        self.sreg = [0] * 6
+        self.seg_base = [0] * 6 #sreg << 16
 
         # MMX registers (64-bit)
-        self.mm0 = 0
-        self.mm1 = 0
-        self.mm2 = 0
-        self.mm3 = 0
-        self.mm4 = 0
-        self.mm5 = 0
-        self.mm6 = 0
-        self.mm7 = 0
-
-        # Flags stored as a dict for clarity
-        self.flags = {
-            "CF": 0,
-            "PF": 0,
-            "AF": 0,
-            "ZF": 0,
-            "SF": 0,
-            "DF": 0,
-            "OF": 0
-        }
+        self.mm = [0] * 8
+
+        # Flags, read like a dict (flags["ZF"]) but evaluated lazily
+        self.flags = LazyFlags()
 
         self.modified_mem = set()
 
-    # Optional: helper for 8-bit register names
+        # Set by HLT, stops the fetch/decode/execute loop
+        self.halted = False
+
     def read32(self, name):
         return getattr(self, name)
 
     def write32(self, name, val):
         setattr(self, name, val & 0xFFFFFFFF)
 
+    def snapshot(self):
+        """Copy of the architectural state (modified_mem is trace bookkeeping and not included)."""
+        return (self.eip, tuple(self.gpr), tuple(self.sreg), tuple(self.mm),
+                self.flags.snapshot(), self.halted)
+
+    def restore(self, snap):
+        """Loads a snapshot() back. The lists are updated in place."""
+        self.eip, gpr, sreg, mm, flags, self.halted = snap
+        self.gpr[:] = gpr
+        load_sregs(self, sreg)
+        self.mm[:] = mm
+        self.flags.restore(flags)
+
     # Optional: dump for debugging
     def dump(self):
         print("EIP =", hex(self.eip))
@@ -62,3 +222,10 @@ class Registers:
         print("ESI =", hex(self.esi), "EDI =", hex(self.edi))
         print("MM =", [hex(x) for x in self.mm])
         print("Flags =", self.flags)
+
+for _i, _name in enumerate(REG32):
+    setattr(Registers, _name, _named("gpr", _i))
+for _i, _name in enumerate(SREGS):
+    setattr(Registers, _name, _named_sreg(_i))
+for _i in range(8):
+    setattr(Registers, f"mm{_i}", _named("mm", _i))
@@ -0,0 +1,189 @@
+#In-process simulator API: load a program, step/run it and inspect the machine
+#without going through isl.py, sys.argv or any output files.
+#
+#    sim = Simulator()
+#    sim.load_bytes(bytes.fromhex("b8 01 00 00 00 f4"))
+#    sim.run()
+#    sim.reg("eax")  -> 1
+import os
+
+from registers import Registers, REG32, REG16, REG8, SREGS, read_reg, write_reg, write_sreg
+from memory import Memory, load_mem_file, load_binary_file
+from hooks import Hooks, EV_RETIRED, EV_DECODED
+from decoder import DecodeCache, DecodeError
+
+class Simulator:
+    """
+    One machine: memory, registers and a decode cache. Nothing is written to
+    disk unless trace_to()/dump_decode_to()/save_checkpoint() ask for it.
+    With translate=True run() uses the block translator (step() always
+    interprets).
+    """
+    def __init__(self, translate=False):
+        self.translate = translate
+        self.hooks = Hooks()
+        self.reset()
+        self.outputs = [] #open trace/dump subscribers, closed by close()
+
+    def reset(self):
+        """Empty memory, zeroed registers, EIP 0."""
+        self.mem = Memory()
+        self.state = Registers()
+        self.hooks.memories.clear()
+        self.hooks.attach_memory(self.mem)
+        self.cache = DecodeCache(self.mem, self.hooks)
+        self.translator = None
+        self.retired = 0
+
+    #Loading
+    def load_bytes(self, data, addr=0):
+        """Copies bytes (or any buffer: bytearray, memoryview, mmap) into memory at addr."""
+        self.mem.write_bytes(addr, data)
+
+    def load_file(self, path, raw=False, load_addr=0):
+        """Loads a "0xADDR: bytes" text image, or a flat binary (mmap'ed) with raw=True."""
+        if raw:
+            return load_binary_file(self.mem, os.fspath(path), load_addr)
+        return load_mem_file(self.mem, os.fspath(path))
+
+    def load_checkpoint(self, path):
+        from checkpoint import load_checkpoint
+        self.reset()
+        load_checkpoint(os.fspath(path), self.state, self.mem)
+
+    def save_checkpoint(self, path):
+        from checkpoint import save_checkpoint
+        save_checkpoint(os.fspath(path), self.state, self.mem)
+
+    #Execution
+    @property
+    def halted(self):
+        return self.state.halted
+
+    def step(self):
+        """Executes one instruction and returns it (a DecodedInstruction). Raises DecodeError."""
+        state = self.state
+        instr = self.cache.fetch(state.eip)
+        instr.handler(state, self.mem)
+        self.retired += 1
+        if state.eip != instr.eip_new and not state.halted:
+            for fn in self.hooks.branch:
+                fn(state, instr, state.eip)
+        for fn in self.hooks.retired:
+            fn(state, self.mem, instr)
+        return instr
+
+    def run(self, max_instructions=None):
+        """Runs until HLT or max_instructions. Returns the number of instructions retired."""
+        if self.translate:
+            if self.translator is None:
+                from translate import Translator
+                self.translator = Translator(self.cache)
+            self.translator.track_writes = any(getattr(out, "reads_written", False) for out in self.outputs)
+            n = self.translator.run(self.state, self.mem, max_instructions)
+        else:
+            from interpreter import run
+            n = run(self.state, self.mem, self.cache, max_instructions, self.hooks)
+        self.retired += n
+        return n
+
+    #Inspection
+    @property
+    def eip(self):
+        return self.state.eip
+
+    @eip.setter
+    def eip(self, val):
+        self.state.eip = val & 0xFFFFFFFF
+
+    def reg(self, name):
+        """Register by name as an int: eax/ax/al/ah..., es..gs, mm0..mm7, eip."""
+        kind, idx, size = _reg_name(name)
+        if kind == "gpr":
+            return read_reg(self.state, idx, size)
+        return getattr(self.state, kind)[idx] if kind != "eip" else self.state.eip
+
+    def set_reg(self, name, val):
+        kind, idx, size = _reg_name(name)
+        if kind == "gpr":
+            write_reg(self.state, idx, val, size)
+        elif kind == "eip":
+            self.eip = val
+        elif kind == "sreg":
+            write_sreg(self.state, idx, val)
+        else:
+            self.state.mm[idx] = val & 0xFFFFFFFFFFFFFFFF
+
+    def regs(self):
+        """All 32-bit GPRs, segment registers, MMX registers and EIP as a dict of ints."""
+        state = self.state
+        out = dict(zip(REG32, state.gpr))
+        out.update(zip(SREGS, state.sreg))
+        out.update((f"mm{i}", v) for i, v in enumerate(state.mm))
+        out["eip"] = state.eip
+        return out
+
+    def flags(self):
+        return dict(self.state.flags.items())
+
+    def read_mem(self, addr, size=4):
+        """Little endian int at addr."""
+        return self.mem.read(addr, size)
+
+    def read_bytes(self, addr, length):
+        return self.mem.read_bytes(addr, length)
+
+    def write_mem(self, addr, val, size=4):
+        self.mem.write(addr, val, size)
+
+    #Optional output
+    def trace_to(self, path, **options):
+        """Writes a results.txt style trace (TraceWriter options: mode, at, every, threaded)."""
+        from trace_writer import TraceWriter
+        trace = TraceWriter(os.fspath(path), **options)
+        self.hooks.subscribe(EV_RETIRED, trace.retire)
+        self.outputs.append(trace)
+        return trace
+
+    def dump_decode_to(self, path):
+        from decoder import DecodeDump
+        dump = self.hooks.subscribe(EV_DECODED, DecodeDump(os.fspath(path)))
+        self.outputs.append(dump)
+        return dump
+
+    def close(self):
+        """Finishes and closes any trace/dump files."""
+        for out in self.outputs:
+            if hasattr(out, "final"):
+                out.final(self.state, self.mem)
+                self.hooks.unsubscribe(EV_RETIRED, out.retire)
+            else:
+                self.hooks.unsubscribe(EV_DECODED, out)
+            out.close()
+        self.outputs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+Machine = Simulator
+
+def _reg_name(name):
+    """name -> (kind, index, size); kind is gpr, sreg, mm or eip."""
+    name = name.lower()
+    if name in REG32:
+        return "gpr", REG32.index(name), 4
+    if name in REG16:
+        return "gpr", REG16.index(name), 2
+    if name in REG8:
+        return "gpr", REG8.index(name), 1
+    if name in SREGS:
+        return "sreg", SREGS.index(name), 2
+    if name.startswith("mm") and name[2:].isdigit() and int(name[2:]) < 8:
+        return "mm", int(name[2:]), 8
+    if name == "eip":
+        return "eip", 0, 4
+    raise KeyError(f"unknown register {name!r}")
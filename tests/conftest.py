@@ -0,0 +1,6 @@
+#The simulator modules are flat files at the repository root
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,33 @@
+import os
+
+from conftest import ROOT
+from simulator import Simulator
+
+MEM_TXT = os.path.join(ROOT, "mem.txt")
+
+def _final(sim):
+    return sim.regs(), {addr: byte for addr, byte in sim.mem.items()}
+
+def test_resume_and_save_to_the_same_file(tmp_path):
+    """The resumed run's pages are views of the mapped file it overwrites."""
+    ref = Simulator()
+    ref.load_file(MEM_TXT)
+    ref.run()
+
+    ck = str(tmp_path / "ck.bin")
+    sim = Simulator()
+    sim.load_file(MEM_TXT)
+    sim.run(5)
+    sim.save_checkpoint(ck)
+
+    resumed = Simulator()
+    resumed.load_checkpoint(ck)
+    resumed.run()
+    resumed.save_checkpoint(ck)
+
+    again = Simulator()
+    again.load_checkpoint(ck)
+    assert again.read_mem(0) == 0x05661004
+    assert again.read_mem(0x2000) == 0x102
+    assert _final(again) == _final(ref)
+    assert os.listdir(tmp_path) == ["ck.bin"]
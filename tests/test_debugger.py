@@ -0,0 +1,72 @@
+from simulator import Simulator
+from debugger import Debugger
+from timetravel import TimeTravel
+
+#0x00 mov ecx, -50 / 0x05 loop: add dword ptr [0x100], 1 / 0x0C add ecx, 1 / 0x0F jne loop
+#0x11 mov dword ptr [0xFFE], 0x11223344 (crosses into page 1) / 0x1B add eax, dword ptr [0x2000] / 0x21 hlt
+PROGRAM = bytes.fromhex("B9 CE FF FF FF 83 05 00 01 00 00 01 83 C1 01 75 F4"
+                        "C7 05 FE 0F 00 00 44 33 22 11 03 05 00 20 00 00 F4")
+JNE, STORE, LOAD, HLT = 0x0F, 0x11, 0x1B, 0x21
+
+def _debugger(timetravel=False):
+    sim = Simulator()
+    sim.load_bytes(PROGRAM)
+    sim.write_mem(0x2000, 7)
+    return Debugger(sim, TimeTravel(sim) if timetravel else None)
+
+def test_conditional_breakpoint():
+    dbg = _debugger()
+    dbg.break_at(JNE, "ecx == 0xFFFFFFF0 and ZF == 0")
+    stop = dbg.cont()
+    assert stop.reason == "breakpoint" and stop.eip == JNE
+    assert dbg.sim.reg("ecx") == 0xFFFFFFF0
+    assert dbg.sim.read_mem(0x100) == 50 - 0x10
+
+def test_write_watchpoint_on_a_page_crossing_store():
+    dbg = _debugger()
+    wp = dbg.watch(0x1000, 1, "w")
+    stop = dbg.cont()
+    assert stop.reason == "watchpoint" and stop.point is wp
+    assert stop.eip == LOAD #stops after the storing instruction
+    assert stop.access == ("w", 0xFFE, 4, 0x11223344)
+
+def test_watchpoint_wrapping_past_the_top_of_memory():
+    dbg = _debugger()
+    wp = dbg.watch(0xFFFFFFF8, 0x1008, "w") #0xFFFFFFF8 ... 0xFFF
+    assert max(wp.pages()) == 0xFFFFF
+    stop = dbg.cont()
+    assert stop.reason == "watchpoint" and stop.access[1] == 0x100 #the loop's first add
+
+def test_read_watchpoint():
+    dbg = _debugger()
+    dbg.watch(0x2002, 1, "r")
+    stop = dbg.cont()
+    assert stop.reason == "watchpoint" and stop.eip == HLT
+    assert stop.access == ("r", 0x2000, 4, 7)
+
+def test_next_runs_a_backward_jne_loop_to_its_exit():
+    dbg = _debugger()
+    dbg.advance(JNE)
+    stop = dbg.next()
+    assert stop.reason == "step" and stop.eip == STORE
+    assert dbg.sim.reg("ecx") == 0
+
+def test_reverse_cont_stops_at_earlier_breakpoints():
+    dbg = _debugger(timetravel=True)
+    assert dbg.cont().reason == "halt"
+    dbg.break_at(JNE)
+    stop = dbg.reverse_cont()
+    assert stop.reason == "breakpoint" and stop.eip == JNE
+    assert dbg.sim.reg("ecx") == 0
+    dbg.reverse_cont()
+    assert dbg.sim.reg("ecx") == 0xFFFFFFFF
+    assert dbg.sim.read_mem(0x100) == 49
+
+def test_clear_removes_the_memory_wrappers():
+    dbg = _debugger()
+    dbg.watch(0x100, 4, "rw")
+    dbg.break_at(JNE)
+    assert "write" in vars(dbg.sim.mem) and "read" in vars(dbg.sim.mem)
+    dbg.clear()
+    assert "write" not in vars(dbg.sim.mem) and "read" not in vars(dbg.sim.mem)
+    assert dbg.cont().reason == "halt"
@@ -0,0 +1,22 @@
+import pytest
+
+import isl
+from decoder import DecodeCache, UndefinedMemory
+from memory import Memory
+from registers import Registers
+
+def test_running_off_the_image_stops_on_undefined_memory():
+    mem = Memory()
+    mem.write_bytes(0, bytes.fromhex("83 C0 01 83 C0 01")) #add eax, 1 twice, no hlt
+    state = Registers()
+    with pytest.raises(UndefinedMemory):
+        isl.run(state, mem, DecodeCache(mem))
+    assert state.eip == 6 and state.gpr[0] == 2
+
+def test_run_case_reports_undefined_memory(tmp_path, capsys):
+    image = tmp_path / "nohlt.txt"
+    image.write_text("0x000: 83 c0 01\n")
+    args = isl.build_parser().parse_args([str(image)])
+    summary = isl.run_case(args, str(tmp_path))
+    assert summary["reason"] == "undefined memory" and summary["eip"] == 3
+    assert "Stopped on undefined memory at EIP 0x00000003" in capsys.readouterr().out
@@ -0,0 +1,15 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+def test_simulator_run_does_not_import_the_cli():
+    code = ("import sys\n"
+            "from simulator import Simulator\n"
+            "sim = Simulator()\n"
+            "sim.load_bytes(bytes.fromhex('b8 01 00 00 00 f4'))\n"
+            "sim.run()\n"
+            "assert sim.reg('eax') == 1\n"
+            "print(' '.join(m for m in ('isl', 'argparse', 'profiler', 'trace_writer', 'checkpoint') if m in sys.modules))\n")
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
@@ -0,0 +1,40 @@
+from simulator import Simulator
+from timetravel import TimeTravel
+
+#mov ecx, -50 / loop: add dword ptr [0x100], 1 / add ecx, 1 / jne loop / hlt
+LOOP = bytes.fromhex("B9 CE FF FF FF 83 05 00 01 00 00 01 83 C1 01 75 F4 F4")
+
+def _machine(sim):
+    return sim.state.snapshot(), sim.read_bytes(0x100, 4)
+
+def test_stepping_across_a_snapshot_keeps_the_history():
+    sim = Simulator()
+    sim.load_bytes(LOOP)
+    tt = TimeTravel(sim, interval=10, max_snapshots=4)
+    tt.run(40)
+    assert [s.pos for s in tt.snaps] == [10, 20, 30, 40]
+    for _ in range(3):
+        tt.step_back()
+        tt.step()
+        assert [s.pos for s in tt.snaps] == [10, 20, 30, 40]
+        assert tt.first == 10
+    tt.step_back(15)
+    tt.run(15)
+    assert [s.pos for s in tt.snaps] == [10, 20, 30, 40]
+
+def test_goto_matches_a_plain_run():
+    ref = Simulator()
+    ref.load_bytes(LOOP)
+    states = [_machine(ref)]
+    while not ref.halted:
+        ref.step()
+        states.append(_machine(ref))
+
+    sim = Simulator()
+    sim.load_bytes(LOOP)
+    tt = TimeTravel(sim, interval=7, max_snapshots=1000)
+    tt.run()
+    for pos in (len(states) - 1, 100, 99, 98, 3, 0, 64, 63, 70, 1):
+        tt.goto(pos)
+        assert _machine(sim) == states[pos]
+    assert len({s.pos for s in tt.snaps}) == len(tt.snaps)
@@ -0,0 +1,65 @@
+import pytest
+
+import bench
+from decoder import DecodeCache
+from hooks import Hooks, EV_MEM_WRITE
+from interpreter import run
+from memory import Memory
+from registers import Registers, FLAG_NAMES
+from translate import Translator
+
+#mov ecx, -20 / loop: add dword ptr [0x2FFE], 1 (crosses into page 3) / xchg byte ptr [0x40], al (code page)
+#add ecx, 1 / jne loop / hlt
+EDGES = bytes.fromhex("B9 EC FF FF FF 83 05 FE 2F 00 00 01 86 05 40 00 00 00 83 C1 01 75 EE F4")
+#mov ecx, -20 / loop: add byte ptr [ecx + 0x2000], 1 / add ecx, 1 / jne loop / hlt
+STRIDE = bytes.fromhex("B9 EC FF FF FF 80 81 00 20 00 00 01 83 C1 01 75 F4 F4")
+
+def _run(load, translate, track_writes=False, hooks=None):
+    mem = Memory()
+    load(mem)
+    state = Registers()
+    cache = DecodeCache(mem, hooks)
+    if hooks is not None:
+        hooks.attach_memory(mem)
+    if translate:
+        retired = Translator(cache, track_writes=track_writes).run(state, mem)
+    else:
+        retired = run(state, mem, cache, hooks=hooks)
+    return retired, state, mem
+
+def _final(retired, state, mem):
+    flags = tuple(state.flags[name] for name in FLAG_NAMES)
+    return (retired, state.eip, state.halted, state.gpr, state.sreg, state.mm, flags,
+            list(mem.items()), list(mem.regions()))
+
+@pytest.mark.parametrize("seed", range(4))
+def test_translated_bench_workload_matches_the_interpreter(seed):
+    work = bench.generate(n_instrs=300, iterations=20, seed=seed)
+    interpreted = _run(work.load, translate=False)
+    translated = _run(work.load, translate=True)
+    assert interpreted[0] == work.dynamic
+    assert _final(*translated) == _final(*interpreted)
+
+def test_page_crossing_and_code_page_stores():
+    load = lambda mem: mem.write_bytes(0, EDGES)
+    interpreted = _run(load, translate=False)
+    translated = _run(load, translate=True)
+    assert _final(*translated) == _final(*interpreted)
+    assert translated[2].read(0x2FFE, 4) == 20
+
+def test_written_addresses_are_tracked_on_request():
+    load = lambda mem: mem.write_bytes(0, STRIDE)
+    _, state, _ = _run(load, translate=False)
+    _, tracked, _ = _run(load, translate=True, track_writes=True)
+    assert tracked.modified_mem == state.modified_mem == set(range(0x1FEC, 0x2000))
+    _, untracked, _ = _run(load, translate=True)
+    assert untracked.modified_mem < state.modified_mem #only what the interpreted first iterations wrote
+
+def test_hooked_memory_sees_every_translated_store():
+    writes = {}
+    for translate in (False, True):
+        hooks = Hooks()
+        seen = writes[translate] = []
+        hooks.subscribe(EV_MEM_WRITE, lambda addr, size, val: seen.append((addr, size, val)))
+        _run(lambda mem: mem.write_bytes(0, EDGES), translate, hooks=hooks)
+    assert writes[True] == writes[False] and len(writes[True]) == 40
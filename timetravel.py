@@ -0,0 +1,238 @@
+#Reverse execution: step back / reverse-continue over a recorded run
+#
+#    sim = Simulator(); sim.load_file("mem.txt")
+#    tt = TimeTravel(sim)
+#    tt.run()                          #records while it executes
+#    tt.step_back(3); sim.reg("eax")
+#    tt.reverse_continue(lambda sim: sim.reg("ecx") == 0)
+#    tt.goto(1200)                     #any position in tt.first ... tt.end
+from hooks import EV_MEM_WRITE
+from memory import PAGE_SHIFT
+
+DEFAULT_INTERVAL = 10000    #instructions between snapshots (longest replay after a jump back)
+DEFAULT_MAX_SNAPSHOTS = 256 #older history is dropped beyond this
+
+#Undo log record slots: 0-7 gpr, 8-13 sreg, 14-21 mm
+SREG_SLOT = 8
+MM_SLOT = 14
+
+class Snapshot:
+    """
+    Registers plus the memory pages written since the previous snapshot, as
+    page number -> (bytes, defined mask) or None for a page that did not
+    exist yet. The oldest snapshot holds every page.
+    """
+    __slots__ = ("pos", "regs", "pages", "dirty")
+
+    def __init__(self, pos, regs, pages, dirty):
+        self.pos = pos
+        self.regs = regs   #Registers.snapshot()
+        self.pages = pages
+        self.dirty = dirty #pages written between the previous snapshot and this one
+
+
+class TimeTravel:
+    """
+    Records a Simulator's execution so it can be run backwards. Every
+    'interval' instructions the registers and the pages written since the
+    last snapshot are copied; in between, each instruction leaves an undo
+    record: its EIP, the old values of the registers it changed, the old
+    flags if they changed and the old bytes (and defined mask) of every
+    memory write. Undo records are kept from the second newest snapshot on,
+    older positions are reached by restoring a snapshot and replaying at
+    most 'interval' instructions. So memory use is bounded by max_snapshots
+    times the pages one interval writes, plus up to two intervals of undo
+    records.
+
+    Only step()/run() record, and only they call the retired/branch
+    subscribers; replays after a jump back are silent. Machine edits made
+    outside them (sim.write_mem, set_reg) are not in the undo log, call
+    restart() after such edits. state.modified_mem (trace bookkeeping) is
+    not rolled back.
+    """
+    def __init__(self, sim, interval=DEFAULT_INTERVAL, max_snapshots=DEFAULT_MAX_SNAPSHOTS):
+        if interval < 1 or max_snapshots < 1:
+            raise ValueError("interval and max_snapshots must be at least 1")
+        self.sim = sim
+        self.interval = interval
+        self.max_snapshots = max_snapshots
+        self._writes = None #undo list of the instruction executing, None between instructions
+        sim.hooks.subscribe(EV_MEM_WRITE, self._on_write)
+        self.restart()
+
+    def restart(self):
+        """Forgets the history; the current machine state becomes position 0."""
+        mem = self.sim.mem
+        pages = {p: (bytes(mem.pages[p]), bytes(mem.defined[p])) for p in mem.pages}
+        self.pos = 0
+        self.end = 0          #furthest position executed (goto() can come back to it)
+        self.snaps = [Snapshot(0, self.sim.state.snapshot(), pages, frozenset())]
+        self.undo = []        #undo records of the instructions at undo_base ... pos - 1
+        self.undo_base = 0
+        self.dirty = set()    #pages written since the newest snapshot
+
+    def close(self):
+        self.sim.hooks.unsubscribe(EV_MEM_WRITE, self._on_write)
+
+    @property
+    def first(self):
+        """Earliest position that can still be reached."""
+        return self.snaps[0].pos
+
+    def _on_write(self, addr, size, val):
+        addr &= 0xFFFFFFFF
+        self.dirty.add(addr >> PAGE_SHIFT)
+        self.dirty.add((addr + size - 1) >> PAGE_SHIFT)
+        if self._writes is not None:
+            mem = self.sim.mem
+            self._writes.append((addr, mem.read_bytes(addr, size), mem.read_defined(addr, size)))
+
+    #Forward
+    def _execute(self):
+        """Runs the instruction at EIP, leaving its undo record. Returns the instruction."""
+        sim = self.sim
+        state = sim.state
+        eip = state.eip
+        instr = sim.cache.fetch(eip)
+        gpr, sreg, mm = state.gpr[:], state.sreg[:], state.mm[:]
+        flags = state.flags.snapshot()
+        self._writes = writes = []
+        try:
+            instr.handler(state, sim.mem)
+        finally:
+            self._writes = None
+        regs = []
+        if gpr != state.gpr:
+            regs += [(i, v) for i, v in enumerate(gpr) if state.gpr[i] != v]
+        if sreg != state.sreg:
+            regs += [(SREG_SLOT + i, v) for i, v in enumerate(sreg) if state.sreg[i] != v]
+        if mm != state.mm:
+            regs += [(MM_SLOT + i, v) for i, v in enumerate(mm) if state.mm[i] != v]
+        f = state.flags
+        if (f.values, f.op, f.a, f.b, f.res, f.size) == flags:
+            flags = None
+        self.undo.append((eip, tuple(regs) if regs else None, flags, tuple(writes) if writes else None))
+        self.pos += 1
+        if self.pos > self.end:
+            self.end = self.pos
+        if self.pos % self.interval == 0:
+            self._snapshot()
+        return instr
+
+    def _snapshot(self):
+        mem = self.sim.mem
+        pages = {}
+        for p in self.dirty:
+            pages[p] = (bytes(mem.pages[p]), bytes(mem.defined[p])) if p in mem.pages else None
+        prev = self.snaps[-1]
+        self.snaps.append(Snapshot(self.pos, self.sim.state.snapshot(), pages, frozenset(self.dirty)))
+        self.dirty = set()
+        if prev.pos > self.undo_base: #keep undo records from the previous snapshot on
+            del self.undo[:prev.pos - self.undo_base]
+            self.undo_base = prev.pos
+        if len(self.snaps) > self.max_snapshots: #fold the oldest into the next one
+            old = self.snaps.pop(0)
+            nxt = self.snaps[0]
+            merged = {p: v for p, v in old.pages.items() if p not in nxt.pages}
+            merged.update((p, v) for p, v in nxt.pages.items() if v is not None)
+            nxt.pages = merged
+
+    def step(self):
+        """Executes one instruction like Simulator.step(), recording it. None once halted."""
+        sim = self.sim
+        state = sim.state
+        if state.halted:
+            return None
+        instr = self._execute()
+        sim.retired += 1
+        if state.eip != instr.eip_new and not state.halted:
+            for fn in sim.hooks.branch:
+                fn(state, instr, state.eip)
+        for fn in sim.hooks.retired:
+            fn(state, sim.mem, instr)
+        return instr
+
+    def run(self, max_instructions=None):
+        """Runs until HLT or max_instructions, recording. Returns the number of instructions retired."""
+        n = 0
+        while not self.sim.state.halted and n != max_instructions:
+            self.step()
+            n += 1
+        return n
+
+    #Backward
+    def _undo_one(self):
+        eip, regs, flags, writes = self.undo.pop()
+        state = self.sim.state
+        if writes is not None:
+            mem = self.sim.mem
+            for addr, data, mask in reversed(writes):
+                mem.restore_bytes(addr, data, mask)
+        if regs is not None:
+            for slot, val in regs:
+                if slot < SREG_SLOT:
+                    state.gpr[slot] = val
+                elif slot < MM_SLOT:
+                    state.sreg[slot - SREG_SLOT] = val
+                    state.seg_base[slot - SREG_SLOT] = val << 16
+                else:
+                    state.mm[slot - MM_SLOT] = val
+        if flags is not None:
+            state.flags.restore(flags)
+        state.eip = eip
+        state.halted = False #it was running when this instruction started
+        self.pos -= 1
+        if self.pos < self.snaps[-1].pos: #back past the newest snapshot, it is taken again on the way forward
+            self.dirty |= self.snaps.pop().dirty
+
+    def _restore(self, k):
+        """Back to snapshot k; the newer snapshots and all undo records are dropped."""
+        snap = self.snaps[k]
+        mem = self.sim.mem
+        touched = set(self.dirty)
+        for later in self.snaps[k + 1:]:
+            touched |= later.dirty
+        for p in touched:
+            for older in reversed(self.snaps[:k + 1]):
+                if p in older.pages:
+                    page = older.pages[p]
+                    break
+            else:
+                page = None #created after the oldest snapshot
+            if page is None:
+                mem.restore_page(p, None, None)
+            else:
+                mem.restore_page(p, *page)
+        self.sim.state.restore(snap.regs)
+        del self.snaps[k + 1:]
+        self.dirty = set()
+        self.undo = []
+        self.undo_base = self.pos = snap.pos
+
+    def goto(self, pos):
+        """Moves the machine to the state after 'pos' recorded instructions (first <= pos)."""
+        if pos < self.first:
+            raise ValueError(f"position {pos} is older than the recorded history (starts at {self.first})")
+        if pos < self.undo_base:
+            k = max(i for i, s in enumerate(self.snaps) if s.pos <= pos)
+            self._restore(k)
+        while self.pos > pos:
+            self._undo_one()
+        while self.pos < pos and not self.sim.state.halted: #silent replay
+            self._execute()
+        return self.pos
+
+    def step_back(self, n=1):
+        """Undoes the last n instructions (fewer at the start of the history). Returns the new position."""
+        return self.goto(max(self.pos - n, self.first))
+
+    def reverse_continue(self, until=None):
+        """
+        Steps back until until(sim) is true, or to the start of the history
+        if it never is (or until is None). Returns the position stopped at.
+        """
+        while self.pos > self.first:
+            self.step_back()
+            if until is not None and until(self.sim):
+                break
+        return self.pos
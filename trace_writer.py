@@ -0,0 +1,195 @@
+#Trace subsystem: formats simulator state into results.txt style records
+from abc import ABC, abstractmethod
+
+from registers import REG32, SREGS, FLAG_NAMES
+
+TRACE_HEADER = "START OF SIMULATION TRACE\n" + "=" * 60 + "\n\n"
+
+#Output modes
+MODE_FULL = "full"   #whole register file and all of memory, the original results.txt view
+MODE_DELTA = "delta" #only what changed since the previous record
+MODE_BINARY = "binary" #compressed binary records, see bintrace.py
+
+#Granularity: when a record is written
+AT_INSTR = "instr"   #every 'every' retired instructions
+AT_BRANCH = "branch" #after instructions that did not fall through (taken JMP/JNE, HLT)
+AT_FINAL = "final"   #final state only
+
+BUFFER_SIZE = 1 << 20
+
+def format_memory(mem, cache=None):
+    """
+    Memory section of the full view: defined bytes, four per row. With a
+    cache dict, the formatted cells of each page are kept and reused for as
+    long as the page contents and its defined mask stay the same.
+    """
+    if not mem:
+        return "  (No memory data)\n"
+    cells = []
+    for page_no in sorted(mem.pages):
+        page, mask = mem.pages[page_no], mem.defined[page_no]
+        hit = cache.get(page_no) if cache is not None else None
+        if hit is not None and hit[0] == page and hit[1] == mask:
+            cells += hit[2]
+            continue
+        page_cells = [f"{addr:8X}: {val:02X}   " for addr, val in mem.page_items(page_no)]
+        if cache is not None:
+            cache[page_no] = (bytes(page), bytes(mask), page_cells)
+        cells += page_cells
+    rows = ["".join(cells[i:i + 4]) for i in range(0, len(cells), 4)]
+    return "\n".join(rows).rstrip() + "\n\n"
+
+def format_state(state):
+    """Register part of a full record (EIP through the flags line)."""
+    eax, ecx, edx, ebx, esp, ebp, esi, edi = state.gpr
+    es, cs, ss, ds, fs, gs = state.sreg
+    mm = state.mm
+    flags = state.flags
+    return (
+        f"EIP: {state.eip:08X}\n"
+        f"EAX: {eax:08X} EBX: {ebx:08X} ECX: {ecx:08X} EDX: {edx:08X}\n"
+        f"ESP: {esp:08X} EBP: {ebp:08X} ESI: {esi:08X} EDI: {edi:08X}\n"
+        + " ".join(f"MM{i}:{mm[i]:016X}" for i in range(8)) + "\n"
+        f"CS: {cs:04X} DS: {ds:04X} ES: {es:04X} FS: {fs:04X} GS: {gs:04X} SS: {ss:04X}\n"
+        + " ".join(f"{name}:{flags[name]}" for name in FLAG_NAMES) + "\n"
+    )
+
+def format_full(state, mem, cache=None):
+    return format_state(state) + "-" * 20 + "\n" + "Memory:\n" + format_memory(mem, cache)
+
+
+class TraceSink(ABC):
+    """
+    Granularity handling shared by the trace writers. retire() is called once
+    per retired instruction and calls record(state, mem) when one is due;
+    final() records the end state unless the last record already shows it.
+    Subclasses must implement record() and set reads_written if they read
+    state.modified_mem (the translator only keeps it up to date for them).
+    """
+    reads_written = False
+
+    def __init__(self, at=AT_INSTR, every=1):
+        if at not in (AT_INSTR, AT_BRANCH, AT_FINAL):
+            raise ValueError(f"unknown trace granularity {at!r}")
+        if every < 1:
+            raise ValueError("trace interval must be at least 1")
+        self.at = at
+        self.every = every
+        self.countdown = every
+        self.retired = 0
+        self.records = 0
+        self.stale = True #instructions retired since the last record
+
+    def retire(self, state, mem, instr):
+        """Called after each retired instruction."""
+        self.retired += 1
+        self.stale = True
+        at = self.at
+        if at == AT_INSTR:
+            self.countdown -= 1
+            if self.countdown:
+                return
+            self.countdown = self.every
+        elif at == AT_BRANCH:
+            if state.eip == instr.eip_new:
+                return
+        else:
+            return
+        self.record(state, mem)
+
+    def final(self, state, mem):
+        """Writes the final state unless the last record already shows it."""
+        if self.stale:
+            self.record(state, mem)
+
+    @abstractmethod
+    def record(self, state, mem):
+        """Writes one record of the current state."""
+
+    def close(self):
+        pass
+
+
+class TraceWriter(TraceSink):
+    """
+    Text trace. Records go through one buffered file handle, optionally
+    drained by a background thread.
+
+    In delta mode a record lists EIP, the registers and flags that differ
+    from the previous record and the memory bytes written since then. The
+    written addresses come from state.modified_mem, which the writer drains
+    after each record.
+    """
+    def __init__(self, filename="results.txt", mode=MODE_FULL, at=AT_INSTR, every=1, threaded=False):
+        if mode not in (MODE_FULL, MODE_DELTA):
+            raise ValueError(f"unknown trace mode {mode!r}")
+        super().__init__(at, every)
+        self.mode = mode
+        self.reads_written = mode == MODE_DELTA
+        self.last = None     #delta mode: register values of the previous record
+        self.page_cells = {} #full mode: formatted memory cells per page, see format_memory()
+
+        self.f = open(filename, "w", buffering=BUFFER_SIZE)
+        self.queue = None
+        if threaded:
+            import threading, queue #only needed for the background writer
+            self.queue = queue.Queue(maxsize=1024)
+            self.thread = threading.Thread(target=self._drain, name="trace-writer", daemon=True)
+            self.thread.start()
+        self.emit(TRACE_HEADER)
+
+    def _drain(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            self.f.write(chunk)
+
+    def emit(self, text):
+        if self.queue is not None:
+            self.queue.put(text)
+        else:
+            self.f.write(text)
+
+    def record(self, state, mem):
+        self.records += 1
+        self.stale = False
+        if self.mode == MODE_FULL:
+            self.emit(format_full(state, mem, self.page_cells))
+        else:
+            self.emit(self._delta(state, mem))
+
+    def _delta(self, state, mem):
+        flags = state.flags
+        regs = (tuple(state.gpr), tuple(state.sreg), tuple(state.mm), tuple(flags[n] for n in FLAG_NAMES))
+        last = self.last
+        self.last = regs
+        gpr, sreg, mm, flag_vals = regs
+        lines = [f"EIP: {state.eip:08X}"]
+
+        cells = [f"{REG32[i].upper()}: {v:08X}" for i, v in enumerate(gpr) if last is None or last[0][i] != v]
+        cells += [f"{SREGS[i].upper()}: {v:04X}" for i, v in enumerate(sreg) if last is None or last[1][i] != v]
+        cells += [f"MM{i}:{v:016X}" for i, v in enumerate(mm) if last is None or last[2][i] != v]
+        if cells:
+            lines.append(" ".join(cells))
+        cells = [f"{FLAG_NAMES[i]}:{v}" for i, v in enumerate(flag_vals) if last is None or last[3][i] != v]
+        if cells:
+            lines.append(" ".join(cells))
+
+        written = state.modified_mem
+        if last is None:
+            lines.append("-" * 20)
+            lines.append("Memory:\n" + format_memory(mem).rstrip("\n"))
+        elif written:
+            cells = [f"{addr:8X}: {mem.read_bytes(addr, 1)[0]:02X}   " for addr in sorted(written)]
+            rows = ["".join(cells[i:i + 4]) for i in range(0, len(cells), 4)]
+            lines.append("Memory:\n" + "\n".join(rows).rstrip())
+        written.clear()
+        return "\n".join(lines) + "\n\n"
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
+        self.f.close()
@@ -0,0 +1,474 @@
+#Dynamic binary translation of hot basic blocks into generated Python code
+from struct import Struct
+
+from utils import sext, decode_modrm, ea_parts, get_operand_size
+from registers import SIZE_MASK, reg_slot
+from memory import PAGE_SHIFT, PAGE_SIZE, PAGE_MASK
+from execute import (bind, execute, generic_handler, exec_ADD, exec_MOV, exec_XCHG, exec_CMPXCHG,
+                     exec_JMP, exec_JNE, exec_HLT)
+from decoder import DecodeError
+
+HOT_THRESHOLD = 8     #block entries interpreted before the block gets translated
+MAX_BLOCK_INSTRS = 64 #long straight-line runs are split into several blocks
+MAX_RETRANSLATIONS = 4 #entries invalidated more often than this stay interpreted
+NO_LIMIT = 1 << 62    #iteration cap handed to self-looping blocks when there is no budget
+
+NO_PAGES = {}          #page table seen by blocks while hooks wrap mem.read/mem.write
+_U16, _U32 = Struct("<H"), Struct("<I")
+#Little endian page accessors for generated code: unpack<size>(page, off), pack<size>(page, off, val)
+PAGE_ACCESS = {"unpack2": _U16.unpack_from, "pack2": _U16.pack_into,
+               "unpack4": _U32.unpack_from, "pack4": _U32.pack_into}
+
+select_handler = generic_handler #same opcode priority as execute()
+
+def direct_pages(mem):
+    """mem.pages for inlined accesses, or no pages (all through Memory.read/write) while hooks wrap them."""
+    wrapped = vars(mem)
+    return NO_PAGES if "read" in wrapped or "write" in wrapped else mem.pages
+
+def is_terminator(handler):
+    return handler in (exec_JMP, exec_JNE, exec_HLT)
+
+
+class Block:
+    def __init__(self, entry, instrs, fn, source, loops):
+        self.entry = entry
+        self.instrs = instrs
+        self.n_instrs = len(instrs)
+        self.fn = fn
+        self.source = source
+        self.loops = loops #fn may run the block several times, count left in Translator.iters
+        self.succ = [None, None] #chained successor blocks, one per exit slot
+        self.valid = True
+
+
+class BlockEmitter:
+    """
+    Generates the source of one block. Guest GPRs live in locals r0..r7 for
+    the whole block; only the operands of the last flag producing instruction
+    are kept (fa, fb, fr) and state.flags is written once, at block exit, or
+    earlier if something in the block needs to see it. Memory accesses within
+    one page index the page's bytearray directly, see load() and store().
+    """
+    def __init__(self, instrs, carried=None, track_writes=False):
+        self.instrs = instrs
+        self.track_writes = track_writes #stores add to state.modified_mem
+        last = instrs[-1]
+        #A block whose JNE jumps back to its own entry spins inside the generated function
+        self.loops = (select_handler(last) is exec_JNE
+                      and (last.eip_new + sext(last.imm, 8)) & 0xFFFFFFFF == instrs[0].eip)
+        self.lines = []
+        self.used = set()      #GPR indices referenced by the block
+        self.pending = None    #(size, op) of the last flag producer not yet written to state.flags
+        self.depth = 2 if self.loops else 1 #indentation level of emitted lines
+        #Flag producer still pending when a looping block jumps back to its top;
+        #it has to be written out if iteration n > 1 exits before producing new flags
+        self.carried = carried
+        self.carried_live = self.loops
+        self.jne_pending = None
+        self.sites = []        #indices of the instructions that access memory
+        self.stores = []       #indices of the instructions that store, each keeps d<k> (see store())
+
+    #Operand helpers
+    def reg(self, idx, size):
+        g, shift, mask = reg_slot(idx, size)
+        self.used.add(g)
+        if size == 4:
+            return f"r{g}"
+        if shift:
+            return f"((r{g} >> {shift}) & {mask:#x})"
+        return f"(r{g} & {mask:#x})"
+
+    def set_reg(self, idx, val, size):
+        g, shift, mask = reg_slot(idx, size)
+        self.used.add(g)
+        if size == 4:
+            self.emit(f"r{g} = {val} & 0xFFFFFFFF")
+        elif shift:
+            self.emit(f"r{g} = (r{g} & {0xFFFFFFFF ^ (mask << shift):#x}) | (({val} & {mask:#x}) << {shift})")
+        else:
+            self.emit(f"r{g} = (r{g} & {0xFFFFFFFF ^ mask:#x}) | ({val} & {mask:#x})")
+
+    def addr(self, instr):
+        """Mirrors calc_effective_addr(): base + (index << scale) + disp + segment base."""
+        base, index, scale, disp, seg = ea_parts(instr)
+        terms = []
+        if base is not None:
+            terms.append(self.reg(base, 4))
+        if index is not None:
+            terms.append(f"({self.reg(index, 4)} << {scale})" if scale else self.reg(index, 4))
+        if disp:
+            terms.append(str(disp))
+        terms.append(f"seg[{seg}]")
+        return f"({' + '.join(terms)}) & 0xFFFFFFFF"
+
+    def emit(self, line):
+        self.lines.append("    " * self.depth + line)
+
+    def page_lookup(self, size, k, store):
+        """
+        Sets o<k>, pn<k> and p<k> for the access of instruction k: offset, page
+        number and the page holding [a, a + size), None if the access crosses
+        into the next one; for a store wp<k> is p<k> unless the page holds
+        decoded code. They are kept while a stays the same (t<k>), a loop
+        hitting one address looks its page up once. No page becomes a code
+        page while a block runs, nothing in it decodes.
+        """
+        self.sites.append(k)
+        self.emit(f"if a != t{k}:")
+        self.emit(f"    t{k} = a; o{k} = a & {PAGE_MASK:#x}; pn{k} = a >> {PAGE_SHIFT}")
+        self.emit(f"    p{k} = pages.get(pn{k})" if size == 1 else
+                  f"    p{k} = pages.get(pn{k}) if o{k} <= {PAGE_SIZE - size} else None")
+        if store:
+            self.emit(f"    wp{k} = p{k} if pn{k} not in code_pages else None")
+
+    def load(self, size, k, store=False):
+        """Inlined Memory.read() of a; with store=True the page lookup also serves a store() to a."""
+        self.page_lookup(size, k, store)
+        if size == 1:
+            return f"(p{k}[o{k}] if p{k} is not None else mem.read(a, 1))"
+        return f"(unpack{size}(p{k}, o{k})[0] if p{k} is not None else mem.read(a, {size}))"
+
+    def store(self, addr, val, size, k, next_eip, loaded=False):
+        """
+        Inlined write_mem(). A store within one page of data goes straight into
+        the page and its defined mask; page crossings, pages holding decoded
+        code and hooked memory take Memory.write. modified_mem is only kept
+        up to date with track_writes.
+        """
+        self.stores.append(k)
+        if addr != "a":
+            self.emit(f"a = {addr}")
+        if not loaded:
+            self.page_lookup(size, k, True)
+        if self.track_writes:
+            self.emit("modified.add(a)" if size == 1 else f"modified.update(range(a, a + {size}))")
+        val_masked = f"{val & SIZE_MASK[size]:#x}" if isinstance(val, int) else f"{val} & {SIZE_MASK[size]:#x}"
+        if size == 1:
+            direct, mark = f"wp{k}[o{k}] = {val_masked}", f"defined[pn{k}][o{k}] = 1"
+        else:
+            direct = f"pack{size}(wp{k}, o{k}, {val_masked})"
+            mark = f"pack{size}(defined[pn{k}], o{k}, {int.from_bytes(bytes([1]) * size, 'little'):#x})"
+        self.emit(f"if wp{k} is not None:")
+        self.emit(f"    {direct}")
+        self.emit(f"    if a != d{k}: {mark}; d{k} = a") #a loop storing to the same address marks it once
+        self.emit("else:")
+        self.emit(f"    mem.write(a, {val}, {size})")
+        if k + 1 < len(self.instrs) or self.loops:
+            #A store may have overwritten code translated into this very block
+            done = f"(n - 1) * {len(self.instrs)} + {k + 1}" if self.loops else k + 1
+            self.emit("    if tr.dirty:")
+            self.emit(f"        @FLUSH@; {self.flags_stmt()}st.eip = {next_eip:#x}; tr.partial = {done}; return -1")
+
+    def flags_stmt(self):
+        if self.pending is not None:
+            size, op = self.pending
+            return f"st.flags.record(fa, fb, fr, {size}, {op!r}); "
+        if self.carried_live and self.carried:
+            size, op = self.carried
+            return f"n > 1 and st.flags.record(fa, fb, fr, {size}, {op!r}); "
+        return ""
+
+    def produce_flags(self, a, b, size, op):
+        self.emit(f"fa = {a}; fb = {b}; fr = fa {'+' if op == 'add' else '-'} fb")
+        self.pending = (size, op)
+        self.carried_live = False
+
+    def materialize_flags(self):
+        stmt = self.flags_stmt()
+        if stmt:
+            self.emit(stmt.rstrip("; "))
+        self.pending = None
+        self.carried_live = False
+
+    #Instruction templates
+    def gen_ADD(self, instr, k):
+        op = instr.opcode
+        size = get_operand_size(op, instr.prefix_mux)
+        mod, reg, rm = decode_modrm(instr.modrm)
+        if op in (0x04, 0x05):
+            self.produce_flags(self.reg(0, size), instr.imm, size, "add")
+            self.set_reg(0, "fr", size)
+            return
+        if op in (0x80, 0x81, 0x83):
+            src = sext(instr.imm, 8) if op == 0x83 else instr.imm
+        elif op in (0x00, 0x01, 0x02, 0x03):
+            src = self.reg(reg, size)
+        if mod != 0b11:
+            self.emit(f"a = {self.addr(instr)}")
+            rm_val = self.load(size, k, store=op not in (0x02, 0x03))
+        else:
+            rm_val = self.reg(rm, size)
+        if op in (0x02, 0x03):
+            self.produce_flags(self.reg(reg, size), rm_val, size, "add")
+            self.set_reg(reg, "fr", size)
+        elif mod == 0b11:
+            self.produce_flags(rm_val, src, size, "add")
+            self.set_reg(rm, "fr", size)
+        else:
+            self.produce_flags(rm_val, src, size, "add")
+            self.store("a", "fr", size, k, instr.eip_new, loaded=True)
+
+    def gen_MOV(self, instr, k):
+        op = instr.opcode
+        size = get_operand_size(op, instr.prefix_mux)
+        if 0xB0 <= op <= 0xBF:
+            self.set_reg(op & 0x07, instr.imm, 1 if op <= 0xB7 else size)
+            return True
+        if op in (0xC6, 0xC7):
+            mod, reg, rm = decode_modrm(instr.modrm)
+            if mod == 0b11:
+                self.set_reg(rm, instr.imm, size)
+            else:
+                self.store(self.addr(instr), instr.imm, size, k, instr.eip_new)
+            return True
+        return False #segment and MMX moves go through the interpreter
+
+    def gen_XCHG(self, instr, k):
+        mod, reg, rm = decode_modrm(instr.modrm)
+        self.emit(f"v = {self.reg(reg, 1)}")
+        if mod == 0b11:
+            self.emit(f"w = {self.reg(rm, 1)}")
+            self.set_reg(rm, "v", 1)
+        else:
+            self.emit(f"a = {self.addr(instr)}")
+            self.emit(f"w = {self.load(1, k, store=True)}")
+            self.set_reg(reg, "w", 1) #before the store so an early exit sees it
+            self.store("a", "v", 1, k, instr.eip_new, loaded=True)
+            return
+        self.set_reg(reg, "w", 1)
+
+    def gen_CMPXCHG(self, instr, k):
+        mod, reg, rm = decode_modrm(instr.modrm)
+        size = get_operand_size(instr.opcode, instr.prefix_mux)
+        if mod != 0b11:
+            self.emit(f"a = {self.addr(instr)}")
+            dest = self.load(size, k, store=True)
+        else:
+            dest = self.reg(rm, size)
+        self.emit(f"s = {self.reg(reg, size)}")
+        self.produce_flags(self.reg(0, size), dest, size, "sub")
+        self.emit("if fa == fb:")
+        self.depth += 1
+        if mod == 0b11:
+            self.set_reg(rm, "s", size)
+        else:
+            self.store("a", "s", size, k, instr.eip_new, loaded=True)
+        self.depth -= 1
+        self.emit("else:")
+        self.depth += 1
+        self.set_reg(0, "fb", size)
+        self.depth -= 1
+
+    def gen_fallback(self, k):
+        """Runs instruction k through the interpreter with state flushed."""
+        self.materialize_flags()
+        self.emit(f"@FLUSH@; st.eip = {self.instrs[k].eip:#x}")
+        self.emit(f"HANDLERS[{k}](st, mem)")
+        self.emit("@RELOAD@")
+
+    def gen_JNE(self, instr):
+        self.jne_pending = self.pending
+        if self.pending is not None:
+            size, op = self.pending
+            zf_clear = f"fr & {SIZE_MASK[size]:#x}"
+        else:
+            zf_clear = 'st.flags["ZF"] == 0'
+        if self.loops:
+            self.emit(f"if {zf_clear} and n < limit:")
+            self.emit("    continue")
+            self.emit("break")
+            self.depth = 1
+            self.emit("tr.iters = n")
+        self.materialize_flags()
+        self.emit("@FLUSH@")
+        taken = (instr.eip_new + sext(instr.imm, 8)) & 0xFFFFFFFF
+        self.emit(f"if {zf_clear}:")
+        self.emit(f"    st.eip = {taken:#x}; return 0")
+        self.emit(f"st.eip = {instr.eip_new:#x}; return 1")
+
+    def build(self, name):
+        if self.loops and self.carried is None:
+            probe = BlockEmitter(self.instrs, carried=False, track_writes=self.track_writes)
+            probe.build(name)
+            self.carried = probe.jne_pending
+        handlers = []
+        for k, instr in enumerate(self.instrs):
+            handler = select_handler(instr)
+            handlers.append(handler)
+            self.emit(f"# {instr.eip:#x}: opcode {instr.opcode:#x}")
+            if handler is exec_JNE:
+                self.gen_JNE(instr)
+            elif handler is exec_ADD:
+                self.gen_ADD(instr, k)
+            elif handler is exec_XCHG:
+                self.gen_XCHG(instr, k)
+            elif handler is exec_CMPXCHG:
+                self.gen_CMPXCHG(instr, k)
+            elif handler is exec_MOV and self.gen_MOV(instr, k):
+                pass
+            elif handler is None:
+                self.emit("pass # unsupported opcode, skipped like execute() does")
+            else:
+                self.gen_fallback(k)
+
+        last = handlers[-1]
+        if last is not exec_JNE:
+            self.materialize_flags()
+            self.emit("@FLUSH@")
+            if not is_terminator(last):
+                self.emit(f"st.eip = {self.instrs[-1].eip_new:#x}")
+            self.emit("return 0")
+
+        regs = sorted(self.used)
+        flush = "; ".join(f"gpr[{i}] = r{i}" for i in regs) or "pass"
+        reload = "; ".join(f"r{i} = gpr[{i}]" for i in regs) or "pass"
+        body = [l.replace("@FLUSH@", flush).replace("@RELOAD@", reload) for l in self.lines]
+        head = [f"def {name}(st, mem, limit):", "    gpr = st.gpr; seg = st.seg_base"]
+        if self.sites:
+            head.append("    pages = direct_pages(mem); " + " = ".join(f"t{k}" for k in self.sites) + " = -1")
+        if self.stores:
+            head.append("    defined = mem.defined; code_pages = mem.code_pages; " + " = ".join(f"d{k}" for k in self.stores) + " = -1")
+            if self.track_writes:
+                head.append("    modified = st.modified_mem")
+        if regs:
+            head.append("    " + reload)
+        if self.loops:
+            head += ["    n = 0", "    while True:", "        n += 1"]
+        return "\n".join(head + body) + "\n"
+
+
+class Translator:
+    """
+    Translation tier on top of a DecodeCache. Block entries are counted while
+    interpreting; once an entry is hot its basic block (ending at JMP/JNE/HLT)
+    is compiled to a Python function, cached by entry EIP and chained to the
+    blocks it exits to. Translated stores only add to state.modified_mem
+    with track_writes set (delta and binary traces read it); changing it
+    throws the translated blocks away.
+    """
+    def __init__(self, cache, threshold=HOT_THRESHOLD, track_writes=False):
+        self.cache = cache
+        self.threshold = threshold
+        self._track_writes = track_writes
+        self.blocks = {}       #entry eip -> Block
+        self.instr_blocks = {} #instruction eip -> set of Blocks containing it
+        self.entry_counts = {}
+        self.invalidations = {} #entry eip -> times its block was thrown away
+        self.dirty = False     #set when a translated block is invalidated
+        self.partial = 0       #instructions retired by a block that exited early
+        self.iters = 1         #iterations run by the last self-looping block
+        cache.drop_listeners.append(self.invalidate)
+
+    @property
+    def track_writes(self):
+        return self._track_writes
+
+    @track_writes.setter
+    def track_writes(self, track):
+        if track != self._track_writes:
+            self._track_writes = track
+            self.clear()
+
+    def clear(self):
+        """Throws every translated block away; entries are translated again once hot."""
+        for blks in self.instr_blocks.values():
+            for blk in blks:
+                blk.valid = False
+        self.blocks.clear()
+        self.instr_blocks.clear()
+
+    def invalidate(self, eip):
+        for blk in self.instr_blocks.pop(eip, ()):
+            if blk.valid:
+                blk.valid = False
+                self.dirty = True
+                if self.blocks.get(blk.entry) is blk:
+                    del self.blocks[blk.entry]
+                self.invalidations[blk.entry] = self.invalidations.get(blk.entry, 0) + 1
+                self.entry_counts[blk.entry] = 0
+
+    def translate(self, entry):
+        instrs = []
+        eip = entry
+        while len(instrs) < MAX_BLOCK_INSTRS:
+            try:
+                instr = self.cache.fetch(eip)
+            except DecodeError:
+                if not instrs:
+                    raise
+                break #the interpreter reports it if execution gets there
+            instrs.append(instr)
+            if is_terminator(select_handler(instr)):
+                break
+            eip = instr.eip_new
+
+        name = f"block_{entry:08x}"
+        emitter = BlockEmitter(instrs, track_writes=self._track_writes)
+        source = emitter.build(name)
+        namespace = {
+            "tr": self,
+            "direct_pages": direct_pages,
+            **PAGE_ACCESS,
+            "HANDLERS": tuple(instr.handler or bind(instr) for instr in instrs),
+        }
+        exec(compile(source, f"<{name}>", "exec"), namespace)
+
+        blk = Block(entry, instrs, namespace[name], source, emitter.loops)
+        self.blocks[entry] = blk
+        for instr in instrs:
+            self.instr_blocks.setdefault(instr.eip, set()).add(blk)
+        return blk
+
+    def interpret_region(self, state, mem, budget, may_translate=True):
+        """Interprets from state.eip up to and including the next terminator."""
+        entry = state.eip
+        if may_translate:
+            count = self.entry_counts.get(entry, 0) + 1
+            self.entry_counts[entry] = count
+            if count >= self.threshold and self.invalidations.get(entry, 0) <= MAX_RETRANSLATIONS:
+                self.translate(entry)
+                return 0
+
+        retired = 0
+        while not state.halted and (budget is None or retired < budget):
+            instr = self.cache.fetch(state.eip)
+            execute(instr, state, mem)
+            retired += 1
+            if is_terminator(select_handler(instr)):
+                break
+        return retired
+
+    def run(self, state, mem, max_instrs=None):
+        """Same contract as isl.run(): returns instructions retired."""
+        retired = 0
+        blk = None
+        while not state.halted:
+            budget = None if max_instrs is None else max_instrs - retired
+            if budget == 0:
+                break
+            if blk is None:
+                blk = self.blocks.get(state.eip)
+            if blk is None:
+                retired += self.interpret_region(state, mem, budget)
+                continue
+            if budget is not None and blk.n_instrs > budget: #finish the run instruction by instruction
+                retired += self.interpret_region(state, mem, budget, may_translate=False)
+                blk = None
+                continue
+
+            self.dirty = False
+            limit = NO_LIMIT if budget is None else budget // blk.n_instrs
+            slot = blk.fn(state, mem, limit)
+            if slot < 0: #stopped early after writing to translated code
+                retired += self.partial
+                blk = None
+                continue
+            retired += blk.n_instrs * self.iters if blk.loops else blk.n_instrs
+
+            nxt = blk.succ[slot]
+            if nxt is None or not nxt.valid:
+                nxt = self.blocks.get(state.eip)
+                blk.succ[slot] = nxt
+            blk = nxt
+        return retired
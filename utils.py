@@ -1,8 +1,6 @@
 # utils.py
 
-REG32 = ["eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"]
-REG8  = ["al", "cl", "dl", "bl", "ah", "ch", "dh", "bh"]
-SREGS = ["es", "cs", "ss", "ds", "fs", "gs"]
+from registers import REG32, REG8, SREGS, ESP, EBP, SS, DS, read_reg, write_reg
 
 def sext(value, bits):
     """Sign extend value from 'bits' to 32 bits."""
@@ -16,134 +14,86 @@ def decode_modrm(modrm_byte):
     return mod, reg, rm
 
 def get_reg_val(state, reg_idx, size):
-    # Standard x86 GPR mapping
-    names = ["eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"]
-    reg_name = names[reg_idx]
-    
-    # Use getattr to pull the value from the class attribute (e.g., state.eax)
-    val = getattr(state, reg_name)
-
-    if size == 1:
-        return val & 0xFF        # AL, CL, DL, BL...
-    if size == 2:
-        return val & 0xFFFF      # AX, CX, DX, BX...
-    return val & 0xFFFFFFFF      # EAX, ECX, EDX, EBX...
+    """GPR reg_idx as an operand of 'size' bytes (8-bit: AL CL DL BL AH CH DH BH)."""
+    return read_reg(state, reg_idx, size)
 
 def write_reg_val(state, reg_idx, val, size):
-    names = ["eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"]
-    reg_name = names[reg_idx]
-    
-    if size == 4:
-        setattr(state, reg_name, val & 0xFFFFFFFF)
-    elif size == 2:
-        # Preserve upper 16 bits of the 32-bit register
-        current = getattr(state, reg_name)
-        new_val = (current & 0xFFFF0000) | (val & 0xFFFF)
-        setattr(state, reg_name, new_val)
-    elif size == 1:
-        # Preserve upper 24 bits
-        current = getattr(state, reg_name)
-        new_val = (current & 0xFFFFFF00) | (val & 0xFF)
-        setattr(state, reg_name, new_val)
-        
+    """Writes the low 'size' bytes of val to the sub-register, the rest of the GPR is kept."""
+    write_reg(state, reg_idx, val, size)
+
 def read_mem(mem, addr, size):
-    res = 0
-    for i in range(size):
-        current_addr = addr + i
-        
-        # If the address is missing, initialize it to "00"
-        if current_addr not in mem:
-            mem[current_addr] = "00"
-            
-        # Get the value (now guaranteed to exist)
-        val_str = mem[current_addr]
-        
-        # Convert hex string to int and shift it into the correct byte position
-        res |= int(val_str, 16) << (8 * i)
-        
-    return res
+    """Little endian read from guest memory (untouched bytes read as 0)."""
+    return mem.read(addr, size)
 
 def write_mem(mem, addr, val, size, state):
     """Writes to memory and tracks the address in state."""
-    for i in range(size):
-        phys_addr = addr + i
-        mem[phys_addr] = f"{(val >> (8 * i)) & 0xFF:02X}"
-        state.modified_mem.add(phys_addr)
+    mem.write(addr, val, size)
+    state.modified_mem.update(range(addr, addr + size))
 
 def update_flags(flags, a, b, res, size, op="add"):
-    # 1. Setup Masks
-    mask = (1 << (size * 8)) - 1
-    sign_bit = 1 << (size * 8 - 1)
-    
-    a_m = a & mask
-    b_m = b & mask
-    res_m = res & mask
-
-    flags["ZF"] = 1 if res_m == 0 else 0
-    flags["SF"] = 1 if (res_m & sign_bit) else 0
-
-    lsb = res_m & 0xFF
-    flags["PF"] = 1 if (bin(lsb).count('1') % 2 == 0) else 0
-
-    flags["AF"] = 1 if ((a_m ^ b_m ^ res_m) & 0x10) else 0
-
-    if op == "add":
-        flags["CF"] = 1 if res_m < a_m else 0 # Or: (res > mask)
-        
-        flags["OF"] = 1 if ((a_m ^ res_m) & (b_m ^ res_m) & sign_bit) else 0
-
-    elif op == "sub" or op == "cmp":
-        flags["CF"] = 1 if a_m < b_m else 0
-        flags["OF"] = 1 if ((a_m ^ b_m) & (a_m ^ res_m) & sign_bit) else 0
-    
+    """
+    Records a flag producing result. Nothing is computed here: state.flags
+    (LazyFlags) derives ZF/SF/PF/AF/CF/OF from the record when they are read.
+    """
+    flags.record(a, b, res, size, op)
     return flags
 
-def get_segment_for_instr(rm_index, prefix_mux, state):
+def get_segment_for_instr(base, instr):
     """
-    Determines which segment register to use based on the base register 
-    and segment override prefixes.
+    Segment register number for a memory operand: the override prefix if
+    there is one, else SS for ESP/EBP based addressing and DS otherwise.
+    base is the r/m (or SIB base) register, None for a SIB operand without
+    base; without a SIB byte, mod 00 rm 101 (disp32 only) counts as EBP and so
+    uses SS.
     """
-    # 1. Check for Segment Override Prefix (prefix_mux[0])
-    # Note: If your decoder stores the specific override (e.g., 0x26 for ES), 
-    # you would use that. For this assignment, we simplify.
-    
-    # 2. Check for Stack-based access (EBP is index 5, ESP is index 4)
-    # If rm is 4 (ESP) or 5 (EBP), use SS. Otherwise use DS.
-    if rm_index in (4, 5):
-        return state.ss
-    else:
-        return state.ds
+    if instr.seg_override is not None:
+        return instr.seg_override
+    return SS if base in (ESP, EBP) else DS
 
-def calc_effective_addr(instr, state):
+def ea_parts(instr):
     """
-    Computes: [Base + Displacement + (Segment << 16)]
-    Supports ModR/M Base+Displacement (no SIB).
+    The memory operand of instr as (base, index, scale, disp, seg): base and
+    index are GPR numbers or None, the address is
+    base + (index << scale) + disp + (seg << 16).
     """
     mod, reg, rm = decode_modrm(instr.modrm)
-    
-    # Get the base register value
-    # Case: mod 00, rm 101 is Displacement-only (disp32) in x86
-    if mod == 0b00 and rm == 0b101:
-        base_val = 0
+    index, scale = None, 0
+    if rm == 0b100: #SIB: scale[7:6] index[5:3] base[2:0]
+        sib = instr.sib
+        scale = sib >> 6
+        index = (sib >> 3) & 0b111
+        if index == ESP: #no index
+            index = None
+        base = sib & 0b111
+        if mod == 0b00 and base == EBP: #disp32, no base
+            base = None
+        seg = get_segment_for_instr(base, instr)
     else:
-        base_reg_name = REG32[rm]
-        base_val = getattr(state, base_reg_name)
+        base = None if (mod == 0b00 and rm == 0b101) else rm
+        seg = get_segment_for_instr(rm, instr)
 
     # Displacement logic based on Mod
     disp = 0
     if mod == 0b01:   # 8-bit displacement
         disp = sext(instr.disp, 8)
-    elif mod == 0b10: # 32-bit displacement
-        disp = instr.disp
-    elif mod == 0b00 and rm == 0b101: # Absolute 32-bit disp
+    elif mod == 0b10 or base is None: # 32-bit displacement / absolute disp32
         disp = instr.disp
+    return base, index, scale, disp, seg
+
+def calc_effective_addr(instr, state):
+    """
+    Computes: [Base + (Index << Scale) + Displacement + (Segment << 16)]
+    The segment part comes from state.seg_base, kept up to date by write_sreg().
+    """
+    base, index, scale, disp, seg = ea_parts(instr)
+    eff_addr = disp + state.seg_base[seg]
+    if base is not None:
+        eff_addr += state.gpr[base]
+    if index is not None:
+        eff_addr += state.gpr[index] << scale
 
-    # Segment selection
-    seg_val = get_segment_for_instr(rm, instr.prefix_mux, state)
-    
     # Final 32-bit Address Calculation
-    eff_addr = (base_val + disp + (seg_val << 16)) & 0xFFFFFFFF
-    return eff_addr
+    return eff_addr & 0xFFFFFFFF
 
 def get_operand_size(opcode, prefix_mux):
     """
@@ -208,7 +158,7 @@ def write_results1(state, mem, filename="results.txt"):
                 # Build the hex string for the 4-byte block
                 bytes_str = ""
                 for i in range(4):
-                    bytes_str += f"{mem.get(base_addr + i, '00')} "
+                    bytes_str += f"{mem.read(base_addr + i, 1):02X} "
                 
                 f.write(f"  [0x{base_addr:04X}]: {bytes_str.strip()}\n")
                 printed_rows.add(base_addr)
@@ -218,52 +168,9 @@ def write_results1(state, mem, filename="results.txt"):
 def write_results(state, mem, filename="results.txt"):
     """
     Formats the CPU state and modified memory into the requested compact view.
-    Appends to results.txt.
+    Appends to results.txt. (Runs use trace_writer.TraceWriter, which keeps the
+    file open; this is the one-off version of its full mode record.)
     """
+    from trace_writer import format_full
     with open(filename, "a") as f:
-        # Instruction Pointer
-        f.write(f"EIP: {state.eip:08X}\n")
-
-        # General Purpose Registers
-        f.write(f"EAX: {state.eax:08X} EBX: {state.ebx:08X} ECX: {state.ecx:08X} EDX: {state.edx:08X}\n")
-        f.write(f"ESP: {state.esp:08X} EBP: {state.ebp:08X} ESI: {state.esi:08X} EDI: {state.edi:08X}\n")
-
-        # MMX Registers (All on one line as requested)
-        mm_regs = [
-            f"MM0:{state.mm0:016X}", f"MM1:{state.mm1:016X}", f"MM2:{state.mm2:016X}", f"MM3:{state.mm3:016X}",
-            f"MM4:{state.mm4:016X}", f"MM5:{state.mm5:016X}", f"MM6:{state.mm6:016X}", f"MM7:{state.mm7:016X}"
-        ]
-        f.write(" ".join(mm_regs) + "\n")
-
-        # Segment Registers
-        f.write(f"CS: {state.cs:04X} DS: {state.ds:04X} ES: {state.es:04X} FS: {state.fs:04X} GS: {state.gs:04X} SS: {state.ss:04X}\n")
-
-        # Individual Flags
-        flags = state.flags
-        f.write(f"CF:{flags['CF']} PF:{flags['PF']} AF:{flags['AF']} ZF:{flags['ZF']} SF:{flags['SF']} DF:{flags['DF']} OF:{flags['OF']}\n")
-        
-        f.write("-" * 20 + "\n")
-
-        # Memory Section
-        f.write("Memory:\n")
-        if not mem:
-            f.write("  (No memory data)\n")
-        else:
-            sorted_addrs = sorted(mem.keys())
-            m_str = ""
-            for i, addr in enumerate(sorted_addrs):
-                val = mem[addr]
-                
-                # If it's a string, convert from hex (base 16)
-                # If it's already an int, use it directly
-                if isinstance(val, str):
-                    val_int = int(val, 16) 
-                else:
-                    val_int = val
-                
-                m_str += f"{addr:8X}: {val_int:02X}   "
-                
-                if (i + 1) % 4 == 0:
-                    m_str += "\n"
-            
-            f.write(m_str.rstrip() + "\n\n")
\ No newline at end of file
+        f.write(format_full(state, mem))